@@ -0,0 +1,312 @@
+import base64
+import datetime
+import functools
+import logging
+import os
+import pathlib
+import threading
+import time
+from collections.abc import Callable
+
+import googleapiclient
+from google.oauth2.service_account import Credentials
+from googleapiclient.discovery import build
+
+from informa.lib import PluginAdapter
+
+GMAIL_SCOPES = ('https://www.googleapis.com/auth/gmail.modify',)
+GMAIL_SUBJECT = 'm@mafro.net'
+
+# Headers fetched when listing messages; bodies and attachments are fetched only when needed
+METADATA_HEADERS = ['From', 'To', 'Subject', 'Date']
+
+# Gmail recommends batches of no more than 50 requests
+BATCH_SIZE = 50
+
+# Requests in a batch which are rate limited or fail server-side are retried with exponential backoff,
+# capped at a few seconds in total as syncs run from scheduled tasks
+BATCH_RETRIES = 4
+BATCH_BACKOFF = 0.5
+BATCH_RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class AttachmentSaveError(Exception):
+    pass
+
+
+class Attachment:
+    'An attachment on a Gmail message, downloaded when saved'
+
+    def __init__(self, gmail: 'Gmail', message_id: str, part: dict):
+        self.gmail = gmail
+        self.message_id = message_id
+        self.attachment_id = part['body'].get('attachmentId')
+        self.filename = part['filename']
+        self.mime_type = part['mimeType']
+        self._data = part['body'].get('data')
+
+    def download(self) -> bytes:
+        if self._data is None:
+            self._data = self.gmail.execute(
+                self.gmail.users
+                .messages()
+                .attachments()
+                .get(userId='me', messageId=self.message_id, id=self.attachment_id)
+            )['data']
+        return base64.urlsafe_b64decode(self._data)
+
+    def save(self, filepath: str | None = None, overwrite: bool = False):
+        path = pathlib.Path(filepath or self.filename)
+        if path.exists() and not overwrite:
+            raise AttachmentSaveError(f'{path} already exists')
+
+        try:
+            path.write_bytes(self.download())
+        except googleapiclient.errors.HttpError as e:
+            raise AttachmentSaveError(f'Failed downloading {self.filename}: {e}') from e
+
+
+class Message:
+    '''
+    A Gmail message, created from metadata only. The body and attachments are fetched on first access,
+    unless already fetched in a batch via Gmail.fetch.
+    '''
+
+    def __init__(self, gmail: 'Gmail', data: dict, full: bool = False):
+        self.gmail = gmail
+        self.id = data['id']
+        self.thread_id = data.get('threadId')
+        self.history_id = data.get('historyId')
+        self.label_ids = data.get('labelIds', [])
+        self.snippet = data.get('snippet')
+        self.date = datetime.datetime.fromtimestamp(int(data['internalDate']) / 1000, tz=datetime.UTC)
+        self.headers = {h['name']: h['value'] for h in data['payload'].get('headers', [])}
+        self._payload = data['payload'] if full else None
+
+    def __repr__(self):
+        return f'Message({self.id}, {self.date:%Y-%m-%d}, {self.subject!r})'
+
+    @property
+    def subject(self) -> str | None:
+        return self.headers.get('Subject')
+
+    @property
+    def sender(self) -> str | None:
+        return self.headers.get('From')
+
+    @property
+    def loaded(self) -> bool:
+        return self._payload is not None
+
+    def load(self, data: dict):
+        self._payload = data['payload']
+
+    @property
+    def payload(self) -> dict:
+        if self._payload is None:
+            self.gmail.fetch([self])
+        return self._payload
+
+    def _parts(self, part: dict | None = None):
+        'Walk the MIME tree of the message'
+        part = part or self.payload
+        yield part
+        for child in part.get('parts', []):
+            yield from self._parts(child)
+
+    def _body(self, mime_type: str) -> str | None:
+        for part in self._parts():
+            if part['mimeType'] == mime_type and not part.get('filename') and 'data' in part['body']:
+                return base64.urlsafe_b64decode(part['body']['data']).decode('utf8', errors='replace')
+        return None
+
+    @property
+    def html(self) -> str | None:
+        return self._body('text/html')
+
+    @property
+    def plain(self) -> str | None:
+        return self._body('text/plain')
+
+    @property
+    def attachments(self) -> list[Attachment]:
+        return [Attachment(self.gmail, self.id, part) for part in self._parts() if part.get('filename')]
+
+    def has_attachments(self) -> bool:
+        return bool(self.attachments)
+
+    def mark_as_read(self):
+        self.gmail.execute(
+            self.gmail.users.messages().modify(userId='me', id=self.id, body={'removeLabelIds': ['UNREAD']})
+        )
+        if 'UNREAD' in self.label_ids:
+            self.label_ids.remove('UNREAD')
+
+
+class Gmail:
+    '''
+    Gmail API client, listing messages by metadata and fetching bodies in batches.
+
+    The underlying HTTP client isn't thread-safe, so requests are serialised on a lock.
+    '''
+
+    def __init__(self, credentials: Credentials):
+        self.service = build('gmail', 'v1', credentials=credentials, cache_discovery=False)
+        self.users = self.service.users()
+        self._lock = threading.Lock()
+
+    def execute(self, request) -> dict:
+        with self._lock:
+            return request.execute()
+
+    def search(self, query: str) -> list[str]:
+        'IDs of messages matching query, newest first'
+        ids = []
+        page_token = None
+
+        while True:
+            resp = self.execute(self.users.messages().list(userId='me', q=query, pageToken=page_token))
+            ids.extend(m['id'] for m in resp.get('messages', []))
+            page_token = resp.get('nextPageToken')
+            if not page_token:
+                return ids
+
+    def get_messages(self, query: str) -> list[Message]:
+        'Messages matching query, with metadata only'
+        return self.get_metadata(self.search(query))
+
+    def get_metadata(self, ids: list[str]) -> list[Message]:
+        'Messages by ID, with metadata only'
+        responses = self._batch(
+            ids,
+            lambda id_: self.users.messages().get(
+                userId='me', id=id_, format='metadata', metadataHeaders=METADATA_HEADERS
+            ),
+        )
+        return [Message(self, responses[id_]) for id_ in ids]
+
+    def fetch(self, messages: list[Message]):
+        'Fetch the full body of messages not yet loaded'
+        pending = [m for m in messages if not m.loaded]
+        responses = self._batch([m.id for m in pending], lambda id_: self.users.messages().get(userId='me', id=id_))
+        for message in pending:
+            message.load(responses[message.id])
+
+    def added_since(self, history_id: str) -> tuple[set[str], str] | None:
+        '''
+        IDs of messages added to the mailbox, or marked unread again, since history_id
+
+        Returns:
+            Message IDs and the mailbox's current historyId, or None if history_id is too old to sync from
+        '''
+        ids = set()
+        page_token = None
+
+        while True:
+            try:
+                resp = self.execute(
+                    self.users.history().list(
+                        userId='me',
+                        startHistoryId=history_id,
+                        historyTypes=['messageAdded', 'labelAdded'],
+                        pageToken=page_token,
+                    )
+                )
+            except googleapiclient.errors.HttpError as e:
+                if e.resp.status == 404:
+                    return None
+                raise
+
+            for history in resp.get('history', []):
+                ids.update(added['message']['id'] for added in history.get('messagesAdded', []))
+                ids.update(
+                    labelled['message']['id']
+                    for labelled in history.get('labelsAdded', [])
+                    if 'UNREAD' in labelled.get('labelIds', [])
+                )
+
+            page_token = resp.get('nextPageToken')
+            if not page_token:
+                return ids, resp['historyId']
+
+    def sync(self, query: str, history_id: str | None = None) -> tuple[list[Message], str]:
+        '''
+        Messages matching query which were added since history_id, or all matching messages without one
+
+        Params:
+            query:       Gmail search query
+            history_id:  historyId returned by a previous sync
+        Returns:
+            Messages, with metadata only, and the historyId to sync from next time
+        '''
+        if history_id and (changes := self.added_since(history_id)) is not None:
+            added, latest = changes
+            if not added:
+                return [], latest
+            return self.get_metadata([id_ for id_ in self.search(query) if id_ in added]), latest
+
+        # Read the historyId before searching, so no message can fall between the two
+        latest = self.execute(self.users.getProfile(userId='me'))['historyId']
+        return self.get_messages(query), latest
+
+    def _batch(self, ids: list[str], make_request: Callable) -> dict[str, dict]:
+        '''
+        Execute a request per ID in batches, returning responses keyed by ID
+
+        Requests which fail with a rate limit or server error are retried alone with exponential backoff,
+        so the rest of the batch isn't fetched again. The backoff sleeps, blocking the caller for up to
+        3.5s in total.
+        '''
+        responses = {}
+        failed = {}
+
+        def callback(request_id, response, exception):
+            if exception:
+                failed[request_id] = exception
+            else:
+                responses[request_id] = response
+
+        pending = list(ids)
+
+        for attempt in range(BATCH_RETRIES):
+            failed.clear()
+
+            for i in range(0, len(pending), BATCH_SIZE):
+                batch = self.service.new_batch_http_request(callback=callback)
+                for id_ in pending[i : i + BATCH_SIZE]:
+                    batch.add(make_request(id_), request_id=id_)
+                self.execute(batch)
+
+            for exception in failed.values():
+                if not _retriable(exception):
+                    raise exception
+
+            if not failed:
+                return responses
+
+            pending = list(failed)
+            if attempt < BATCH_RETRIES - 1:
+                time.sleep(BATCH_BACKOFF * 2**attempt)
+
+        raise next(iter(failed.values()))
+
+
+def _retriable(exception: Exception) -> bool:
+    return isinstance(exception, googleapiclient.errors.HttpError) and exception.resp.status in BATCH_RETRY_STATUSES
+
+
+@functools.cache
+def _gmail(credentials_file: str, subject: str) -> Gmail:
+    return Gmail(Credentials.from_service_account_file(credentials_file, scopes=GMAIL_SCOPES, subject=subject))
+
+
+def get_gmail(logger: logging.Logger | PluginAdapter, subject: str = GMAIL_SUBJECT) -> Gmail | None:
+    'Return a Gmail client, shared by all plugins, authenticating on first use'
+    try:
+        return _gmail(os.environ.get('GSUITE_OAUTH_CREDS'), subject)
+    except TypeError:
+        logger.error('Bad SSH private key defined in GSUITE_OAUTH_CREDS')
+        return None
+    except googleapiclient.errors.HttpError:
+        logger.error('Failed to authenticate to the Google API')
+        return None
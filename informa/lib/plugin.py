@@ -25,6 +25,8 @@ from paho.mqtt import client as mqtt
 from paho.mqtt import publish as mqtt_publish
 from paho.mqtt.enums import CallbackAPIVersion
 from pydantic import BaseModel
+from rocketry.args import Task
+from rocketry.core import BaseCondition
 
 from informa.exceptions import AppError, PluginRequiresConfigError, StateJsonDecodeError
 from informa.lib import ConfigBase, PluginAdapter, StateBase
@@ -32,11 +34,51 @@ from informa.lib.utils import now_aest, raise_alarm
 
 F = TypeVar('F', bound=Callable[..., Any])
 
+# Given the plugin and the task's last run, return when the task should next run, or None if not scheduled
+NextFireProvider = Callable[['InformaPlugin', datetime.datetime | None], datetime.datetime | None]
+
 
 @dataclass
 class InformaTask:
     func: F
-    condition: str
+    condition: str | BaseCondition | NextFireProvider
+
+
+class NextFire(BaseCondition):
+    '''
+    Rocketry condition which holds once the next fire time from a provider has passed.
+
+    Rocketry evaluates conditions continuously, so the provider result is cached until the task runs
+    again, or until `recheck` has elapsed to pick up changes in the data it's computed from.
+    '''
+
+    def __init__(self, provider: Callable[[datetime.datetime | None], datetime.datetime | None], recheck=None):
+        self.provider = provider
+        self.recheck = recheck or datetime.timedelta(hours=1)
+        self._cache: tuple[datetime.datetime | None, datetime.datetime, datetime.datetime | None] | None = None
+        super().__init__()
+
+    def next_fire(self, last_run: datetime.datetime | None) -> datetime.datetime | None:
+        now = now_aest()
+
+        if self._cache is not None:
+            cached_last_run, computed, next_fire = self._cache
+            if cached_last_run == last_run and now - computed < self.recheck:
+                return next_fire
+
+        next_fire = self.provider(last_run)
+        self._cache = (last_run, now, next_fire)
+        return next_fire
+
+    def get_state(self, task=Task()):  # noqa: B008
+        # Rocketry returns naive local timestamps unless configured with a timezone
+        last_run = task.last_run.astimezone() if task.last_run else None
+        next_fire = self.next_fire(last_run)
+        return next_fire is not None and now_aest() >= next_fire
+
+    def __str__(self):
+        provider = getattr(self.provider, 'func', self.provider)
+        return f'next fire from {getattr(provider, "__qualname__", provider)}'
 
 
 class CliResponse(BaseModel):
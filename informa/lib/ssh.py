@@ -0,0 +1,165 @@
+import datetime
+import logging
+import threading
+import warnings
+from collections import deque
+from collections.abc import Callable
+from dataclasses import dataclass, field
+
+from cryptography.utils import CryptographyDeprecationWarning
+
+with warnings.catch_warnings(action='ignore', category=CryptographyDeprecationWarning):
+    import paramiko
+
+from informa.lib import PluginAdapter
+from informa.lib.utils import now_aest
+
+# Sent on idle connections, so NAT and firewalls don't drop pooled sessions between runs
+KEEPALIVE_INTERVAL = 30
+
+
+class SSHPool:
+    '''
+    Pool of SSH connections, keyed by host & user, kept open for reuse across plugin runs.
+
+    A single connection can run multiple commands concurrently, each on its own channel.
+    '''
+
+    def __init__(self, keepalive: int = KEEPALIVE_INTERVAL):
+        self.keepalive = keepalive
+        self._clients: dict[tuple[str, str], paramiko.SSHClient] = {}
+        self._lock = threading.Lock()
+
+    def get(self, host: str, username: str, key_filename: str | None = None) -> paramiko.SSHClient:
+        'Return an open connection to host, connecting only if there is no live pooled connection'
+        with self._lock:
+            client = self._clients.get((host, username))
+            if client is not None:
+                transport = client.get_transport()
+                if transport is not None and transport.is_active():
+                    return client
+                client.close()
+
+            client = paramiko.client.SSHClient()
+            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())  # noqa: S507
+            client.connect(
+                host,
+                username=username,
+                key_filename=key_filename,
+                look_for_keys=False,
+                allow_agent=False,
+            )
+            client.get_transport().set_keepalive(self.keepalive)
+
+            self._clients[(host, username)] = client
+            return client
+
+    def close(self):
+        with self._lock:
+            for client in self._clients.values():
+                client.close()
+            self._clients.clear()
+
+
+pool = SSHPool()
+
+
+def stream_command(client: paramiko.SSHClient, command: str, on_line: Callable[[str], None]) -> int:
+    '''
+    Run a command over SSH, passing each line of combined stdout/stderr to on_line as it arrives. Output is
+    decoded leniently, so a stray non-UTF-8 byte can't end the stream
+
+    Returns:
+        The command's exit status
+    '''
+    channel = client.get_transport().open_session()
+    try:
+        channel.set_combine_stderr(True)
+        channel.exec_command(command)
+
+        with channel.makefile('rb') as f:
+            for line in f:
+                on_line(line.decode('utf8', errors='replace').rstrip('\n'))
+
+        return channel.recv_exit_status()
+    finally:
+        channel.close()
+
+
+@dataclass
+class Job:
+    'A remote command running in a background thread, with its recent output'
+
+    command: str
+    started: datetime.datetime | None = None
+    finished: datetime.datetime | None = None
+    exit_status: int | None = None
+    error: str | None = None
+    output: deque[str] = field(default_factory=lambda: deque(maxlen=1000))
+
+    @property
+    def running(self) -> bool:
+        return self.started is not None and self.finished is None
+
+    @property
+    def done(self) -> bool:
+        return self.finished is not None
+
+    @property
+    def duration(self) -> datetime.timedelta | None:
+        return self.finished - self.started if self.started and self.finished else None
+
+    def to_dict(self, tail: int = 20) -> dict:
+        return {
+            'command': self.command,
+            'started': self.started,
+            'finished': self.finished,
+            'exit_status': self.exit_status,
+            'error': self.error,
+            'output': list(self.output)[-tail:],
+        }
+
+
+def run_background(
+    logger: logging.Logger | PluginAdapter,
+    connect: Callable[[], paramiko.SSHClient],
+    command: str,
+    on_complete: Callable[[Job], None] | None = None,
+) -> Job:
+    '''
+    Run a command over SSH in a background thread, so long running commands don't pin a scheduler worker.
+    Output is streamed line by line to the logger, and kept on the returned Job for progress reporting.
+
+    Params:
+        logger:       Plugin logger
+        connect:      Returns an SSH connection, typically from the pool
+        command:      Command to run
+        on_complete:  Called with the Job once the command has finished, before the Job is marked done
+    '''
+    job = Job(command)
+
+    def on_line(line: str):
+        job.output.append(line)
+        logger.debug(line)
+
+    def target():
+        job.started = now_aest()
+
+        # Always mark the job finished, so a failure can't leave it running forever
+        try:
+            try:
+                job.exit_status = stream_command(connect(), command, on_line)
+            except (paramiko.SSHException, OSError) as e:
+                logger.error('SSH command failed: %s (%s)', command, e)
+                job.error = str(e)
+            except Exception as e:
+                logger.exception('SSH command failed: %s', command)
+                job.error = f'{e.__class__.__name__}: {e}'
+
+            if on_complete:
+                on_complete(job)
+        finally:
+            job.finished = now_aest()
+
+    threading.Thread(target=target, name=f'ssh-job-{command}', daemon=True).start()
+    return job
@@ -0,0 +1,115 @@
+import asyncio
+import logging
+import socket
+import time
+
+import requests
+
+from informa.lib import PluginAdapter
+
+# wol-sender running on trevor broadcasts the magic packet onto the LAN
+WOL_SENDER_URL = 'http://trevor:3001/wake'
+
+
+def is_port_open(host: str, port: int, timeout: float = 1) -> bool:
+    'Return True if a TCP connection can be opened to host:port'
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+def send_wol(logger: logging.Logger | PluginAdapter, mac: str) -> bool:
+    'Ask wol-sender to send a WOL magic packet to mac'
+    try:
+        resp = requests.get(f'{WOL_SENDER_URL}/{mac}', timeout=3)
+        resp.raise_for_status()
+    except requests.RequestException as e:
+        logger.error('Failed sending WOL packet to %s: %s', mac, e)
+        return False
+
+    logger.info('WOL packet sent to %s', mac)
+    return True
+
+
+def ensure_awake(
+    logger: logging.Logger | PluginAdapter,
+    host: str,
+    port: int,
+    mac: str,
+    deadline: float = 120,
+    max_interval: float = 10,
+) -> bool:
+    '''
+    Ensure a host is awake and accepting connections, waking it via WOL if necessary.
+
+    Readiness is polled with exponential backoff, so the caller can resume the blocked operation
+    in the same run rather than waiting for the next scheduled tick.
+
+    Params:
+        logger:        Plugin logger
+        host:          Hostname or IP of the sleeping host
+        port:          TCP port which indicates the host's service is ready
+        mac:           MAC address of the host
+        deadline:      Seconds to wait for the host to become ready
+        max_interval:  Cap on the backoff between polls
+    Returns:
+        True if the host is ready before the deadline
+    '''
+    if is_port_open(host, port):
+        return True
+
+    if not send_wol(logger, mac):
+        return False
+
+    start = time.monotonic()
+    interval = 1.0
+
+    while time.monotonic() - start < deadline:
+        time.sleep(interval)
+
+        if is_port_open(host, port):
+            logger.info('%s:%s ready after %.0fs', host, port, time.monotonic() - start)
+            return True
+
+        interval = min(interval * 2, max_interval)
+
+    logger.error('%s:%s not ready after %ss', host, port, deadline)
+    return False
+
+
+async def ensure_awake_async(
+    logger: logging.Logger | PluginAdapter,
+    host: str,
+    port: int,
+    mac: str,
+    deadline: float = 120,
+    max_interval: float = 10,
+) -> bool:
+    '''
+    Ensure a host is awake and accepting connections; see ensure_awake.
+
+    For use inside the scheduler's event loop, where waiting for the host to boot must not block other
+    tasks or the API. Blocking socket and HTTP calls run in worker threads.
+    '''
+    if await asyncio.to_thread(is_port_open, host, port):
+        return True
+
+    if not await asyncio.to_thread(send_wol, logger, mac):
+        return False
+
+    start = time.monotonic()
+    interval = 1.0
+
+    while time.monotonic() - start < deadline:
+        await asyncio.sleep(interval)
+
+        if await asyncio.to_thread(is_port_open, host, port):
+            logger.info('%s:%s ready after %.0fs', host, port, time.monotonic() - start)
+            return True
+
+        interval = min(interval * 2, max_interval)
+
+    logger.error('%s:%s not ready after %ss', host, port, deadline)
+    return False
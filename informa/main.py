@@ -1,5 +1,6 @@
 import asyncio
 import datetime
+import functools
 import importlib
 import inspect
 import logging
@@ -12,11 +13,12 @@ import dataclasses_json
 import uvicorn
 from fastapi import APIRouter, FastAPI
 from rocketry import Rocketry
+from rocketry.core import BaseCondition
 
 from informa import __version__
 from informa.exceptions import PluginAlreadyDisabled, PluginAlreadyEnabled
 from informa.lib.config import AppConfig, load_app_config, save_app_config
-from informa.lib.plugin import F, InformaPlugin, InformaTask
+from informa.lib.plugin import F, InformaPlugin, InformaTask, NextFire, NextFireProvider
 from informa.lib.utils import raise_alarm
 
 logger = logging.getLogger('informa')
@@ -125,15 +127,28 @@ class Informa:
                 original_func = args[0] if args else None
 
             if original_func:
-                # Wrap the function with error handling
-                def error_handled_func(*func_args, **func_kwargs):
-                    try:
-                        return original_func(*func_args, **func_kwargs)
-                    except Exception as e:
-                        # Get task name from kwargs or construct it
-                        task_name = kwargs.get('name', f'{original_func.__module__}.{original_func.__name__}')
-                        self._handle_task_failure(task_name, e)
-                        raise  # Re-raise so Rocketry knows the task failed
+                # Get task name from kwargs or construct it
+                task_name = kwargs.get('name', f'{original_func.__module__}.{original_func.__name__}')
+
+                # Wrap the function with error handling. Coroutine functions need a coroutine wrapper,
+                # so that Rocketry awaits them in the event loop and failures are caught here.
+                if inspect.iscoroutinefunction(original_func):
+
+                    async def error_handled_func(*func_args, **func_kwargs):
+                        try:
+                            return await original_func(*func_args, **func_kwargs)
+                        except Exception as e:
+                            self._handle_task_failure(task_name, e)
+                            raise  # Re-raise so Rocketry knows the task failed
+
+                else:
+
+                    def error_handled_func(*func_args, **func_kwargs):
+                        try:
+                            return original_func(*func_args, **func_kwargs)
+                        except Exception as e:
+                            self._handle_task_failure(task_name, e)
+                            raise  # Re-raise so Rocketry knows the task failed
 
                 # Replace the func with our wrapped version
                 if 'func' in kwargs:
@@ -167,13 +182,14 @@ class Informa:
             # Don't let alarm failures crash the handler
             logger.error('Failed to send alarm for task failure: %s', e)
 
-    def task(self, condition: str) -> Callable[[F], F]:
+    def task(self, condition: str | BaseCondition | NextFireProvider) -> Callable[[F], F]:
         '''
         Decorator to register a plugin function as a task. This method will instantiate an
         InformaPlugin if one doesn't yet exist for the plugin.
 
         Args:
-            condition:  The condition string for the task (eg. `every 5 mins`)
+            condition:  The condition string for the task (eg. `every 5 mins`), a Rocketry condition,
+                        or a callable returning the task's next fire time, computed from plugin data
         '''
 
         def decorator(func: F) -> F:
@@ -222,9 +238,14 @@ class Informa:
         for task in plugin.tasks:
             task_name = f'{plugin_name}.{task.func.__name__}'
 
+            condition = task.condition
+            if callable(condition) and not isinstance(condition, BaseCondition):
+                # Bind the next fire provider to this plugin
+                condition = NextFire(functools.partial(condition, plugin))
+
             self.rocketry.session.create_task(
                 func=task.func,
-                start_cond=task.condition,
+                start_cond=condition,
                 name=task_name,
                 parameters={'plugin': plugin},
             )
@@ -1,12 +1,22 @@
-import contextlib
 import datetime
 import decimal
 import logging
+import os
+import pathlib
+import shutil
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
 
 import click
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 import requests
+from fastapi import APIRouter
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from informa import app
 from informa.lib import (
@@ -21,8 +31,45 @@ from informa.lib.utils import now_aest
 logger = PluginAdapter(logging.getLogger('informa'))
 
 
+router = APIRouter(prefix='/dans')
+
+
+@app.api(router)
+def fastapi():
+    'Register the APIRouter with Informa'
+
+
 TEMPLATE_NAME = 'dans.tmpl'
 
+# Concurrent connections to api.danmurphys.com.au
+MAX_CONCURRENT_QUERIES = 8
+
+# Price history Parquet dataset & product table
+HISTORY_DIR = pathlib.Path(os.environ.get('STATE_DIR', './state')).absolute() / 'dans'
+
+# Runs of consecutive observations at the same price
+RUN_SCHEMA = pa.schema([
+    ('product_id', pa.string()),
+    ('price', pa.decimal128(10, 2)),
+    ('first_seen', pa.timestamp('us', tz='UTC')),
+    ('last_seen', pa.timestamp('us', tz='UTC')),
+    ('count', pa.int32()),
+    ('alerted', pa.bool_()),
+])
+# Legacy dataset of one row per observation, migrated into runs on the next run
+HISTORY_SCHEMA = pa.schema([
+    ('product_id', pa.string()),
+    ('price', pa.decimal128(10, 2)),
+    ('ts', pa.timestamp('us', tz='UTC')),
+    ('alerted', pa.bool_()),
+])
+PRODUCT_SCHEMA = pa.schema([
+    ('product_id', pa.string()),
+    ('name', pa.string()),
+    ('target', pa.int64()),
+])
+PRICE_QUANTUM = decimal.Decimal('0.01')
+
 
 @dataclass
 class Product:
@@ -39,9 +86,122 @@ class History:
     alerted: bool = False
 
 
+@dataclass
+class Observation:
+    price: decimal.Decimal
+    ts: datetime.datetime
+
+
+@dataclass
+class Run:
+    'Consecutive observations of a product at the same price, stored as a single row'
+
+    price: decimal.Decimal
+    first_seen: datetime.datetime
+    last_seen: datetime.datetime
+    count: int = 1
+    alerted: bool = False
+
+    def extends(self, other: 'Run') -> bool:
+        'Alerts always start a new run, so the last alert is kept exactly'
+        return not self.alerted and not other.alerted and self.price == other.price
+
+
+@dataclass
+class ProductIndex:
+    '''
+    Most recent alert and observation for a product, plus price aggregates, maintained as history is added.
+
+    Prices are in cents, so a histogram of prices is small and gives an exact median.
+
+    The open run holds observations at the current price, and is only written to the store once the price changes.
+    '''
+
+    last_alert: Observation | None = None
+    latest: Observation | None = None
+    count: int = 0
+    lowest: decimal.Decimal | None = None
+    highest: decimal.Decimal | None = None
+    first_seen: datetime.datetime | None = None
+    prices: dict[str, int] = field(default_factory=dict)
+    run: Run | None = None
+
+    def add(self, history: History) -> Run | None:
+        '''
+        Add an observation, extending the open run if the price is unchanged
+
+        Returns:
+            The previously open run, if this observation closed it
+        '''
+        observation = Run(
+            decimal.Decimal(history.price).quantize(PRICE_QUANTUM), history.ts, history.ts, alerted=history.alerted
+        )
+        self.add_run(observation)
+
+        closed = self.run
+        if closed and closed.extends(observation):
+            closed.last_seen = observation.last_seen
+            closed.count += 1
+            return None
+
+        self.run = observation
+        return closed
+
+    def add_run(self, run: Run):
+        'Add a run of observations to the aggregates'
+        self.latest = Observation(run.price, run.last_seen)
+        if run.alerted:
+            self.last_alert = Observation(run.price, run.last_seen)
+
+        price = decimal.Decimal(run.price).quantize(PRICE_QUANTUM)
+        self.count += run.count
+        self.lowest = price if self.lowest is None else min(self.lowest, price)
+        self.highest = price if self.highest is None else max(self.highest, price)
+        if self.first_seen is None:
+            self.first_seen = run.first_seen
+
+        key = str(price)
+        self.prices[key] = self.prices.get(key, 0) + run.count
+
+    @property
+    def median(self) -> decimal.Decimal | None:
+        'Exact median from the price histogram, averaging the middle two for an even count'
+        if not self.count:
+            return None
+
+        lower, upper = (self.count - 1) // 2, self.count // 2
+        values = []
+        seen = 0
+
+        for price, n in sorted((decimal.Decimal(p), n) for p, n in self.prices.items()):
+            if lower < seen + n and not values:
+                values.append(price)
+            if upper < seen + n:
+                values.append(price)
+                break
+            seen += n
+
+        return (values[0] + values[-1]) / 2
+
+    def stats(self, product: Product) -> dict:
+        return {
+            'name': product.name,
+            'Count': self.count,
+            'Lowest': self.lowest,
+            'Highest': self.highest,
+            'Median': self.median,
+            'Target': product.target,
+            'Latest': self.latest.price if self.latest else None,
+            'First Fetch': self.first_seen,
+            'Latest Fetch': self.latest.ts if self.latest else None,
+        }
+
+
 @dataclass
 class State(StateBase):
+    # Legacy JSON history, migrated into the Parquet store on the next run
     history: list[History] = field(default_factory=list)
+    index: dict[str, ProductIndex] = field(default_factory=dict)
 
 
 @dataclass
@@ -53,67 +213,294 @@ class FailedProductQuery(Exception):
     pass
 
 
-class ProductNeverAlerted(Exception):
-    pass
-
-
 @app.task('every 12 hours')
 def run(plugin):
     plugin.execute()
 
 
 def main(state: State, config: Config):
-    sess = requests.Session()
+    store = PriceHistory(HISTORY_DIR)
+    migrate_history(state, store)
+    store.write_products(config.products)
+
+    # Build index entries from the store for products new to the index, or indexed before aggregates
+    missing = [
+        product.id for product in config.products if product.id not in state.index or not state.index[product.id].count
+    ]
+    if missing:
+        state.index.update(store.build_index(missing))
+
+    sess = create_session()
 
-    history_item: History | None = None
     count = 0
+    closed = []
+
+    # Query all products concurrently; results are in the same order as configured
+    results = query_products(sess, config.products)
 
     # Iterate configured list of Dan's products
-    for product in config.products:
-        with contextlib.suppress(ProductNeverAlerted):
-            history_item, _ = get_last_alert(product, state.history)
+    for product, current_price in zip(config.products, results, strict=True):
+        if isinstance(current_price, FailedProductQuery):
+            logger.error(current_price)
+            continue
 
-        try:
-            current_price = query_product(sess, product)
-            alerted = False
+        index = state.index.setdefault(product.id, ProductIndex())
+        last_alert = index.last_alert
+        alerted = False
 
-            # Check if price within target range, and send an email if so
-            if current_price <= product.target:
-                # Skip product if alerted more recently than 6 days ago
-                if history_item and history_item.ts > now_aest() - datetime.timedelta(days=6):
-                    logger.info('Skipped alerting %s @ %s', product.name, history_item.price)
-                else:
-                    send_alert(product, current_price)
-                    alerted = True
+        # Check if price within target range, and send an email if so
+        if current_price <= product.target:
+            # Skip product if alerted more recently than 6 days ago
+            if last_alert and last_alert.ts > now_aest() - datetime.timedelta(days=6):
+                logger.info('Skipped alerting %s @ %s', product.name, last_alert.price)
+            else:
+                send_alert(product, current_price)
+                alerted = True
 
-                count += 1
+            count += 1
 
-            # Track query results
-            result = History(product, current_price, ts=now_aest(), alerted=alerted)
-            add_to_history(state.history, result)
+        # Unchanged prices extend the open run in state; only closed runs are written to the store
+        run = index.add(History(product, current_price, ts=now_aest(), alerted=alerted))
+        if run:
+            closed.append((product.id, run))
 
-        except FailedProductQuery as e:
-            logger.error(e)
+    store.append_runs(closed)
 
     return count
 
 
-def get_last_alert(product: Product, history: list[History]) -> tuple[History, int]:
-    'Lookup most recent alert for this product'
-    for i, history_item in enumerate(reversed(history)):
-        if history_item.product == product and history_item.alerted:
-            return history_item, i
-    raise ProductNeverAlerted
+def create_session() -> requests.Session:
+    'Session with a connection pool sized for concurrent queries, and retries on transient errors'
+    retry = Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=('GET',),
+        # Return the final response, so query_product reports the HTTP status
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=MAX_CONCURRENT_QUERIES, max_retries=retry)
+
+    sess = requests.Session()
+    sess.mount('https://', adapter)
+    return sess
+
+
+def query_products(sess, products: list[Product]) -> list[decimal.Decimal | FailedProductQuery]:
+    '''
+    Query Dan Murphy's API for many products concurrently
+
+    Returns:
+        Current price, or the exception raised, for each product in order
+    '''
+
+    def query(product: Product) -> decimal.Decimal | FailedProductQuery:
+        try:
+            return query_product(sess, product)
+        except FailedProductQuery as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_QUERIES) as executor:
+        return list(executor.map(query, products))
+
+
+class PriceHistory:
+    '''
+    Append-only Parquet dataset of price runs, with a separate product table.
+
+    Consecutive observations at the same price are stored as a single run, with first-seen and last-seen
+    timestamps and a count, so aggregates over the runs match those over every observation.
+
+    Each run appends a file to the dataset. Reads use predicate pushdown and memory-mapping, so only
+    the needed rows and columns are loaded.
+    '''
+
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+        self.runs_path = path / 'runs'
+        self.history_path = path / 'history'
+        self.products_path = path / 'products.parquet'
+
+    def append(self, observations: list[History], name: str | None = None):
+        'Compact observations into runs, and write them as a new file in the dataset'
+        self.append_runs(compact((h.product.id, h) for h in observations), name)
+
+    def append_runs(self, runs: list[tuple[str, Run]], name: str | None = None):
+        '''
+        Write runs, keyed by product ID, as a new file in the dataset
+
+        Params:
+            runs:  Runs to write
+            name:  Fixed file name, replacing any earlier file of that name; so a migration retried after a
+                   failure rewrites the same runs rather than duplicating them
+        '''
+        if not runs:
+            return
+
+        self._write_runs(
+            pa.Table.from_pylist(
+                [
+                    {
+                        'product_id': product_id,
+                        'price': decimal.Decimal(run.price).quantize(PRICE_QUANTUM),
+                        'first_seen': run.first_seen,
+                        'last_seen': run.last_seen,
+                        'count': run.count,
+                        'alerted': run.alerted,
+                    }
+                    for product_id, run in runs
+                ],
+                schema=RUN_SCHEMA,
+            ),
+            name,
+        )
+
+    def read(self, columns: list[str] | None = None, filters: pc.Expression | None = None) -> pa.Table:
+        'Read runs from the dataset'
+        if not self.runs_path.exists():
+            return RUN_SCHEMA.empty_table().select(columns or RUN_SCHEMA.names)
+
+        return pq.read_table(
+            self.runs_path,
+            columns=columns,
+            filters=filters,
+            schema=RUN_SCHEMA,
+            memory_map=True,
+        )
+
+    def build_index(self, product_ids: list[str]) -> dict[str, ProductIndex]:
+        'Build the most recent alert and observation, and price aggregates, for each product from the dataset'
+        runs = self.read(filters=pc.field('product_id').isin(product_ids))
+
+        index = {product_id: ProductIndex() for product_id in product_ids}
+
+        # Sorted by timestamp, so later runs overwrite earlier ones
+        for row in runs.sort_by('first_seen').to_pylist():
+            index[row.pop('product_id')].add_run(Run(**row))
+
+        return index
+
+    def rewrite(self, filters: pc.Expression | None = None) -> int:
+        '''
+        Compact the dataset into a single file, keeping only runs matching filters
+
+        Returns:
+            Count of runs removed
+        '''
+        if not self.runs_path.exists():
+            return 0
+
+        files = list(self.runs_path.glob('*.parquet'))
+
+        table = self.read()
+        kept = table.filter(filters) if filters is not None else table
+
+        self._write_runs(kept.sort_by('first_seen'))
+        for f in files:
+            f.unlink()
+
+        return table.num_rows - kept.num_rows
+
+    def migrate(self) -> int:
+        '''
+        Compact the legacy dataset of one row per observation into runs, and remove it
+
+        Returns:
+            Count of observations migrated
+        '''
+        if not self.history_path.exists():
+            return 0
+
+        table = pq.read_table(self.history_path, schema=HISTORY_SCHEMA, memory_map=True)
+        self.append_runs(
+            compact(
+                (row['product_id'], History(None, row['price'], row['ts'], row['alerted']))
+                for row in table.sort_by('ts').to_pylist()
+            ),
+            'migrated-history',
+        )
+        shutil.rmtree(self.history_path)
+
+        return table.num_rows
+
+    def products(self) -> dict[str, Product]:
+        'Product table, keyed by ID'
+        if not self.products_path.exists():
+            return {}
+
+        table = pq.read_table(self.products_path, memory_map=True)
+        return {row['product_id']: Product(row['product_id'], row['name'], row['target']) for row in table.to_pylist()}
+
+    def write_products(self, products: list[Product]):
+        'Upsert products into the product table, rewriting it only when changed'
+        existing = self.products()
+        merged = {**existing, **{p.id: p for p in products}}
+        if merged != existing:
+            self._write_products(merged)
+
+    def delete_product(self, product_id: str) -> int:
+        '''
+        Remove a product and its history
+
+        Returns:
+            Count of runs removed
+        '''
+        removed = self.rewrite(pc.field('product_id') != product_id)
+
+        products = self.products()
+        if products.pop(product_id, None):
+            self._write_products(products)
+
+        return removed
+
+    def _write_runs(self, table: pa.Table, name: str | None = None):
+        self.runs_path.mkdir(parents=True, exist_ok=True)
+        path = self.runs_path / f'{name or format(now_aest(), "%Y%m%dT%H%M%S%f")}.parquet'
+
+        # Write via a hidden temporary file, which dataset reads skip, so a file is never partially written
+        tmp = self.runs_path / f'.{path.name}.tmp'
+        pq.write_table(table, tmp)
+        tmp.replace(path)
+
+    def _write_products(self, products: dict[str, Product]):
+        table = pa.Table.from_pylist(
+            [{'product_id': p.id, 'name': p.name, 'target': p.target} for p in products.values()],
+            schema=PRODUCT_SCHEMA,
+        )
+        self.path.mkdir(parents=True, exist_ok=True)
+        pq.write_table(table, self.products_path)
+
+
+def compact(observations: Iterable[tuple[str, History]]) -> list[tuple[str, Run]]:
+    'Compact observations, keyed by product ID and in timestamp order, into runs'
+    indexes: dict[str, ProductIndex] = {}
+    runs = []
 
+    for product_id, history in observations:
+        run = indexes.setdefault(product_id, ProductIndex()).add(history)
+        if run:
+            runs.append((product_id, run))
 
-def add_to_history(history: list[History], new_history: History):
-    'Add query result to product history'
-    # Remove history over 13 months old
-    for i, history_item in enumerate(history):
-        if history_item.ts > now_aest() + datetime.timedelta(days=400):
-            del history[i]
+    # Close the final run of each product
+    runs.extend((product_id, index.run) for product_id, index in indexes.items())
+    return runs
 
-    history.append(new_history)
+
+def migrate_history(state: State, store: PriceHistory):
+    'Move legacy JSON history from state, and legacy observation rows from the store, into runs'
+    if count := store.migrate():
+        logger.info('Migrated %s observations to runs in %s', count, store.runs_path)
+
+    if not state.history:
+        return
+
+    store.write_products([h.product for h in state.history])
+    # Written under a fixed name, so if main fails before the cleared state is saved, the next run's
+    # migration replaces these runs rather than duplicating them
+    store.append(sorted(state.history, key=lambda h: h.ts), 'migrated-state')
+    logger.info('Migrated %s history entries to %s', len(state.history), store.path)
+
+    state.history = []
 
 
 def query_product(sess, product: Product) -> decimal.Decimal:
@@ -172,47 +559,32 @@ def cli():
     'Dan Murphy\'s product tracker'
 
 
-def get_history(plugin: InformaPlugin) -> pd.DataFrame:
-    state = plugin.load_state()
-    df = pd.DataFrame([
-        {
-            'id': h.product.id,
-            'name': h.product.name,
-            'target': h.product.target,
-            'price': h.price,
-            'ts': h.ts,
-        }
-        for h in state.history
-    ])
-    df['ts'] = pd.to_datetime(df.ts, utc=True)
-    return df
+def get_stats(state: State) -> list[dict]:
+    'Product stats from the aggregates in the state index'
+    products = PriceHistory(HISTORY_DIR).products()
+
+    return sorted(
+        (index.stats(products[product_id]) for product_id, index in state.index.items() if product_id in products),
+        key=lambda row: row['name'],
+    )
+
+
+@router.get('/stats')
+def serve_stats():
+    'Serve product stats as JSON'
+    return get_stats(app.plugins[__name__].load_state())
 
 
 @cli.command
-def stats():
+def stats(plugin: InformaPlugin):
     '''
     Show product stats
     '''
-    df = get_history()
-
-    # Aggregate max/min/median prices
-    price_range = df.groupby(['name']).agg({'price': ['count', 'min', 'max', 'median']})
-    price_range.columns = price_range.columns.get_level_values(1)
-
-    # Determine earliest and most recent query dates
-    query_range = df.groupby(['name']).agg({'ts': ['min', 'max']})
-    query_range.columns = query_range.columns.get_level_values(1)
-
-    # Pull price from most recent query
-    latest_price = df.sort_values(['ts']).groupby('name').tail(1).set_index('name').drop(columns=['id', 'ts'])
-
-    # Smash into single dataframe
-    df = pd.concat([price_range, latest_price, query_range], axis=1)
-    df.columns = ['Count', 'Lowest', 'Highest', 'Median', 'Target', 'Latest', 'Latest Fetch', 'First Fetch']
+    df = pd.DataFrame(get_stats(plugin.load_state())).set_index('name')
 
     # Date formatting
     for col in ('Latest Fetch', 'First Fetch'):
-        df[col] = df[col].dt.strftime('%d-%m-%Y')
+        df[col] = pd.to_datetime(df[col], utc=True).dt.strftime('%d-%m-%Y')
 
     print(df)
 
@@ -220,16 +592,25 @@ def stats():
 @cli.command
 @click.option('--fix', is_flag=True, default=False)
 def validate(plugin: InformaPlugin, fix: bool):
-    'Validate and fix state'
-    state = plugin.load_state()
+    '''
+    Validate history against the product table
+
+    With --fix, remove history for unknown products, and compact the dataset into a single file
+    '''
+    store = PriceHistory(HISTORY_DIR)
+    known = list(store.products())
 
-    for entry in state.history:
-        init = entry.price
-        entry.price = decimal.Decimal(f'{entry.price:0.2f}')
-        if init != entry.price:
-            print(entry.product.name, init, entry.price)
+    orphaned = store.read(columns=['product_id', 'count'], filters=~pc.field('product_id').isin(known))
+    for row in orphaned.group_by('product_id').aggregate([('count', 'sum')]).to_pylist():
+        print(row['product_id'], row['count_sum'])
 
     if fix:
+        removed = store.rewrite(pc.field('product_id').isin(known))
+        print(f'Removed {removed} entries')
+
+        state = plugin.load_state()
+        for product_id in set(state.index) - set(known):
+            del state.index[product_id]
         plugin.write_state(state)
 
 
@@ -241,7 +622,12 @@ def delete(plugin: InformaPlugin, product_name: str):
     \b
     PRODUCT_NAME: Product name shown in stats command
     '''
+    store = PriceHistory(HISTORY_DIR)
     state = plugin.load_state()
 
-    state.history = [entry for entry in state.history if entry.product.name != product_name]
+    for product in store.products().values():
+        if product.name == product_name:
+            print(f'Removed {store.delete_product(product.id)} entries')
+            state.index.pop(product.id, None)
+
     plugin.write_state(state)
@@ -1,22 +1,32 @@
+import asyncio
+import base64
+import bisect
 import datetime
+import errno
+import functools
+import itertools
 import logging
 import math
 import os
 import re
 import socket
 import xmlrpc.client
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass, field
-from urllib.parse import urlparse
+from urllib.parse import parse_qs, urlparse
+from xml.parsers.expat import ExpatError
 
+import arrow
 import click
 import feedparser
 import googleapiclient
 import httplib2
-import pytz
 import requests
+from fastapi import APIRouter
 from gcsa.google_calendar import GoogleCalendar
 from google.oauth2.service_account import Credentials
-from rocketry.conds import cron
+from rocketry.conds import after_success
 
 from informa import app
 from informa.lib import (
@@ -27,17 +37,68 @@ from informa.lib import (
     pretty,
 )
 from informa.lib.plugin import InformaPlugin
+from informa.lib.utils import now_aest
+from informa.lib.wol import ensure_awake_async
 
 logger = PluginAdapter(logging.getLogger('informa'))
 
 
+router = APIRouter(prefix='/f1torrents')
+
+
+@app.api(router)
+def fastapi():
+    'Register the APIRouter with Informa'
+
+
 RTORRENT_HOST = '192.168.1.104'
+RTORRENT_PORT = 5000
+JORG_MAC = 'd0:50:99:c1:63:c9'
 TEMPLATE_NAME = 'f1torrents.tmpl'
 
+# Run on the days either side of a race, and refresh the cached calendar daily
+RACE_WEEKEND_DAYS = 2
+CALENDAR_MAX_AGE = datetime.timedelta(days=1)
+
+# Between race weekends the snapshot is refreshed less often; the CLI queries rtorrent itself when the
+# snapshot is older than this
+SNAPSHOT_IDLE_INTERVAL = datetime.timedelta(minutes=30)
+SNAPSHOT_MAX_AGE = datetime.timedelta(hours=1)
+
+# Each torrent source is queried concurrently, and bounded by its own timeout. The requests timeout applies
+# per socket operation, so a slow source is also abandoned once discovery passes its deadline
+SOURCE_TIMEOUT = 5
+DISCOVERY_DEADLINE = 8
+
+# Release titles look like Formula.1.2024x05.Monaco.Race.SkyF1UHD.2160P; tokens are whole dot-separated words
+# matched anywhere after the season and round, in a single scan of the title. So the Pre-Race and Post-Race
+# shows aren't mistaken for the Race
+RELEASE_PREFIX = re.compile(r'Formula\.1\.(?P<season>\d{4})x(?P<round>\d{2})')
+RELEASE_TOKENS = re.compile(
+    r'(?<=\.)(?:'
+    r'(?P<sprint>Sprint)|(?P<qualifying>Qualifying)|(?P<race>Race)|(?P<review>Season\.Review|Shootout)'
+    r'|(?P<teds>Teds)|(?P<quality>SkyF1\w*?HD(?:\.\d{3,4}[pP])?)'
+    r')(?=\.|$)'
+)
+# A wanted release contains one of these words, so titles without any are rejected before the regex scan
+SESSION_WORDS = ('Race', 'Qualifying', 'Sprint', 'Season.Review', 'Shootout')
+
 RT_PRI_HIGH = 2
 RT_PRI_NORM = 1
 RT_PRI_OFF = 0
 
+RT_TAG = 'F1'
+
+# Number of f.multicall requests batched into each system.multicall
+RT_MULTICALL_CHUNK = 100
+
+# Size of the buffer into which SCGI responses are read
+SCGI_RECV_BUFSIZE = 64 * 1024
+
+# Per-call timeout, and limit on concurrent connections, for AsyncRTorrent
+RT_TIMEOUT = 10
+RT_MAX_CONNECTIONS = 4
+
 
 @dataclass
 class Download:
@@ -45,11 +106,28 @@ class Download:
     title: str
     magnet: str
     added_to_rtorrent: bool = False
+    info_hash: str | None = None
+
+
+@dataclass
+class Race:
+    title: str
+    start: datetime.datetime
+
+
+@dataclass
+class RaceWeekend:
+    start: datetime.date
+    end: datetime.date
 
 
 @dataclass
 class State(StateBase):
     races: dict[str, Download] = field(default_factory=dict)
+    calendar: dict[str, Race] = field(default_factory=dict)  # Google Calendar event ID -> Race
+    calendar_sync_token: str | None = None
+    calendar_synced: datetime.datetime | None = None
+    weekends: list[RaceWeekend] = field(default_factory=list)  # Sorted by start
 
 
 class FailedFetchingTorrents(Exception):
@@ -57,65 +135,223 @@ class FailedFetchingTorrents(Exception):
 
 
 @dataclass
-class Race:
+class Config(ConfigBase):
+    current_season: int
+    gcal: str
+    sources: list[str] = field(default_factory=lambda: ['thepiratebay', 'torrentgalaxy'])
+
+
+@dataclass(frozen=True)
+class Release:
+    season: int
+    round: int
+    session_type: str | None
+    quality: str | None
+    teds: bool = False
+
+    @property
+    def key(self) -> str:
+        'A different key for each session type (eg. 2023x04ra)'
+        return f'{self.season}x{self.round:02d}{self.session_type}'
+
+
+@dataclass(frozen=True)
+class FoundTorrent:
+    info_hash: str
     title: str
-    start: datetime.datetime
+    release: Release
+    magnet: str
 
 
 @dataclass
-class Config(ConfigBase):
-    current_season: int
-    gcal: str
-    calendar: list[Race] | None = None
+class TorrentSnapshot:
+    '''
+    In-memory snapshot of rtorrent's downloads and their files, shared by tasks, CLI and API
 
+    Maintained by the `poll_torrents` task. Each refresh lists downloads, and only fetches files for
+    those which are new, or whose completed bytes or tag changed since the previous refresh. rtorrent has
+    no per-download summary of file priorities, so downloads whose priorities are changed are invalidated.
+    '''
+
+    torrents: dict[str, dict] = field(default_factory=dict)
+    versions: dict[str, tuple[int, str]] = field(default_factory=dict)
+    refreshed: datetime.datetime | None = None
+
+    async def refresh(self, rt: 'AsyncRTorrent') -> int:
+        '''
+        Incrementally refresh the snapshot from rtorrent
 
-def fetch_f1_calendar(plugin: InformaPlugin) -> dict[str, datetime.datetime] | None:
-    'Fetch current F1 calendar'
+        Returns:
+            Number of new or changed downloads
+        '''
+        downloads = await rt.list_downloads()
+        versions = {d[0]: (d[2], d[3]) for d in downloads}
+
+        changed = [d for d in downloads if self.versions.get(d[0]) != versions[d[0]]]
+        files = await rt.get_files([d[0] for d in changed])
+
+        for d in changed:
+            self.torrents[d[0]] = build_torrent(d, files[d[0]])
+
+        # Drop downloads which have been removed from rtorrent
+        for hash_id in self.torrents.keys() - versions.keys():
+            del self.torrents[hash_id]
+
+        self.versions = versions
+        self.refreshed = now_aest()
+        return len(changed)
+
+    def invalidate(self, hash_ids: Iterable[str]):
+        'Refetch the files of these downloads on the next refresh'
+        for hash_id in hash_ids:
+            self.versions.pop(hash_id, None)
+
+    def filter(self, name_filter: str) -> dict[str, dict]:
+        'Return torrents with name_filter in their name'
+        return {hash_id: t for hash_id, t in self.torrents.items() if name_filter in t['name']}
+
+
+snapshot = TorrentSnapshot()
+
+# Hashes of F1 torrents already tagged and prioritised, which need no further writes
+reconciled: set[str] = set()
+
+
+def sync_f1_calendar(state: State, config: Config) -> bool:
+    '''
+    Sync the F1 calendar from Google Calendar into plugin state
+
+    After an initial full sync, only events changed since the last sync are fetched, via the
+    calendar's sync token. Race weekends are then precomputed for the current season.
+    '''
     gsuite_creds = os.environ.get('GSUITE_OAUTH_CREDS')
     if not gsuite_creds:
         logger.error('No Google service account credentials')
-        return None
+        return False
 
     try:
         gc = GoogleCalendar(credentials=Credentials.from_service_account_file(gsuite_creds))
     except googleapiclient.errors.HttpError:
         logger.error('Failed to authenticate to Google Calendar API')
-        return None
+        return False
+
+    # Sync tokens cannot be combined with timeMin or orderBy, so the full sync fetches every event
+    params = {'calendarId': config.gcal, 'singleEvents': True}
+    if state.calendar_sync_token:
+        params['syncToken'] = state.calendar_sync_token
 
-    config = plugin.load_config()
+    items = []
+    sync_token = None
 
     try:
-        events = gc.get_events(
-            calendar_id=config.gcal,
-            time_min=datetime.date(config.current_season, 1, 1),
-            single_events=True,
-            order_by='startTime',
-        )
-        return {
-            e.summary[16:-1]: e.start.astimezone(pytz.timezone('Australia/Melbourne'))
-            for e in events
-            if e.summary.startswith('F1: Grand Prix')
-        }
+        request = gc.service.events().list(**params)
+        while request is not None:
+            resp = request.execute()
+            items.extend(resp.get('items', []))
+            sync_token = resp.get('nextSyncToken', sync_token)
+            request = gc.service.events().list_next(request, resp)
+
+    except googleapiclient.errors.HttpError as e:
+        if e.resp.status == 410 and state.calendar_sync_token:
+            # Sync token has expired, fallback to a full sync
+            logger.info('Calendar sync token expired')
+            state.calendar_sync_token = None
+            return sync_f1_calendar(state, config)
+
+        logger.error('Failed fetching calendar data (%s)', e)
+        return False
 
     except (httplib2.error.ServerNotFoundError, TimeoutError, ConnectionError, socket.gaierror):
         logger.error('Failed fetching calendar data (timeout or server not found)')
-        return None
+        return False
 
+    if not state.calendar_sync_token:
+        state.calendar.clear()
 
-@app.task(cron('*/15 * * * *'))
-def run(plugin):
-    cal = fetch_f1_calendar(plugin)
-    if not cal:
-        return
+    for item in items:
+        summary = item.get('summary', '')
 
-    today = datetime.datetime.now(tz=datetime.UTC).date()
+        # Cancelled events in an incremental sync have only their ID
+        if item.get('status') == 'cancelled' or not summary.startswith('F1: Grand Prix'):
+            state.calendar.pop(item['id'], None)
+            continue
 
-    for race in [Race(k, v) for k, v in cal.items()]:
-        if race.start.date() - datetime.timedelta(days=3) < today < race.start.date() + datetime.timedelta(days=3):
-            plugin.execute()
-            return
+        start = item['start'].get('dateTime') or item['start']['date']
+        state.calendar[item['id']] = Race(
+            title=summary[16:-1],
+            start=arrow.get(start).to('Australia/Melbourne').datetime,
+        )
+
+    state.calendar_sync_token = sync_token
+    state.calendar_synced = now_aest()
+    state.weekends = race_weekends(state.calendar.values(), config.current_season)
+
+    logger.debug('Synced F1 calendar with %s changes', len(items))
+    return True
+
+
+def race_weekends(races: Iterable[Race], season: int) -> list[RaceWeekend]:
+    'Return the race weekends in a season, in order'
+    return sorted(
+        (
+            RaceWeekend(
+                start=race.start.date() - datetime.timedelta(days=RACE_WEEKEND_DAYS),
+                end=race.start.date() + datetime.timedelta(days=RACE_WEEKEND_DAYS),
+            )
+            for race in races
+            if race.start.year >= season
+        ),
+        key=lambda w: w.start,
+    )
+
+
+def next_race_weekend(weekends: list[RaceWeekend], day: datetime.date) -> RaceWeekend | None:
+    'Binary search the sorted race weekends for the current or next weekend on day'
+    i = bisect.bisect_left(weekends, day, key=lambda w: w.end)
+    return weekends[i] if i < len(weekends) else None
+
+
+def race_weekend_schedule(interval: datetime.timedelta, idle: datetime.timedelta | None = None):
+    '''
+    Return a next fire provider which runs a task every interval during race weekends. Between them the
+    task is dormant, or runs every idle interval if given
+    '''
+
+    def next_fire(plugin: InformaPlugin, last_run: datetime.datetime | None) -> datetime.datetime | None:
+        now = now_aest()
+        earliest = (last_run + interval).astimezone(now.tzinfo) if last_run else now
+        fires = []
+
+        weekend = next_race_weekend(plugin.load_state().weekends, earliest.date())
+        if weekend is not None:
+            start = datetime.datetime.combine(weekend.start, datetime.time(), tzinfo=now.tzinfo)
+            if earliest >= start:
+                return earliest
+            fires.append(start)
+
+        if idle is not None:
+            fires.append((last_run + idle).astimezone(now.tzinfo) if last_run else now)
+
+        return min(fires, default=None)
 
-    logger.debug('Today not within F1 weekend range')
+    return next_fire
+
+
+@app.task('every 1 hour')
+def refresh_calendar(plugin):
+    'Refresh the cached calendar daily'
+    state = plugin.load_state()
+
+    stale = state.calendar_synced is None or now_aest() - state.calendar_synced > CALENDAR_MAX_AGE
+    if stale and sync_f1_calendar(state, plugin.load_config()):
+        plugin.write_state(state)
+
+
+@app.task(race_weekend_schedule(datetime.timedelta(minutes=15)))
+def run(plugin):
+    # Sync, like every plugin's run: execute changes the process working directory, so can't safely run in a
+    # worker thread alongside other tasks. Discovery blocks the event loop for at most DISCOVERY_DEADLINE
+    plugin.execute()
 
 
 def main(state: State, config: Config) -> int:
@@ -123,192 +359,356 @@ def main(state: State, config: Config) -> int:
     Check for new F1 torrents and add to rtorrent
     '''
     try:
-        if check_thepiratebay(config.current_season, state):
-            # if torrents found, try to add immediately
-            add_magnet_to_rtorrent(state.races)
-            return 1
+        found = discover_torrents(config, state)
     except FailedFetchingTorrents as e:
         logger.error(e)
+        return 0
 
-    return 0
+    added = [torrent for torrent in found if save_magnet_as_download(state, torrent)]
+    return 1 if added else 0
 
 
-@app.task('every 5 minute')
-def set_torrent_file_priorities(plugin):
+@app.task(race_weekend_schedule(datetime.timedelta(minutes=1), idle=SNAPSHOT_IDLE_INTERVAL))
+async def poll_torrents(plugin):
     '''
-    Set priority high on the 02.Race.Session or 02.Qualifying.Session torrent parts
+    Refresh the shared snapshot of torrents from rtorrent
     '''
-    rt = RTorrent(RTORRENT_HOST, 5000)
     try:
-        torrents = rt.get_torrents()
+        changed = await snapshot.refresh(AsyncRTorrent(RTORRENT_HOST, RTORRENT_PORT))
     except RtorrentError as e:
         # No error logging to save log noise when jorg is switched off
         logger.debug(e)
         return
 
-    for hash_id, torrent_data in torrents.items():
-        if 'Formula.1.' not in torrent_data['name']:
-            continue
+    if changed:
+        logger.debug('Refreshed %s changed torrents', changed)
+
+
+@app.task('every 5 minute')
+async def set_torrent_file_priorities(plugin):
+    '''
+    Tag F1 torrents, and set priority high on the 02.Race.Session or 02.Qualifying.Session torrent parts
+    '''
+    if snapshot.refreshed is None:
+        # Snapshot not yet loaded from rtorrent
+        return
+
+    # Forget torrents which have been removed from rtorrent
+    reconciled.intersection_update(snapshot.torrents)
+
+    pending = {hash_id: t for hash_id, t in snapshot.filter('Formula.1.').items() if hash_id not in reconciled}
 
+    if calls := plan_reconciliation(pending):
         try:
-            # Set label on F1 torrents
-            rt.set_tag(hash_id, 'F1')
+            await AsyncRTorrent(RTORRENT_HOST, RTORRENT_PORT).multicall(calls)
         except RtorrentError as e:
-            logger.error('Failed setting tag on %s (%s)', hash_id, e)
-            continue
+            logger.error('Failed setting tags and priorities (%s)', e)
+            return
 
-        for i, file_data in enumerate(torrent_data['files']):
-            if '02' in file_data['filename']:
-                try:
-                    pri = rt.get_file_priority(hash_id, i)
+        logger.debug('Applied %s tag and priority changes', len(calls))
 
-                    if pri != RT_PRI_HIGH:
-                        rt.set_file_priority(hash_id, i, RT_PRI_HIGH)
-                        logger.debug('Set high priority on %s', torrent_data['name'])
+        # Show the new priorities in the snapshot once the next refresh has fetched them
+        snapshot.invalidate({params[0].split(':')[0] for _, params in calls})
 
-                except RtorrentError as e:
-                    logger.error('Failed setting priority on %s:%s (%s)', hash_id, i, e)
-                    continue
+    # Magnets have no files until their metadata arrives; check those again next time
+    reconciled.update(hash_id for hash_id, t in pending.items() if t['files'])
+
+
+def plan_reconciliation(torrents: dict[str, dict]) -> list[tuple[str, tuple]]:
+    '''
+    Compare desired tag and file priorities with the actual state of torrents in the snapshot
+
+    Returns:
+        The rtorrent calls needed to reconcile, as (methodname, params)
+    '''
+    calls = []
+
+    for hash_id, torrent_data in torrents.items():
+        if torrent_data['tag'] != RT_TAG:
+            calls.append(('d.custom1.set', (hash_id, RT_TAG)))
+
+        files = [i for i, f in enumerate(torrent_data['files']) if '02' in f['filename'] and f['priority'] != 'high']
+        if files:
+            calls.extend(('f.priority.set', (f'{hash_id}:f{i}', RT_PRI_HIGH)) for i in files)
+
+            # File priority changes only take effect once rtorrent updates the download
+            calls.append(('d.update_priorities', (hash_id,)))
+            logger.debug('Set high priority on %s', torrent_data['name'])
 
+    return calls
 
-@app.task('every 15 minutes')
-def add_torrents(plugin):
+
+@app.task(after_success(f'{__name__}.run'))
+async def add_torrents(plugin):
+    '''
+    Add pending magnets to rtorrent, straight after each run has found them. Async so jorg can be woken
+    without blocking the event loop
+    '''
+    pending = {key: race for key, race in plugin.load_state().races.items() if not race.added_to_rtorrent}
+    if not await add_magnet_to_rtorrent(pending):
+        return
+
+    # Other tasks write state while rtorrent and jorg are awaited; so reload, and merge only the magnets
+    # added here
     state = plugin.load_state()
-    if add_magnet_to_rtorrent(state.races):
-        plugin.write_state(state)
+    for key, race in pending.items():
+        if race.added_to_rtorrent and key in state.races:
+            state.races[key].added_to_rtorrent = True
+    plugin.write_state(state)
 
 
-def add_magnet_to_rtorrent(races: dict[str, Download]) -> bool:
+async def add_magnet_to_rtorrent(races: dict[str, Download]) -> bool:
     '''
-    Add magnets directly to rtorrent via RPC
+    Add magnets directly to rtorrent via RPC, without blocking the scheduler's event loop
     '''
     torrent_added = False
 
+    rt = AsyncRTorrent(RTORRENT_HOST, RTORRENT_PORT)
+
     for key, race_data in races.items():
         if not race_data.added_to_rtorrent:
             try:
-                rt = RTorrent(RTORRENT_HOST, 5000)
-                rt.add_magnet(race_data.magnet)
-            except RtorrentError as e:
-                if 'No route to host' in str(e):
-                    # Wake jorg via wol-sender running on 3001
-                    requests.get('http://trevor:3001/wake/d0:50:99:c1:63:c9', timeout=3)
-                    logger.info('WOL packet sent to wake rtorrent')
-                    return False
+                await rt.add_magnet(race_data.magnet)
+            except RtorrentUnreachable:
+                # Wake jorg and wait for rtorrent to accept connections, then retry in this same run
+                if not await ensure_awake_async(logger, RTORRENT_HOST, RTORRENT_PORT, JORG_MAC):
+                    return torrent_added
 
+                try:
+                    await rt.add_magnet(race_data.magnet)
+                except RtorrentError as e:
+                    logger.error('Failed adding magnet for %s (%s)', key, e)
+                    continue
+            except RtorrentError as e:
                 logger.error('Failed adding magnet for %s (%s)', key, e)
                 continue
 
-            # parse magnet link to get torrent filename
-            qs = urlparse(race_data.magnet).query.split('&')
-            filename = next((p[3:] for p in qs if p.startswith('dn=')), '')
-
-            logger.info('Added magnet for %s', filename)
-            race_data.added_to_rtorrent = True
-
-            mailgun.send(
-                logger,
-                f'{filename} torrent added',
-                TEMPLATE_NAME,
-                {
-                    'filename': filename,
-                },
-            )
+            magnet_added(race_data)
             torrent_added = True
 
     return torrent_added
 
 
-def check_thepiratebay(current_season: int, state: State) -> bool:
+def magnet_added(race_data: Download):
+    'Mark a download as added to rtorrent, and send a notification'
+    # parse magnet link to get torrent filename
+    qs = urlparse(race_data.magnet).query.split('&')
+    filename = next((p[3:] for p in qs if p.startswith('dn=')), '')
+
+    logger.info('Added magnet for %s', filename)
+    race_data.added_to_rtorrent = True
+
+    mailgun.send(
+        logger,
+        f'{filename} torrent added',
+        TEMPLATE_NAME,
+        {
+            'filename': filename,
+        },
+    )
+
+
+# Updated trackers for piratebay Dec 2025
+THEPIRATEBAY_TRACKERS = '&tr=http%3A%2F%2Fp4p.arenabg.com%3A1337%2Fannounce&tr=udp%3A%2F%2F47.ip-51-68-199.eu%3A6969%2Fannounce&tr=udp%3A%2F%2F9.rarbg.me%3A2780%2Fannounce&tr=udp%3A%2F%2F9.rarbg.to%3A2710%2Fannounce&tr=udp%3A%2F%2F9.rarbg.to%3A2730%2Fannounce&tr=udp%3A%2F%2F9.rarbg.to%3A2920%2Fannounce&tr=udp%3A%2F%2Fopen.stealth.si%3A80%2Fannounce&tr=udp%3A%2F%2Fopentracker.i2p.rocks%3A6969%2Fannounce&tr=udp%3A%2F%2Ftracker.coppersurfer.tk%3A6969%2Fannounce&tr=udp%3A%2F%2Ftracker.cyberia.is%3A6969%2Fannounce&tr=udp%3A%2F%2Ftracker.dler.org%3A6969%2Fannounce&tr=udp%3A%2F%2Ftracker.internetwarriors.net%3A1337%2Fannounce&tr=udp%3A%2F%2Ftracker.leechers-paradise.org%3A6969%2Fannounce&tr=udp%3A%2F%2Ftracker.openbittorrent.com%3A6969%2Fannounce&tr=udp%3A%2F%2Ftracker.opentrackr.org%3A1337&tr=udp%3A%2F%2Ftracker.pirateparty.gr%3A6969%2Fannounce&tr=udp%3A%2F%2Ftracker.tiny-vps.com%3A6969%2Fannounce&tr=udp%3A%2F%2Ftracker.torrent.eu.org%3A451%2Fannounce'
+
+# Shared between polls, to reuse connections to each source
+http = requests.Session()
+
+
+def discover_torrents(config: Config, state: State) -> list[FoundTorrent]:
     '''
-    Query thepiratebay for smcgill1969 torrents
+    Query all configured torrent sources concurrently, returning new torrents deduped by info hash
+    across sources and against those already in state
+
+    Results are merged in the order of config.sources, so the first source's release is preferred for
+    each session regardless of which source answers first. Sources which miss DISCOVERY_DEADLINE are skipped
+    for this poll
     '''
+    known = {d.info_hash for d in state.races.values() if d.info_hash}
+    results: dict[str, list[FoundTorrent]] = {}
+
+    executor = ThreadPoolExecutor(max_workers=len(config.sources) or 1)
     try:
-        sess = requests.Session()
-        resp = sess.get('https://apibay.org/q.php?q=user%3Asmcgill1969', timeout=5)
-    except requests.RequestException as e:
-        raise FailedFetchingTorrents('Failed loading from https://apibay.org/q.php') from e
+        futures = {
+            executor.submit(SOURCES[source], config.current_season, SOURCE_TIMEOUT): source for source in config.sources
+        }
 
-    RACE_TYPES = {'Race', 'Qualifying', 'Sprint', 'Season.Review', 'Shootout'}
+        for future in as_completed(futures, timeout=DISCOVERY_DEADLINE):
+            try:
+                results[futures[future]] = future.result()
+            except FailedFetchingTorrents as e:
+                logger.warning(e)
 
-    ret = False
+    except TimeoutError:
+        slow = [source for future, source in futures.items() if not future.done()]
+        logger.warning('Skipped torrent sources which missed the deadline: %s', ', '.join(slow))
+    finally:
+        # Return without waiting on slow sources; their requests end at their own timeout
+        executor.shutdown(wait=False, cancel_futures=True)
 
-    for torrent in resp.json():
-        title = torrent['name']
-        info_hash = torrent['info_hash']
+    if config.sources and not results:
+        raise FailedFetchingTorrents('Failed loading from all torrent sources')
 
-        if 'Formula.1' in title and str(current_season) in title and 'SkyF1UHD' in title:
-            if not any(s in title for s in RACE_TYPES) or 'Teds' in title:
-                logger.debug('Skipped: %s', title)
-                continue
+    found: dict[str, FoundTorrent] = {}
+    for source in config.sources:
+        for torrent in results.get(source, []):
+            if torrent.info_hash not in known:
+                found.setdefault(torrent.info_hash, torrent)
 
-            # Updated trackers for piratebay Dec 2025
-            magnet = f'magnet:?xt=urn:btih:{info_hash}&dn={title}&tr=http%3A%2F%2Fp4p.arenabg.com%3A1337%2Fannounce&tr=udp%3A%2F%2F47.ip-51-68-199.eu%3A6969%2Fannounce&tr=udp%3A%2F%2F9.rarbg.me%3A2780%2Fannounce&tr=udp%3A%2F%2F9.rarbg.to%3A2710%2Fannounce&tr=udp%3A%2F%2F9.rarbg.to%3A2730%2Fannounce&tr=udp%3A%2F%2F9.rarbg.to%3A2920%2Fannounce&tr=udp%3A%2F%2Fopen.stealth.si%3A80%2Fannounce&tr=udp%3A%2F%2Fopentracker.i2p.rocks%3A6969%2Fannounce&tr=udp%3A%2F%2Ftracker.coppersurfer.tk%3A6969%2Fannounce&tr=udp%3A%2F%2Ftracker.cyberia.is%3A6969%2Fannounce&tr=udp%3A%2F%2Ftracker.dler.org%3A6969%2Fannounce&tr=udp%3A%2F%2Ftracker.internetwarriors.net%3A1337%2Fannounce&tr=udp%3A%2F%2Ftracker.leechers-paradise.org%3A6969%2Fannounce&tr=udp%3A%2F%2Ftracker.openbittorrent.com%3A6969%2Fannounce&tr=udp%3A%2F%2Ftracker.opentrackr.org%3A1337&tr=udp%3A%2F%2Ftracker.pirateparty.gr%3A6969%2Fannounce&tr=udp%3A%2F%2Ftracker.tiny-vps.com%3A6969%2Fannounce&tr=udp%3A%2F%2Ftracker.torrent.eu.org%3A451%2Fannounce'
+    return list(found.values())
 
-            if save_magnet_as_download(state, title, magnet):
-                ret = True
 
-    return ret
+@functools.lru_cache(maxsize=4096)
+def classify(title: str) -> Release | None:
+    '''
+    Extract season, round, session type and quality from a release title. The regex scan costs a few times
+    more than plain substring checks, so wanted_release prefilters titles, and as sources return mostly the
+    same titles on every poll, results are cached
 
+    Returns:
+        None if the title isn't an F1 release
+    '''
+    m = RELEASE_PREFIX.match(title)
+    if not m:
+        return None
+
+    tokens = {}
+    for token in RELEASE_TOKENS.finditer(title, m.end()):
+        tokens.setdefault(token.lastgroup, token.group())
 
-def check_torrentgalaxy(current_season: int, state: State) -> bool:
+    # Race / Qualifying / Sprint etc
+    if 'sprint' in tokens:
+        session_type = 'sq' if 'qualifying' in tokens else 'sr'
+    elif 'qualifying' in tokens:
+        session_type = 'qu'
+    elif 'race' in tokens:
+        session_type = 'ra'
+    elif 'review' in tokens:
+        session_type = 'rv'
+    else:
+        session_type = None
+
+    return Release(
+        season=int(m.group('season')),
+        round=int(m.group('round')),
+        session_type=session_type,
+        quality=tokens.get('quality'),
+        teds='teds' in tokens,
+    )
+
+
+def wanted_release(title: str, current_season: int, quality: str) -> Release | None:
+    '''
+    Classify a release title, returning the Release only if it's a race session in the current season.
+    Titles from other seasons, in other qualities or without a session word are skipped with plain substring
+    checks, so only likely matches pay for the regex scan
+    '''
+    if not title.startswith(f'Formula.1.{current_season}x') or quality not in title:
+        return None
+    if not any(word in title for word in SESSION_WORDS):
+        return None
+
+    release = classify(title)
+    return release if is_wanted(title, release, current_season, quality) else None
+
+
+def is_wanted(title: str, release: Release | None, current_season: int, quality: str) -> bool:
+    'Filter for race sessions in the current season'
+    if release is None or release.season != current_season or not (release.quality or '').startswith(quality):
+        return False
+
+    if release.session_type is None or release.teds:
+        logger.debug('Skipped: %s', title)
+        return False
+
+    return True
+
+
+def parse_info_hash(magnet: str) -> str | None:
+    'Extract the info hash from a magnet link, normalised to uppercase hex'
+    for xt in parse_qs(urlparse(magnet).query).get('xt', []):
+        if xt.startswith('urn:btih:'):
+            info_hash = xt[9:]
+            if len(info_hash) == 32:
+                # Base32 encoded
+                info_hash = base64.b32decode(info_hash.upper()).hex()
+            return info_hash.upper()
+    return None
+
+
+def query_thepiratebay(current_season: int, timeout: float) -> list[FoundTorrent]:
+    '''
+    Query thepiratebay for smcgill1969 torrents
+    '''
+    try:
+        resp = http.get('https://apibay.org/q.php?q=user%3Asmcgill1969', timeout=timeout)
+        resp.raise_for_status()
+        torrents = resp.json()
+    except (requests.RequestException, ValueError) as e:
+        raise FailedFetchingTorrents('Failed loading from https://apibay.org/q.php') from e
+
+    found = []
+
+    for torrent in torrents:
+        title = torrent['name']
+
+        if release := wanted_release(title, current_season, 'SkyF1UHD'):
+            magnet = f'magnet:?xt=urn:btih:{torrent["info_hash"]}&dn={title}{THEPIRATEBAY_TRACKERS}'
+            found.append(FoundTorrent(torrent['info_hash'].upper(), title, release, magnet))
+
+    return found
+
+
+def query_torrentgalaxy(current_season: int, timeout: float) -> list[FoundTorrent]:
     torrent_url = 'https://torrentgalaxy.to/rss?magnet&user=48067'
 
     try:
-        sess = requests.Session()
-        resp = sess.get(torrent_url, timeout=5)
+        resp = http.get(torrent_url, timeout=timeout)
+        resp.raise_for_status()
 
     except requests.RequestException as e:
         raise FailedFetchingTorrents(f'Failed loading from {torrent_url}') from e
 
     feed = feedparser.parse(resp.text)
 
-    ret = False
-
-    RACE_TYPES = {'Race', 'Qualifying', 'Sprint', 'Season.Review', 'Shootout'}
+    found = []
 
     for entry in feed['entries']:
         title = entry['title']
 
-        if 'Formula.1' in title and str(current_season) in title and 'SkyF1HD.1080p' in title:
-            if not any(s in title for s in RACE_TYPES) or 'Teds' in title:
-                logger.debug('Skipped: %s', title)
-                continue
+        release = wanted_release(title, current_season, 'SkyF1HD.1080p')
+        if not release:
+            continue
 
-            try:
-                # Find magnet link
-                magnet = entry['links'][0]['href']
-                if not magnet:
-                    raise ValueError
-            except (ValueError, KeyError, IndexError):
-                logger.error('Failed extracting magnet: %s', entry.get('links', 'No key "links" on entry obj!'))
-                continue
+        try:
+            # Find magnet link
+            magnet = entry['links'][0]['href']
+            info_hash = parse_info_hash(magnet)
+            if not info_hash:
+                raise ValueError
+        except (ValueError, KeyError, IndexError):
+            logger.error('Failed extracting magnet: %s', entry.get('links', 'No key "links" on entry obj!'))
+            continue
 
-            if save_magnet_as_download(state, title, magnet):
-                ret = True
+        found.append(FoundTorrent(info_hash, title, release, magnet))
 
-    return ret
+    return found
 
 
-def save_magnet_as_download(state: State, title: str, magnet: str) -> bool:
-    'Add title/magnet as Download object to state'
-    # Race / Qualifying / Sprint etc
-    if 'Sprint' in title:
-        session_type = 'sq' if 'Qualifying' in title else 'sr'
-    elif 'Qualifying' in title:
-        session_type = 'qu'
-    elif 'Race' in title:
-        session_type = 'ra'
-    else:
-        session_type = 'rv'
+SOURCES = {
+    'thepiratebay': query_thepiratebay,
+    'torrentgalaxy': query_torrentgalaxy,
+}
 
-    logger.debug('Found: %s (%s)', title, session_type)
 
-    # Create a different key for each session type (eg. 2023x04ra)
-    key = f'{title[10:17]}{session_type}'
+def save_magnet_as_download(state: State, torrent: FoundTorrent) -> bool:
+    'Add found torrent as Download object to state'
+    logger.debug('Found: %s (%s)', torrent.title, torrent.release.session_type)
+
+    key = torrent.release.key
 
     if key not in state.races:
-        state.races[key] = Download(key=key, title=title, magnet=magnet)
+        state.races[key] = Download(key=key, title=torrent.title, magnet=torrent.magnet, info_hash=torrent.info_hash)
         return True
     return False
 
@@ -317,51 +717,113 @@ class RtorrentError(Exception):
     pass
 
 
+class RtorrentUnreachable(RtorrentError):
+    'No route to the rtorrent host, which happens while jorg is asleep'
+
+
 class SCGITransport(xmlrpc.client.Transport):
+    '''
+    XML-RPC over SCGI
+
+    rtorrent closes the connection after every SCGI response, so sockets cannot be reused between
+    requests; the resolved address is cached instead. Responses are read into a preallocated buffer,
+    and the body is streamed into the XML parser as it arrives.
+    '''
+
+    def __init__(self, bufsize: int = SCGI_RECV_BUFSIZE):
+        super().__init__()
+        self._buf = bytearray(bufsize)
+        self._addrinfo = {}
+
     def single_request(self, host, handler, request_body, verbose=0):  # noqa: ARG002
-        # Create SCGI header
-        header = f'CONTENT_LENGTH\x00{len(request_body)}\x00SCGI\x001\x00'
-        request_body = f'{len(header)}:{header},{request_body}'
-        sock = None
+        if isinstance(request_body, str):
+            request_body = request_body.encode()
+
+        with self.connect(host, handler) as sock:
+            sock.sendall(scgi_request(request_body))
+            return self.parse_response(sock)
+
+    def connect(self, host, handler) -> socket.socket:
+        'Open a socket to rtorrent, via TCP when host is set, else the unix socket at handler'
+        if host:
+            if host not in self._addrinfo:
+                hostname, port = host.split(':')
+                self._addrinfo[host] = socket.getaddrinfo(hostname, port, socket.AF_INET, socket.SOCK_STREAM)[0]
+            family, type_, proto, _, address = self._addrinfo[host]
+        else:
+            family, type_, proto, address = socket.AF_UNIX, socket.SOCK_STREAM, 0, handler
+
+        sock = socket.socket(family, type_, proto)
+        try:
+            sock.connect(address)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def parse_response(self, sock):
+        response = SCGIResponseParser(*self.getparser())
+        view = memoryview(self._buf)
 
+        while size := sock.recv_into(view):
+            response.feed(view[:size])
+
+        return response.close()
+
+
+class SCGIResponseParser:
+    '''
+    Incrementally strip the SCGI headers from a response, streaming the XML-RPC body into expat
+
+    SCGI headers are accumulated until the blank line; after which all data is body.
+    '''
+
+    def __init__(self, parser, unmarshaller):
+        self.parser = parser
+        self.unmarshaller = unmarshaller
+        self.header = bytearray()
+        self.in_body = False
+
+    def feed(self, data: bytes | memoryview):
         try:
-            if host:
-                host, port = host.split(':')
-                addrinfo = socket.getaddrinfo(host, port, socket.AF_INET, socket.SOCK_STREAM)
-                sock = socket.socket(*addrinfo[0][:3])
-                sock.connect(addrinfo[0][4])
-            else:
-                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-                sock.connect(handler)
-
-            sock.send(request_body.encode('ascii'))
-            return self.parse_response(sock.makefile())
+            if self.in_body:
+                self.parser.feed(data)
+                return
 
-        finally:
-            if sock:
-                sock.close()
+            self.header += data
+            body_start = find_scgi_body(self.header)
+            if body_start != -1:
+                self.in_body = True
+                self.parser.feed(self.header[body_start:])
 
-    def parse_response(self, response):
-        p, u = self.getparser()
+        except (ValueError, ExpatError) as e:
+            raise RtorrentError('Failed parsing SCGI response!') from e
 
-        response_body = ''
-        while True:
-            data = response.read(1024)
-            if not data:
-                break
-            response_body += data
+    def close(self) -> tuple:
+        'Return the unmarshalled response params, raising xmlrpc.client.Fault on a fault response'
+        if not self.in_body:
+            raise RtorrentError('Failed parsing SCGI response!')
 
         try:
-            # Remove SCGI headers from the response
-            _, response_body = re.split(r'\n\s*?\n', response_body, maxsplit=1)
-            p.feed(response_body)
-            p.close()
-            return u.close()
+            self.parser.close()
+            return self.unmarshaller.close()
 
-        except ValueError as e:
+        except (ValueError, ExpatError) as e:
             raise RtorrentError('Failed parsing SCGI response!') from e
 
 
+def find_scgi_body(data: bytes | bytearray) -> int:
+    'Return the offset of the body following the SCGI response headers, or -1 if incomplete'
+    offsets = [i + len(sep) for sep in (b'\r\n\r\n', b'\n\n') if (i := data.find(sep)) != -1]
+    return min(offsets, default=-1)
+
+
+def scgi_request(body: bytes) -> bytes:
+    'Wrap an XML-RPC request body in an SCGI request, with the header as a netstring'
+    header = b'CONTENT_LENGTH\x00%d\x00SCGI\x001\x00' % len(body)
+    return b'%d:%s,%s' % (len(header), header, body)
+
+
 class SCGIServerProxy(xmlrpc.client.ServerProxy):
     def __init__(self, uri):
         uri = urlparse(uri)
@@ -416,70 +878,92 @@ class RTorrent:
     def __init__(self, host, port):
         self.server = SCGIServerProxy(f'scgi://{host}:{port}/')
 
-    def get_torrents(self, tag_filter=None):
+    def get_torrents(self, view='main', name_filter=None, tag_filter=None):
+        '''
+        Fetch downloads and their files from rtorrent
+
+        Files are only fetched for downloads which pass the filters, and are batched into chunked
+        system.multicall requests; so the whole dataset costs a couple of round-trips, not one per torrent.
+
+        Params:
+            view (str):         rtorrent view to list, filtered server-side
+            name_filter (str):  only include downloads with this substring in their name
+            tag_filter (str):   only include downloads with this tag in custom1
+        Returns:
+            dict of download hash_id to torrent data
+        '''
+        downloads = self.list_downloads(view, name_filter, tag_filter)
+        files = self.get_files([d[0] for d in downloads])
+
+        return {d[0]: build_torrent(d, files[d[0]]) for d in downloads}
+
+    def list_downloads(self, view='main', name_filter=None, tag_filter=None):
+        '''
+        List downloads in a view, without their files
+
+        Params:
+            view (str):         rtorrent view to list
+            name_filter (str):  only include downloads with this substring in their name
+            tag_filter (str):   only include downloads with this tag in custom1
+        Returns:
+            list of [hash, name, completed_bytes, custom1]
+        '''
         try:
             downloads = self.server.d.multicall2(
                 '',  # empty target
-                'main',
+                view,
                 'd.hash=',
                 'd.name=',
                 'd.completed_bytes=',
                 'd.custom1=',
             )
             if downloads is None:
-                raise RtorrentError('get_torrents: Failed to load from rtorrent SCGI')
+                raise RtorrentError('list_downloads: Failed to load from rtorrent SCGI')
 
         except ConnectionRefusedError as e:
-            raise RtorrentError('get_torrents: Rtorrent is down') from e
+            raise RtorrentError('list_downloads: Rtorrent is down') from e
         except (OSError, xmlrpc.client.Fault) as e:
-            raise RtorrentError(f'get_torrents: Failed to load from rtorrent SCGI: {e}') from e
+            raise RtorrentError(f'list_downloads: Failed to load from rtorrent SCGI: {e}') from e
 
-        data = {}
+        return [
+            d for d in downloads if (not name_filter or name_filter in d[1]) and (not tag_filter or d[3] == tag_filter)
+        ]
 
-        for d in downloads:
-            if not tag_filter or (tag_filter and d[4] == tag_filter):
-                # calculate % done
-                data[d[0]] = {
-                    'name': d[1],
-                    'size': format_size(d[2]),
-                    'tag': d[3],
-                    'files': [],
-                }
+    def get_files(self, hash_ids):
+        '''
+        Fetch the files for many downloads, batching f.multicall into system.multicall requests
 
-                try:
-                    files = self.server.f.multicall(
-                        d[0],
-                        '',
-                        'f.path=',
-                        'f.size_bytes=',
-                        'f.size_chunks=',
-                        'f.completed_chunks=',
-                        'f.priority=',
-                    )
-                except ConnectionRefusedError as e:
-                    raise RtorrentError('get_torrents: Rtorrent is down') from e
-                except (OSError, xmlrpc.client.Fault) as e:
-                    raise RtorrentError(f'get_torrents: Failed to load d.files from rtorrent SCGI: {e}') from e
-
-                for f in files:
-                    data[d[0]]['files'].append({
-                        'filename': f[0],
-                        'size': format_size(f[1]),
-                        'progress': f'{float(f[3]) / float(f[2]) * 100:.1f}%' if f[2] else 0,
-                        'priority': 'skip' if f[4] == RT_PRI_OFF else 'high' if f[4] == RT_PRI_HIGH else 'normal',
-                    })
+        Params:
+            hash_ids (list):  download hash_ids
+        Returns:
+            dict of hash_id to list of [path, size_bytes, size_chunks, completed_chunks, priority]
+        '''
+        files = {}
+
+        for i in range(0, len(hash_ids), RT_MULTICALL_CHUNK):
+            chunk = hash_ids[i : i + RT_MULTICALL_CHUNK]
+
+            multicall = xmlrpc.client.MultiCall(self.server)
+            for hash_id in chunk:
+                multicall.f.multicall(
+                    hash_id,
+                    '',
+                    'f.path=',
+                    'f.size_bytes=',
+                    'f.size_chunks=',
+                    'f.completed_chunks=',
+                    'f.priority=',
+                )
 
-                try:
-                    # torrent total progress based on each file's progress, ignoring 'skipped' files
-                    torrent_progress = sum(f[3] for f in files if f[4] > 0) / sum(f[2] for f in files if f[4] > 0) * 100
-                except ZeroDivisionError:
-                    # all files are 'skip'
-                    torrent_progress = 0
+            try:
+                files.update(zip(chunk, multicall(), strict=True))
 
-                data[d[0]]['progress'] = f'{torrent_progress:.1f}%'
-                data[d[0]]['complete'] = torrent_progress == 100  # noqa: PLR2004
+            except ConnectionRefusedError as e:
+                raise RtorrentError('get_files: Rtorrent is down') from e
+            except (OSError, xmlrpc.client.Fault) as e:
+                raise RtorrentError(f'get_files: Failed to load d.files from rtorrent SCGI: {e}') from e
 
-        return data
+        return files
 
     def add_magnet(self, magnet_url):
         '''
@@ -548,6 +1032,174 @@ class RTorrent:
             raise RtorrentError(f'get_file_priority: Failed to load from rtorrent SCGI: {e}') from e
 
 
+class AsyncRTorrent:
+    '''
+    asyncio client for rtorrent, for use inside the scheduler's event loop
+
+    SCGI serves a single request per connection, so concurrent calls each open their own connection;
+    a semaphore bounds how many are in flight against rtorrent at once.
+    '''
+
+    def __init__(self, host, port, timeout=RT_TIMEOUT, max_connections=RT_MAX_CONNECTIONS):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.semaphore = asyncio.Semaphore(max_connections)
+
+    async def call(self, methodname, *params):
+        '''
+        Make a single XML-RPC call to rtorrent
+
+        Params:
+            methodname (str):  rtorrent command
+            params:            command parameters
+        Returns:
+            The command's return value
+        '''
+        request = scgi_request(xmlrpc.client.dumps(params, methodname).encode())
+
+        try:
+            async with self.semaphore:
+                # Timeout applies to the call itself, not time queued behind other calls
+                params = await asyncio.wait_for(self._request(request), self.timeout)
+        except TimeoutError as e:
+            raise RtorrentError(f'{methodname}: No response after {self.timeout}s') from e
+        except ConnectionRefusedError as e:
+            raise RtorrentError(f'{methodname}: Rtorrent is down') from e
+        except OSError as e:
+            # asyncio reports a failed connect with its own message, so match on errno not the text
+            if e.errno == errno.EHOSTUNREACH:
+                raise RtorrentUnreachable(f'{methodname}: No route to rtorrent host: {e}') from e
+            raise RtorrentError(f'{methodname}: Failed to load from rtorrent SCGI: {e}') from e
+        except xmlrpc.client.Fault as e:
+            raise RtorrentError(f'{methodname}: Failed to load from rtorrent SCGI: {e}') from e
+
+        return params[0] if len(params) == 1 else params
+
+    async def _request(self, request: bytes) -> tuple:
+        'Send an SCGI request over a new connection, streaming the response into the XML parser'
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            writer.write(request)
+            await writer.drain()
+
+            response = SCGIResponseParser(*xmlrpc.client.getparser())
+            while data := await reader.read(SCGI_RECV_BUFSIZE):
+                response.feed(data)
+        finally:
+            writer.close()
+
+        return response.close()
+
+    async def multicall(self, calls):
+        '''
+        Make many calls in a single system.multicall round-trip
+
+        Params:
+            calls (list):  tuples of (methodname, params)
+        Returns:
+            list of each call's return value
+        '''
+        results = await self.call(
+            'system.multicall', [{'methodName': methodname, 'params': list(params)} for methodname, params in calls]
+        )
+
+        for result in results:
+            if isinstance(result, dict):
+                raise RtorrentError(f'system.multicall: {result["faultString"]} ({result["faultCode"]})')
+
+        return [result[0] for result in results]
+
+    async def get_torrents(self, view='main', name_filter=None, tag_filter=None):
+        '''
+        Fetch downloads and their files from rtorrent; see RTorrent.get_torrents
+
+        Chunks of file queries are issued concurrently.
+        '''
+        downloads = await self.list_downloads(view, name_filter, tag_filter)
+        files = await self.get_files([d[0] for d in downloads])
+
+        return {d[0]: build_torrent(d, files[d[0]]) for d in downloads}
+
+    async def list_downloads(self, view='main', name_filter=None, tag_filter=None):
+        'List downloads in a view, without their files; see RTorrent.list_downloads'
+        downloads = await self.call('d.multicall2', '', view, 'd.hash=', 'd.name=', 'd.completed_bytes=', 'd.custom1=')
+
+        return [
+            d for d in downloads if (not name_filter or name_filter in d[1]) and (not tag_filter or d[3] == tag_filter)
+        ]
+
+    async def get_files(self, hash_ids):
+        'Fetch the files for many downloads; see RTorrent.get_files'
+        chunks = [hash_ids[i : i + RT_MULTICALL_CHUNK] for i in range(0, len(hash_ids), RT_MULTICALL_CHUNK)]
+
+        results = await asyncio.gather(*[
+            self.multicall([
+                (
+                    'f.multicall',
+                    (
+                        hash_id,
+                        '',
+                        'f.path=',
+                        'f.size_bytes=',
+                        'f.size_chunks=',
+                        'f.completed_chunks=',
+                        'f.priority=',
+                    ),
+                )
+                for hash_id in chunk
+            ])
+            for chunk in chunks
+        ])
+
+        return dict(zip(hash_ids, itertools.chain.from_iterable(results), strict=True))
+
+    async def add_magnet(self, magnet_url):
+        'Add a magnet URL'
+        await self.call('load.start_verbose', '', magnet_url)
+
+    async def set_tag(self, hash_id, tag_name):
+        'Set tag in custom1 field on a torrent'
+        await self.call('d.custom1.set', hash_id, tag_name)
+
+    async def set_file_priority(self, hash_id, file_index, priority):
+        'Set priority of a file in a torrent; 0: skip, 1: normal, 2: high'
+        await self.call('f.priority.set', f'{hash_id}:f{file_index}', priority)
+
+    async def get_file_priority(self, hash_id, file_index):
+        'Get priority of a file in a torrent; 0: skip, 1: normal, 2: high'
+        return await self.call('f.priority', f'{hash_id}:f{file_index}')
+
+
+def build_torrent(download, files):
+    'Convert a row from d.multicall2 and its f.multicall rows into torrent data'
+    torrent = {
+        'name': download[1],
+        'size': format_size(download[2]),
+        'tag': download[3],
+        'files': [
+            {
+                'filename': f[0],
+                'size': format_size(f[1]),
+                'progress': f'{float(f[3]) / float(f[2]) * 100:.1f}%' if f[2] else 0,
+                'priority': 'skip' if f[4] == RT_PRI_OFF else 'high' if f[4] == RT_PRI_HIGH else 'normal',
+            }
+            for f in files
+        ],
+    }
+
+    try:
+        # torrent total progress based on each file's progress, ignoring 'skipped' files
+        torrent_progress = sum(f[3] for f in files if f[4] > 0) / sum(f[2] for f in files if f[4] > 0) * 100
+    except ZeroDivisionError:
+        # all files are 'skip'
+        torrent_progress = 0
+
+    torrent['progress'] = f'{torrent_progress:.1f}%'
+    torrent['complete'] = torrent_progress == 100  # noqa: PLR2004
+    return torrent
+
+
 def format_size(size):
     if size <= 0:
         return '0B'
@@ -573,11 +1225,22 @@ def found(plugin: InformaPlugin):
 
 
 @cli.command
-def get_torrents():
+def get_torrents(plugin: InformaPlugin):
     'Load the current torrents from rtorrent'
-    rt = RTorrent(RTORRENT_HOST, 5000)
-    try:
-        torrents = rt.get_torrents()
-        pretty.table([t for t in torrents.values() if 'Formula.1' in t['name']], columns=('progress', 'name'))
-    except RtorrentError as e:
-        logger.error(e)
+    if snapshot.refreshed is not None and now_aest() - snapshot.refreshed < SNAPSHOT_MAX_AGE:
+        torrents = snapshot.filter('Formula.1')
+    else:
+        # No snapshot when running outside the Informa server, or it's stale; query rtorrent directly
+        try:
+            torrents = RTorrent(RTORRENT_HOST, RTORRENT_PORT).get_torrents(name_filter='Formula.1')
+        except RtorrentError as e:
+            logger.error(e)
+            return
+
+    pretty.table(list(torrents.values()), columns=('progress', 'name'))
+
+
+@router.get('/torrents')
+def serve_torrents():
+    'Serve the current snapshot of torrents in rtorrent'
+    return {'refreshed': snapshot.refreshed, 'torrents': snapshot.torrents}
@@ -1,12 +1,12 @@
 import logging
 from dataclasses import dataclass
 
-import bs4
 import click
 import requests
 
 from informa import app
 from informa.lib import PluginAdapter, StateBase, mailgun
+from informa.lib.html import parse_html
 from informa.lib.plugin import InformaPlugin
 from informa.lib.utils import raise_alarm
 
@@ -51,7 +51,7 @@ def fetch_ha_releases(last_release_seen: str | None) -> NewVersion | None:
         logger.error('Failed loading HA release notes: %s', e)
         return None
 
-    soup = bs4.BeautifulSoup(resp.text, 'html.parser')
+    soup = parse_html(resp.text, fast=True)
 
     try:
         # Extract latest version
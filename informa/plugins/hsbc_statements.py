@@ -5,13 +5,10 @@ import tempfile
 from dataclasses import dataclass
 
 import click
-import googleapiclient
-from google.oauth2.service_account import Credentials
 
-from gmsa import Gmail
-from gmsa.exceptions import AttachmentSaveError
 from informa import app
 from informa.lib import PluginAdapter, StateBase, mailgun
+from informa.lib.gmail import AttachmentSaveError, Message, get_gmail
 from informa.lib.utils import raise_alarm
 from transto import hsbc
 from transto.exceptions import MissingEnvVar
@@ -21,7 +18,8 @@ logger = PluginAdapter(logging.getLogger('informa'))
 
 @dataclass
 class State(StateBase):
-    pass
+    # Gmail historyId from which to look for new statements
+    history_id: str | None = None
 
 
 @app.task('every 24 hours')
@@ -29,42 +27,42 @@ def run(plugin):
     plugin.execute()
 
 
-def main(_) -> int:
-    msg = check_for_email()
+def main(state: State) -> int:
+    result = check_for_email(state.history_id)
+    if result is None:
+        return 0
+    msgs, history_id = result
 
-    if msg and process_statement(msg):
-        logger.info('Processed statement dated %s', msg.date)
-        msg.mark_as_read()
+    if msgs and process_statement(msgs[-1]):
+        logger.info('Processed statement dated %s', msgs[-1].date)
+        msgs[-1].mark_as_read()
+
+        # Only sync from the new historyId once every new statement is processed
+        if len(msgs) == 1:
+            state.history_id = history_id
         return 1
+
+    if not msgs:
+        state.history_id = history_id
     logger.info('No unread messages')
     return 0
 
 
-def check_for_email():
-    'Fetch unread email with HSBC label'
-    try:
-        gmail = Gmail(
-            credentials=Credentials.from_service_account_file(
-                os.environ.get('GSUITE_OAUTH_CREDS'),
-                scopes=['https://www.googleapis.com/auth/gmail.modify'],
-                subject='m@mafro.net',
-            )
-        )
-    except TypeError:
-        logger.error('Bad SSH private key defined in GSUITE_OAUTH_CREDS')
-        return None
-    except googleapiclient.errors.HttpError:
-        logger.error('Failed to authenticate to Google Sheets API')
+def check_for_email(history_id: str | None = None) -> tuple[list[Message], str] | None:
+    'Fetch unread email with HSBC label, added since history_id'
+    gmail = get_gmail(logger)
+    if gmail is None:
         return None
 
     # Fetch unread messages from HSBC/Statements
-    msgs = gmail.get_messages(query='label:hsbc-statements is:unread')
+    msgs, history_id = gmail.sync('label:hsbc-statements is:unread', history_id)
 
-    # Filter for messages with Email Statement.pdf attachment
+    # Fetch message bodies in a single batch, then filter for messages with Email Statement.pdf attachment
+    gmail.fetch(msgs)
     msgs = [m for m in msgs if m.has_attachments() and m.attachments[0].filename == 'Email Statement.pdf']
     logger.debug('Found %d messages', len(msgs))
 
-    return msgs[-1] if len(msgs) >= 1 else None
+    return msgs, history_id
 
 
 def process_statement(msg) -> bool:
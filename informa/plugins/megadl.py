@@ -1,12 +1,16 @@
+import datetime
 import logging
 import os
-import socket
+import shlex
 import warnings
+from collections import deque
+from collections.abc import Iterable
 from dataclasses import dataclass, field
 from typing import List
 
 import click
 from cryptography.utils import CryptographyDeprecationWarning
+from fastapi import APIRouter
 
 with warnings.catch_warnings(action='ignore', category=CryptographyDeprecationWarning):
     import paramiko
@@ -15,13 +19,41 @@ import yaml
 from informa import app
 from informa.lib import PluginAdapter, StateBase
 from informa.lib.plugin import InformaPlugin
+from informa.lib.ssh import Job, pool, run_background, stream_command
+from informa.lib.wol import ensure_awake
 
 logger = PluginAdapter(logging.getLogger('informa'))
 
 
+router = APIRouter(prefix='/megadl')
+
+
+@app.api(router)
+def fastapi():
+    'Register the APIRouter with Informa'
+
+
+JORG_MAC = 'd0:50:99:c1:63:c9'
+
+# Background megadlz jobs; each is recorded in state as it completes
+jobs: list[Job] = []
+# Finished jobs, kept for progress reporting
+recent: deque[Job] = deque(maxlen=10)
+
+
+@dataclass
+class Download:
+    name: str
+    files: int
+    size: int | None
+    duration: float
+    finished: datetime.datetime
+
+
 @dataclass
 class State(StateBase):
     completed: List[str] = field(default_factory=list)
+    downloads: list[Download] = field(default_factory=list)
 
 
 @app.task('every 1 hours')
@@ -32,52 +64,138 @@ def run(plugin):
 def main(state: State) -> int:
     '''
     Trigger downloads from MEGA via SSH to jorg
+
+    megadlz picks the next pending link itself, so downloads run one after another. Each run is a background
+    job which starts the next as soon as it finishes, so a backlog of links is worked through without waiting
+    for the schedule
+
+    Returns:
+        Count of files downloaded since the last run
     '''
-    client = paramiko.client.SSHClient()
-    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())  # noqa: S507
-    try:
-        client.connect(
-            'jorg',
-            username='mafro',
-            key_filename=os.environ.get('JORG_SSH_KEY'),
-            look_for_keys=False,
-            allow_agent=False,
+    count = 0
+
+    for job in [job for job in jobs if job.done]:
+        if parse_output(job.output, 'Downloaded '):
+            count += int(parse_output(job.output, 'Count ') or 0)
+        jobs.remove(job)
+        recent.append(job)
+
+    if jobs:
+        logger.info('%s downloads still in progress', len(jobs))
+        return count
+
+    start_download()
+    return count
+
+
+def start_download():
+    'Run megadlz on jorg as a background job'
+    jobs.append(
+        run_background(
+            logger,
+            connect,
+            'cd {} && megadlz'.format(os.environ.get('MEGADLZ_DIR')),
+            on_complete=download_complete,
         )
+    )
 
-        # Run blocking command over SSH
-        _, stdout, _ = client.exec_command('cd {} && megadlz\n'.format(os.environ.get('MEGADLZ_DIR')))
-        stdout.channel.set_combine_stderr(True)
-        output = stdout.readlines()
 
-    except socket.gaierror:
-        logger.error('Socket error on SSH connect')
-        return 0
+def download_complete(job: Job):
+    '''
+    Measure and record a completed download, and continue with the next pending link
+
+    The download is written to state straight away, rather than by the next scheduled run, so it isn't lost
+    if Informa restarts in between
+    '''
+    measure_download(job)
+
+    plugin = app.plugins[__name__]
+    state = plugin.load_state()
+    record_download(state, job)
+    plugin.write_state(state)
+
+    # No download means no links were pending, or megadlz failed; either way wait for the next run
+    if parse_output(job.output, 'Downloaded '):
+        start_download()
+
+
+def connect() -> paramiko.SSHClient:
+    'Return a pooled SSH connection to jorg, waking it if necessary'
+    key_filename = os.environ.get('JORG_SSH_KEY')
+
+    try:
+        return pool.get('jorg', 'mafro', key_filename)
     except paramiko.ssh_exception.NoValidConnectionsError:
-        # Server jorg is sleeping
-        return 0
-    except paramiko.ssh_exception.SSHException:
-        logger.error('Bad SSH private key defined in JORG_SSH_KEY')
-        return 0
-    finally:
-        client.close()
+        # Server jorg is sleeping; wake it and continue with this run. Only called from background jobs,
+        # so waiting doesn't block the scheduler
+        if not ensure_awake(logger, 'jorg', 22, JORG_MAC):
+            raise
+        return pool.get('jorg', 'mafro', key_filename)
+
+
+def measure_download(job: Job):
+    'Append the size of a completed download to the job output, for recording in state'
+    name = parse_output(job.output, 'Downloaded ')
+    if not name:
+        return
+
+    du: list[str] = []
 
     try:
-        # Extract name & file count downloaded
-        dl = next(iter([line[11:] for line in output if line.startswith('Downloaded ')]))
-        count = next(iter([line[6:] for line in output if line.startswith('Count ')]))
-        error = next(iter([line[6:] for line in output if line.startswith('ERROR:')]))
-        if error:
-            logger.error(error)
-        logger.info('Downloaded %s with %s files', dl.strip(), count.strip())
-
-        # Persist something
-        state.completed.append(dl)
-
-    except StopIteration:
+        stream_command(
+            connect(),
+            'cd {} && du -sb -- {}'.format(os.environ.get('MEGADLZ_DIR'), shlex.quote(name)),
+            du.append,
+        )
+        job.output.append(f'Size {du[0].split()[0]}')
+    except (IndexError, paramiko.SSHException, OSError) as e:
+        logger.warning('Failed measuring %s: %s', name, e)
+
+
+def parse_output(output: Iterable[str], prefix: str) -> str | None:
+    'Return the first line of megadlz output with prefix, minus the prefix'
+    return next(iter([line[len(prefix) :].strip() for line in output if line.startswith(prefix)]), None)
+
+
+def record_download(state: State, job: Job) -> int:
+    '''
+    Record a finished megadlz job in state
+
+    Returns:
+        Count of files downloaded
+    '''
+    # Extract name & file count downloaded
+    dl = parse_output(job.output, 'Downloaded ')
+    count = parse_output(job.output, 'Count ')
+    error = parse_output(job.output, 'ERROR:')
+    if error:
+        logger.error(error)
+
+    if not dl or not count:
+        logger.error('Download failed: %s', job.error or job.exit_status)
         return 0
-    else:
-        # Plugin only ever triggers a single download
-        return int(count)
+
+    size = parse_output(job.output, 'Size ')
+
+    logger.info('Downloaded %s with %s files in %s', dl, count, job.duration)
+
+    state.completed.append(dl)
+    state.downloads.append(
+        Download(
+            name=dl,
+            files=int(count),
+            size=int(size) if size else None,
+            duration=job.duration.total_seconds(),
+            finished=job.finished,
+        )
+    )
+    return int(count)
+
+
+@router.get('/progress')
+def progress():
+    'Report on running and recent megadlz jobs'
+    return [job.to_dict() for job in [*recent, *jobs]]
 
 
 @click.group(name=__name__[16:].replace('_', '-'))
@@ -1,12 +1,12 @@
 import logging
 from dataclasses import dataclass, field
 
-import bs4
 import click
 import requests
 
 from informa import app
 from informa.lib import PluginAdapter, StateBase, mailgun
+from informa.lib.html import parse_html
 from informa.lib.plugin import InformaPlugin
 
 logger = PluginAdapter(logging.getLogger('informa'))
@@ -43,7 +43,7 @@ def query_cellar_releases(products_seen: set[str]) -> int:
         logger.error('Failed loading Tahbilk website: %s', e)
         return None
 
-    soup = bs4.BeautifulSoup(resp.text, 'html.parser')
+    soup = parse_html(resp.text)
 
     found = 0
 
@@ -1,5 +1,8 @@
+import datetime
+import hashlib
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
 
 import click
@@ -8,11 +11,17 @@ import requests
 from informa import app
 from informa.lib import PluginAdapter, StateBase
 from informa.lib.plugin import InformaPlugin
-from informa.lib.utils import raise_alarm
+from informa.lib.utils import now_aest, raise_alarm
 
 logger = PluginAdapter(logging.getLogger('informa'))
 
 
+GANDI_MAX_CONCURRENCY = 4
+
+# Reconcile against the Gandi zone at least this often, even when the tailnet is unchanged
+RECONCILE_INTERVAL = datetime.timedelta(days=1)
+
+
 @dataclass
 class Device:
     hostname: str
@@ -22,6 +31,8 @@ class Device:
 @dataclass
 class State(StateBase):
     tailnet: dict[str, str] = field(default_factory=dict)
+    fingerprint: str | None = None
+    reconciled: datetime.datetime | None = None
 
 
 @app.task('every 30 minutes')
@@ -35,17 +46,62 @@ def main(state: State) -> int:
     if not devices:
         return 0
 
-    updated = 0
+    fingerprint = device_fingerprint(devices)
+
+    if (
+        fingerprint == state.fingerprint
+        and state.reconciled is not None
+        and now_aest() - state.reconciled < RECONCILE_INTERVAL
+    ):
+        logger.debug('Tailnet unchanged (%s)', fingerprint[:12])
+        return 0
+
+    # Diff against the live zone, so changes made outside of informa are also corrected
+    zone = fetch_dns_records()
+    if zone is None:
+        return 0
+
+    changed = [device for device in devices if zone.get(device.hostname) != device.ip]
+
+    # Records already correct in the zone need no update
     for device in devices:
-        # If current IP differs from informa state, update Gandi DNS and refresh state
-        if state.tailnet.get(device.hostname) != device.ip and update_dns_record(device.hostname, device.ip):
+        if device not in changed:
             state.tailnet[device.hostname] = device.ip
-            updated += 1
-            logger.info('Updated %s.mafro.net -> %s', device.hostname, device.ip)
+
+    if not changed:
+        mark_reconciled(state, fingerprint)
+        return 0
+
+    # Gandi has no bulk update for a subset of records (PUT on the zone replaces every record), so apply
+    # each change concurrently
+    with ThreadPoolExecutor(max_workers=GANDI_MAX_CONCURRENCY) as executor:
+        results = executor.map(lambda d: update_dns_record(d.hostname, d.ip), changed)
+
+        updated = 0
+        for device, ok in zip(changed, results, strict=True):
+            if ok:
+                state.tailnet[device.hostname] = device.ip
+                updated += 1
+                logger.info('Updated %s.mafro.net -> %s', device.hostname, device.ip)
+
+    # Failed updates are retried on the next run
+    if updated == len(changed):
+        mark_reconciled(state, fingerprint)
 
     return updated
 
 
+def device_fingerprint(devices: list[Device]) -> str:
+    'Hash of the sorted hostname -> IP pairs, to detect tailnet changes'
+    pairs = sorted(f'{device.hostname}={device.ip}' for device in devices)
+    return hashlib.sha256('\n'.join(pairs).encode()).hexdigest()
+
+
+def mark_reconciled(state: State, fingerprint: str):
+    state.fingerprint = fingerprint
+    state.reconciled = now_aest()
+
+
 def fetch_tailscale_devices() -> list[Device] | None:
     'Fetch devices from Tailscale API'
     tailscale_api_key = os.getenv('TAILSCALE_API_KEY')
@@ -76,6 +132,36 @@ def fetch_tailscale_devices() -> list[Device] | None:
         return None
 
 
+def fetch_dns_records() -> dict[str, str] | None:
+    'Fetch all A records in the Gandi zone, as hostname -> IP'
+    gandi_api_key = os.getenv('GANDI_API_KEY')
+    if not gandi_api_key:
+        logger.error('GANDI_API_KEY environment variable is not set')
+        return None
+
+    try:
+        resp = requests.get(
+            'https://api.gandi.net/v5/livedns/domains/mafro.net/records',
+            headers={'Authorization': f'Bearer {gandi_api_key}'},
+            params={'rrset_type': 'A'},
+            timeout=10,
+        )
+        resp.raise_for_status()
+
+        return {
+            record['rrset_name']: record['rrset_values'][0]
+            for record in resp.json()
+            if record.get('rrset_type') == 'A' and record.get('rrset_values')
+        }
+
+    except requests.RequestException as e:
+        logger.error('Failed to fetch Gandi DNS records: %s', e)
+        return None
+    except (KeyError, TypeError):
+        raise_alarm(logger, 'Gandi DNS record format changed!')
+        return None
+
+
 def update_dns_record(hostname: str, ip: str) -> bool:
     'Update DNS record via Gandi API'
     gandi_api_key = os.getenv('GANDI_API_KEY')
@@ -109,5 +195,8 @@ def cli():
 def current(plugin: InformaPlugin):
     'Show current DNS mappings'
     state = plugin.load_state()
-    for hostname, ip in state.last_ips.items():
+    for hostname, ip in state.tailnet.items():
         click.echo(f'{hostname}.mafro.net: {ip}')
+
+    click.echo(f'\nFingerprint: {state.fingerprint or "None"}')
+    click.echo(f'Last reconciled: {state.reconciled or "Never"}')
@@ -4,22 +4,26 @@ import decimal
 import hashlib
 import logging
 import os
+import pathlib
 import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 from dataclasses import dataclass, field
 from typing import List
 
-import bs4
 import click
 import googleapiclient
 import gspread
 import pandas as pd
 import requests
-from google.oauth2.service_account import Credentials
 from gspread_dataframe import get_as_dataframe, set_with_dataframe
+from requests.adapters import HTTPAdapter
 
-from gmsa import Gmail
 from informa import app
 from informa.lib import PluginAdapter, StateBase, pretty
+from informa.lib.gmail import Message, get_gmail
+from informa.lib.html import parse_html
 from informa.lib.plugin import InformaPlugin
 from informa.lib.utils import raise_alarm
 
@@ -28,6 +32,27 @@ logger = PluginAdapter(logging.getLogger('informa'))
 
 SPREADO_ID = '1hK-10ucfebKcQng0gOC5VOELEvEGUIRbJUKxZQ1m5bA'
 
+# The site blocks headerless requests
+USER_AGENT = (
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0 Safari/537.36'
+)
+
+# Product pages fetched for orders, cached on disk by URL
+PAGE_CACHE_DIR = pathlib.Path(os.environ.get('STATE_DIR', './state')).absolute() / 'tob' / 'pages'
+
+# Pages are refetched for new orders after this long, so a re-ordered wine gets its current price
+PAGE_MAX_AGE = datetime.timedelta(days=1)
+
+# Only pages with the product description are cached; not maintenance or bot-block pages served with a 200
+PRODUCT_MARKUP = re.compile(r'''id=["']?tab-description\b''')
+
+# Concurrent connections to theotherbordeaux.com
+MAX_CONCURRENT_FETCHES = 8
+
+# Order emails parsed concurrently during a backfill, and how often progress is saved
+BACKFILL_WORKERS = 4
+BACKFILL_SAVE_INTERVAL = 10
+
 
 class NoExtractionError(Exception):
     pass
@@ -63,6 +88,14 @@ class OrderLine:
 @dataclass
 class State(StateBase):
     orders: List[Order] = field(default_factory=list)
+    # Drive modifiedTime of the spreadsheet when orders were last synced with it
+    sheet_modified: str | None = None
+    # Gmail historyId from which to look for new order emails
+    history_id: str | None = None
+    # Orders parsed by an unfinished backfill, keyed by Gmail message ID
+    backfill: dict[str, Order] = field(default_factory=dict)
+    # Gmail message IDs which an unfinished backfill failed to parse, and won't retry
+    backfill_failed: list[str] = field(default_factory=list)
 
 
 @app.task('every 12 hours')
@@ -71,28 +104,30 @@ def run(plugin):
 
 
 def main(state: State) -> int:
-    gsuite_creds = os.environ.get('GSUITE_OAUTH_CREDS')
-    if not gsuite_creds:
-        logger.error('No Google service account credentials')
+    if (opened := open_sheet()) is None:
         return 0
+    spreadsheet, sheet = opened
 
-    gc = gspread.service_account(filename=gsuite_creds)
-
-    sheet = gc.open_by_key(SPREADO_ID).worksheet('raw')
+    pages = PageCache(PAGE_CACHE_DIR, max_age=PAGE_MAX_AGE)
 
-    # The spreadsheet is the source of truth for persisted order history.
-    df = get_as_dataframe(sheet)
-    merge_upstream(df, state.orders)
+    # The spreadsheet is the source of truth for persisted order history; only download it when it has
+    # been modified since the last sync
+    modified = spreadsheet.get_lastUpdateTime()
+    if modified != state.sheet_modified or not state.orders:
+        logger.debug('Sheet modified at %s, reloading order history', modified)
+        merge_upstream(get_as_dataframe(sheet), state.orders)
+        state.sheet_modified = modified
 
-    msgs = check_for_email()
-    if msgs is None:
+    result = check_for_email(history_id=state.history_id)
+    if result is None:
         return
+    msgs, history_id = result
 
     order = None
 
     try:
         # Parse the first order
-        if (msg := next(iter(msgs), None)) and (order := parse_email(msg.html)) and order:
+        if (msg := next(iter(msgs), None)) and (order := parse_email(msg.html, pages)) and order:
             logger.info('Order %s found, with %s wines', order.number, len(order.wines))
             msg.mark_as_read()
     except NoExtractionError:
@@ -103,30 +138,48 @@ def main(state: State) -> int:
     if order and order.number not in (o.number for o in state.orders):
         state.orders.append(order)
 
-    if state.orders:
-        # Write to Google Sheets
-        set_with_dataframe(sheet, get_history(state), resize=True)
+        if len(state.orders) == 1:
+            # Write the whole sheet, including the header row
+            set_with_dataframe(sheet, get_history(state), resize=True)
+        else:
+            append_order(sheet, order)
+
+        # Record the modified time of our own write, so the next run doesn't download the sheet again
+        state.sheet_modified = spreadsheet.get_lastUpdateTime()
+
+    # Only sync from the new historyId once every new email is handled, so the rest are found again next run
+    if not msgs or (len(msgs) == 1 and order):
+        state.history_id = history_id
 
     if order:
         return len(order.wines)
     return 0
 
 
-def check_for_email(query: str | None = None) -> Order | None:
-    'Fetch theotherbordeaux emails from the wines label'
-    try:
-        gmail = Gmail(
-            credentials=Credentials.from_service_account_file(
-                os.environ.get('GSUITE_OAUTH_CREDS'),
-                scopes=['https://www.googleapis.com/auth/gmail.modify'],
-                subject='m@mafro.net',
-            )
-        )
-    except TypeError:
-        logger.error('Bad SSH private key defined in GSUITE_OAUTH_CREDS')
+def open_sheet() -> tuple[gspread.Spreadsheet, gspread.Worksheet] | None:
+    'Open the spreadsheet, and its worksheet of raw order history'
+    gsuite_creds = os.environ.get('GSUITE_OAUTH_CREDS')
+    if not gsuite_creds:
+        logger.error('No Google service account credentials')
         return None
-    except googleapiclient.errors.HttpError:
-        logger.error('Failed to authenticate to the Google API')
+
+    gc = gspread.service_account(filename=gsuite_creds)
+    spreadsheet = gc.open_by_key(SPREADO_ID)
+    return spreadsheet, spreadsheet.worksheet('raw')
+
+
+def check_for_email(query: str | None = None, history_id: str | None = None) -> tuple[list[Message], str] | None:
+    '''
+    Fetch theotherbordeaux emails from the wines label
+
+    Params:
+        query:       Gmail search query, else anything unread
+        history_id:  Only return emails added since this Gmail historyId
+    Returns:
+        Emails with metadata only, and the historyId to check from next time
+    '''
+    gmail = get_gmail(logger)
+    if gmail is None:
         return None
 
     try:
@@ -138,18 +191,24 @@ def check_for_email(query: str | None = None) -> Order | None:
         else:
             query = bquery + query
 
-        msgs = gmail.get_messages(query=query)
+        msgs, history_id = gmail.sync(query, history_id)
     except googleapiclient.errors.HttpError:
         logger.error('Failed to fetch messages from Gmail')
         return None
 
     logger.debug(msgs)
-    return msgs
+    return msgs, history_id
 
 
-def parse_email(html: str) -> Order:
-    'Parse the email for the order details'
-    soup = bs4.BeautifulSoup(html, 'html.parser')
+def parse_email(html: str, pages: 'PageCache | None' = None) -> Order:
+    '''
+    Parse the email for the order details
+
+    Params:
+        html:   Order email body
+        pages:  Product page cache; when supplied, all product pages in the order are fetched concurrently up front
+    '''
+    soup = parse_html(html, fast=True)
 
     order = None
 
@@ -190,6 +249,9 @@ def parse_email(html: str) -> Order:
 
     singles = []
 
+    if pages:
+        pages.prefetch([a.attrs['href'] for a in body.select('.order_item a[href]')])
+
     try:
         # Iterate order line items
         for row in body.select('.order_item'):
@@ -199,7 +261,7 @@ def parse_email(html: str) -> Order:
             price = price.removeprefix('$')
             price = decimal.Decimal(price)
 
-            wines = extract_wines(url, order_line=OrderLine(price, quantity))
+            wines = extract_wines(url, order_line=OrderLine(price, quantity), pages=pages)
 
             if len(wines) == 0:
                 raise IndexError
@@ -237,24 +299,112 @@ def parse_email(html: str) -> Order:
     return order
 
 
-def extract_wines(item_url: str, order_line: OrderLine | None = None) -> List[Wine]:
+class PageCache:
+    '''
+    Product page fetcher, caching each page on disk by URL so re-parsing an order never refetches.
+
+    Pages are fetched over a shared session, and prefetch resolves a set of URLs and any mixed pack
+    links on those pages concurrently. Fetches from all threads are capped at concurrency, the size of
+    the session's connection pool. Cached pages older than max_age are refetched; without a max_age
+    they're kept indefinitely.
+    '''
+
+    def __init__(
+        self,
+        path: pathlib.Path,
+        concurrency: int = MAX_CONCURRENT_FETCHES,
+        max_age: datetime.timedelta | None = None,
+    ):
+        self.path = path
+        self.concurrency = concurrency
+        self.max_age = max_age
+
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = USER_AGENT
+        self.session.mount('https://', HTTPAdapter(pool_maxsize=concurrency))
+        self._fetches = threading.BoundedSemaphore(concurrency)
+
+    def _cache_path(self, url: str) -> pathlib.Path:
+        return self.path / f'{hashlib.sha256(url.encode()).hexdigest()}.html'
+
+    def get(self, url: str) -> str:
+        'Return a product page, from the cache if already fetched'
+        path = self._cache_path(url)
+        try:
+            if self.max_age is None or time.time() - path.stat().st_mtime < self.max_age.total_seconds():
+                return path.read_text(encoding='utf8')
+        except FileNotFoundError:
+            pass
+
+        with self._fetches:
+            resp = self.session.get(url, timeout=5)
+        resp.raise_for_status()
+
+        if not PRODUCT_MARKUP.search(resp.text):
+            # Not a product page; extract_wines fails on it this run, and it's fetched afresh next time
+            logger.debug('Not caching %s, which has no product description', url)
+            return resp.text
+
+        # Write via a temporary file, so a concurrent or interrupted fetch never leaves a partial page
+        self.path.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f'.{threading.get_ident()}.tmp')
+        tmp.write_text(resp.text, encoding='utf8')
+        tmp.replace(path)
+
+        return resp.text
+
+    def prefetch(self, urls: list[str]):
+        '''
+        Fetch pages concurrently, following the links on mixed pack pages to the pages of the wines in the pack.
+        Failures are left for extract_wines to raise, when it requests the page again.
+        '''
+        seen = set(urls)
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            pending = {executor.submit(self.get, url) for url in seen}
+
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    try:
+                        html = future.result()
+                    except requests.RequestException as e:
+                        logger.debug('Prefetch failed: %s', e)
+                        continue
+
+                    for url in pack_links(html):
+                        if url not in seen:
+                            seen.add(url)
+                            pending.add(executor.submit(self.get, url))
+
+
+def pack_links(html: str) -> list[str]:
+    'Return the links to the wines on a mixed pack product page, or an empty list for any other page'
+    body = parse_html(html, fast=True).select_one('#tab-description')
+    if body is None or (len(set(body.select('a'))) <= 1 and not body.select('img')):
+        return []
+    return [a.attrs['href'] for a in body.select('a[href]')]
+
+
+def extract_wines(item_url: str, order_line: OrderLine | None = None, pages: PageCache | None = None) -> List[Wine]:
     '''
     Extract the wines listed on a TOB product page
 
     Params:
-        item_url:  Product page URL
+        item_url:    Product page URL
+        order_line:  Order line price & quantity, to apportion the paid price of a pack
+        pages:       Product page cache, else the page is fetched directly
     Returns:
         List of Wine objects
         Pack price
     '''
-    resp = requests.get(
-        item_url,
-        timeout=5,
-        headers={
-            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0 Safari/537.36'
-        },
-    )
-    soup = bs4.BeautifulSoup(resp.text, 'html.parser')
+    if pages:
+        html = pages.get(item_url)
+    else:
+        html = requests.get(item_url, timeout=5, headers={'User-Agent': USER_AGENT}).text
+
+    soup = parse_html(html, fast=True)
     body = soup.select_one('#tab-description')
     logger.debug('Extracting: %s', item_url)
 
@@ -368,7 +518,7 @@ def extract_wines(item_url: str, order_line: OrderLine | None = None) -> List[Wi
         # Multiple links indicates a mixed pack product
         for atag in body.select('a'):
             # Ignore pack_price when querying wines in packs
-            wines.extend(extract_wines(atag.attrs['href']))
+            wines.extend(extract_wines(atag.attrs['href'], pages=pages))
 
         # Calculate how many multiples of packs were ordered
         # num bottles in order line divided by pack size
@@ -398,45 +548,93 @@ def create_indentifiers(order: Order):
 
 
 def merge_upstream(df: pd.DataFrame, orders: List[Order]) -> None:
-    'Replace local order history with the Google Sheet order history'
+    '''
+    Replace local order history with the Google Sheet order history
 
+    Cells are converted a whole column at a time, with missing values taken from a mask of each column.
+    '''
     orders.clear()
     if df.empty:
         return
 
     rows = df[df['number'].notna()]
-    for number, order_rows in rows.groupby('number', sort=False):
-        first = order_rows.iloc[0]
-        order = Order(
-            number=int(number),
-            date=pd.to_datetime(first['date']).date(),
-            total=decimal.Decimal(str(first['total'])),
-            discount=decimal.Decimal(str(first['discount'])),
-        )
+    numbers = rows['number'].astype(int)
+
+    # Back-fill identifiers for orders missing any, where a wine's index counts repeats of its tag in the order
+    missing = rows['wine.identifier'].isna()
+    backfill = missing.groupby(numbers, sort=False).transform('any').to_numpy()
+    indexes = (rows.groupby([numbers, rows['wine.tag']], dropna=False, sort=False).cumcount() + 1).to_numpy()
+
+    tags = _strings(rows['wine.tag'])
+    identifiers = _strings(rows['wine.identifier'])
+    for i in missing.to_numpy().nonzero()[0]:
+        identifiers[i] = hashlib.sha256(f'{numbers.iat[i]}{tags[i]}{indexes[i]}'.encode()).hexdigest()
+
+    columns = zip(
+        numbers.tolist(),
+        pd.to_datetime(rows['date']).dt.date.tolist(),
+        rows['total'].astype(str).tolist(),
+        rows['discount'].astype(str).tolist(),
+        _strings(rows['wine.title']),
+        _strings(rows['wine.url']),
+        tags,
+        _decimals(rows['wine.price'], mask=False),
+        _decimals(rows['wine.paid']),
+        _strings(rows['wine.image_url']),
+        identifiers,
+        [int(index) if fill else None for index, fill in zip(indexes, backfill, strict=True)],
+        strict=True,
+    )
 
-        for _, row in order_rows.iterrows():
-            paid = None if pd.isna(row['wine.paid']) else decimal.Decimal(str(row['wine.paid']))
-            identifier = None if pd.isna(row['wine.identifier']) else str(row['wine.identifier'])
-            order.wines.append(
-                Wine(
-                    title=None if pd.isna(row['wine.title']) else str(row['wine.title']),
-                    url=None if pd.isna(row['wine.url']) else str(row['wine.url']),
-                    tag=None if pd.isna(row['wine.tag']) else str(row['wine.tag']),
-                    price=decimal.Decimal(str(row['wine.price'])),
-                    paid=paid,
-                    image_url=None if pd.isna(row['wine.image_url']) else str(row['wine.image_url']),
-                    identifier=identifier,
-                )
+    # Orders in order of first appearance in the sheet
+    by_number: dict[int, Order] = {}
+
+    for number, date, total, discount, title, url, tag, price, paid, image_url, identifier, index in columns:
+        order = by_number.get(number)
+        if order is None:
+            order = by_number[number] = Order(
+                number=number,
+                date=date,
+                total=decimal.Decimal(total),
+                discount=decimal.Decimal(discount),
+            )
+
+        order.wines.append(
+            Wine(
+                title=title,
+                url=url,
+                tag=tag,
+                price=price,
+                paid=paid,
+                image_url=image_url,
+                index=index,
+                identifier=identifier,
             )
+        )
+
+    orders.extend(by_number.values())
+
+
+def _strings(column: pd.Series) -> list[str | None]:
+    'Convert a sheet column to str, with None for missing cells'
+    return column.astype(str).where(column.notna(), None).tolist()
+
+
+def _decimals(column: pd.Series, mask: bool = True) -> list[decimal.Decimal | None]:
+    'Convert a sheet column to Decimal, with None for missing cells unless mask is False'
+    values = column.astype(str).tolist()
+    if not mask:
+        return [decimal.Decimal(value) for value in values]
+    return [
+        None if missing else decimal.Decimal(value)
+        for value, missing in zip(values, column.isna().tolist(), strict=True)
+    ]
 
-        provided_identifiers = [wine.identifier for wine in order.wines]
-        if any(identifier is None for identifier in provided_identifiers):
-            create_indentifiers(order)
-            for wine, identifier in zip(order.wines, provided_identifiers):
-                if identifier is not None:
-                    wine.identifier = identifier
 
-        orders.append(order)
+def append_order(sheet: gspread.Worksheet, order: Order):
+    'Append the wines of an order to the sheet, in a single values.append call'
+    rows = [['' if value is None else str(value) for value in row.values()] for row in _flatten(order)]
+    sheet.append_rows(rows, value_input_option='USER_ENTERED', table_range='A1')
 
 
 @click.group(name='tob')
@@ -490,11 +688,96 @@ def parse(order: int):
     \b
     ORDER   A single TOB order number
     '''
-    msgs = check_for_email(str(order))
-    if msg := next(iter(msgs), None):
-        order = parse_email(msg.html)
+    result = check_for_email(str(order))
+    if result and (msg := next(iter(result[0]), None)):
+        order = parse_email(msg.html, PageCache(PAGE_CACHE_DIR))
         if order is None:
             return
         df = pd.DataFrame(_flatten(order))
         df['date'] = pd.to_datetime(df['date'])
         pretty.dataframe(df)
+
+
+@cli.command
+@click.option('--since', type=click.DateTime(formats=['%Y-%m-%d']), required=True, help='Earliest order email date')
+@click.option('--workers', default=BACKFILL_WORKERS, help='Order emails parsed concurrently')
+def backfill(plugin: InformaPlugin, since: datetime.datetime, workers: int):
+    '''
+    Parse all order emails since a date, and merge them into the order history in a single sheet write
+
+    Parsed orders are saved to state as the backfill runs, so an interrupted backfill resumes where it left off.
+    Emails which fail to parse are recorded and skipped on resume.
+
+    A backfill runs far longer than the server's CLI timeout, so must be run locally with LOCAL=1
+    '''
+    if not os.getenv('LOCAL'):
+        click.echo('Backfill must be run locally, with LOCAL=1')
+        return
+
+    state = plugin.load_state()
+    parsed, failed = state.backfill, state.backfill_failed
+
+    def save_progress():
+        # Merge into the latest state, so changes made by a concurrent plugin run aren't overwritten
+        latest = plugin.load_state()
+        latest.backfill, latest.backfill_failed = parsed, failed
+        plugin.write_state(latest)
+
+    result = check_for_email(f'after:{since:%Y/%m/%d}')
+    if result is None:
+        return
+    msgs = [m for m in result[0] if m.id not in parsed and m.id not in failed]
+    click.echo(f'{len(result[0])} order emails, {len(result[0]) - len(msgs)} already parsed')
+
+    # Fetch all email bodies in batches, then parse them concurrently
+    get_gmail(logger).fetch(msgs)
+    pages = PageCache(PAGE_CACHE_DIR)
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = {executor.submit(parse_email, msg.html, pages): msg for msg in msgs}
+
+        with click.progressbar(as_completed(futures), length=len(futures), label='Parsing orders') as progress:
+            for i, future in enumerate(progress, 1):
+                msg = futures[future]
+                try:
+                    order = future.result()
+                except NoExtractionError as e:
+                    logger.error('Email dated %s failed extraction: %s', msg.date, e)
+                    order = None
+                except Exception:
+                    logger.exception('Email dated %s failed to parse', msg.date)
+                    order = None
+
+                if order:
+                    parsed[msg.id] = order
+                else:
+                    failed.append(msg.id)
+
+                if i % BACKFILL_SAVE_INTERVAL == 0:
+                    save_progress()
+    finally:
+        # Stop promptly on interrupt, keeping the orders parsed so far
+        executor.shutdown(cancel_futures=True)
+        save_progress()
+
+    if (opened := open_sheet()) is None:
+        return
+    spreadsheet, sheet = opened
+
+    # Orders may have been added by the scheduled plugin run while parsing
+    state = plugin.load_state()
+    merge_upstream(get_as_dataframe(sheet), state.orders)
+
+    known = {o.number for o in state.orders}
+    new = {o.number: o for o in parsed.values() if o.number not in known}
+    state.orders.extend(sorted(new.values(), key=lambda o: o.number))
+
+    if new:
+        set_with_dataframe(sheet, get_history(state), resize=True)
+
+    state.sheet_modified = spreadsheet.get_lastUpdateTime()
+    state.backfill, state.backfill_failed = {}, []
+    plugin.write_state(state)
+
+    click.echo(f'Added {len(new)} orders, {len(failed)} emails failed to parse')
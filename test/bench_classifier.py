@@ -0,0 +1,94 @@
+'''
+Benchmark the release title classifier against the previous substring checks, on a synthetic corpus
+of historical release titles. The classifier is timed on a first poll (cold) and a repeat poll (warm).
+
+    hatch run test:bench
+'''
+
+import itertools
+import random
+import timeit
+
+from informa.plugins.f1torrents import classify, wanted_release
+
+SESSIONS = [
+    'Race',
+    'Qualifying',
+    'Sprint',
+    'Sprint.Qualifying',
+    'Sprint.Shootout',
+    'Season.Review',
+    'Pre-Race.Buildup',
+    'Post-Race.Analysis',
+    'FP1',
+    'FP2',
+    'FP3',
+    'Teds.Qualifying.Notebook',
+    'Drivers.Press.Conference',
+]
+QUALITIES = ['SkyF1UHD.2160P', 'SkyF1HD.1080p', 'SkyF1HD.SD', 'F1TV.1080p']
+VENUES = ['Bahrain', 'Saudi.Arabia', 'Australia', 'Japan', 'China', 'Miami', 'Monaco', 'Canada', 'Las.Vegas']
+
+
+def legacy_key(title: str, current_season: int, quality: str) -> str | None:
+    'The filtering and key extraction prior to the classifier, which mistook Pre-Race and Post-Race for the Race'
+    RACE_TYPES = {'Race', 'Qualifying', 'Sprint', 'Season.Review', 'Shootout'}
+
+    if 'Formula.1' in title and str(current_season) in title and quality in title:
+        if not any(s in title for s in RACE_TYPES) or 'Teds' in title:
+            return None
+
+        if 'Sprint' in title:
+            session_type = 'sq' if 'Qualifying' in title else 'sr'
+        elif 'Qualifying' in title:
+            session_type = 'qu'
+        elif 'Race' in title:
+            session_type = 'ra'
+        else:
+            session_type = 'rv'
+
+        return f'{title[10:17]}{session_type}'
+    return None
+
+
+def classifier_key(title: str, current_season: int, quality: str) -> str | None:
+    release = wanted_release(title, current_season, quality)
+    return release.key if release else None
+
+
+def make_corpus(size: int) -> list[str]:
+    'Build a corpus of F1 release titles from past seasons, mixed with unrelated torrents'
+    rand = random.Random(1)
+    titles = [
+        f'Formula.1.{season}x{rnd:02d}.{venue}.{session}.{quality}'
+        for season, rnd, session, quality in itertools.product(range(2018, 2026), range(1, 25), SESSIONS, QUALITIES)
+        for venue in [rand.choice(VENUES)]
+    ]
+    titles += [f'MotoGP.{2018 + i % 8}.Round{i % 20:02d}.Race.1080p.WEB' for i in range(len(titles) // 4)]
+    rand.shuffle(titles)
+    return list(itertools.islice(itertools.cycle(titles), size))
+
+
+def main():
+    # Poll-sized corpora, which fit within the classifier cache
+    for size in (1000, 4000):
+        corpus = make_corpus(size)
+
+        for quality in ('SkyF1UHD', 'SkyF1HD.1080p'):
+            for title in corpus:
+                expected = None if '-Race' in title else legacy_key(title, 2024, quality)
+                assert classifier_key(title, 2024, quality) == expected, title
+
+        print(f'{size} titles:')
+        for name, func in (('legacy', legacy_key), ('cold', classifier_key), ('warm', classifier_key)):
+            if name == 'cold':
+                classify.cache_clear()
+
+            duration = timeit.timeit(
+                lambda func=func, corpus=corpus: [func(t, 2024, 'SkyF1UHD') for t in corpus], number=1
+            )
+            print(f'  {name:>6} {duration * 1000:7.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+'''
+Benchmark the lxml fast path of parse_html against html.parser, on the saved pages and emails in
+test/fixtures, running the selectors the scraper plugins use.
+
+    hatch run test:bench
+'''
+
+import pathlib
+import timeit
+
+from informa.lib.html import FAST_PARSER, parse_html
+
+FIXTURES = pathlib.Path(__file__).parent / 'fixtures'
+
+SELECTORS = [
+    '#tab-description',
+    '#tab-description a',
+    '#tab-description img',
+    '.summary .price',
+    'h1',
+    '#body_content_inner .order_item',
+    'tfoot tr, tr.order-totals',
+    '.release-date',
+    'article a[href]',
+]
+
+
+def scrape(html: str, fast: bool) -> list[list[str]]:
+    'Parse a page and extract the text of every element matching each selector'
+    soup = parse_html(html, fast=fast)
+    return [[el.get_text(' ', strip=True) for el in soup.select(selector)] for selector in SELECTORS]
+
+
+def main():
+    pages = {path.stem: path.read_text(encoding='utf8') for path in sorted(FIXTURES.glob('*.txt'))}
+
+    for name, html in pages.items():
+        assert scrape(html, fast=False) == scrape(html, fast=True), name
+
+    print(f'{len(pages)} pages, {sum(len(html) for html in pages.values()) / 2**20:.1f}MB:')
+    for name, fast in (('html.parser', False), (FAST_PARSER, True)):
+        parse = min(
+            timeit.repeat(lambda fast=fast: [parse_html(html, fast) for html in pages.values()], number=1, repeat=3)
+        )
+        total = min(
+            timeit.repeat(lambda fast=fast: [scrape(html, fast) for html in pages.values()], number=1, repeat=3)
+        )
+        print(f'  {name:>11} parse {parse * 1000:7.1f}ms  parse+select {total * 1000:7.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+'''
+Benchmark the rtorrent SCGI transport against the previous implementation, on multi-megabyte
+system.multicall responses served from a local SCGI server.
+
+    hatch run test:bench
+'''
+
+import re
+import socket
+import threading
+import timeit
+import tracemalloc
+import xmlrpc.client
+
+from informa.plugins.f1torrents import SCGIServerProxy
+
+
+class LegacySCGITransport(xmlrpc.client.Transport):
+    'The SCGI transport prior to streaming responses into the parser'
+
+    def single_request(self, host, handler, request_body, verbose=0):
+        header = f'CONTENT_LENGTH\x00{len(request_body)}\x00SCGI\x001\x00'
+        request_body = f'{len(header)}:{header},{request_body}'
+
+        host, port = host.split(':')
+        addrinfo = socket.getaddrinfo(host, port, socket.AF_INET, socket.SOCK_STREAM)
+        sock = socket.socket(*addrinfo[0][:3])
+        sock.connect(addrinfo[0][4])
+        try:
+            sock.send(request_body.encode('ascii'))
+            return self.parse_response(sock.makefile())
+        finally:
+            sock.close()
+
+    def parse_response(self, response):
+        p, u = self.getparser()
+
+        response_body = ''
+        while True:
+            data = response.read(1024)
+            if not data:
+                break
+            response_body += data
+
+        _, response_body = re.split(r'\n\s*?\n', response_body, maxsplit=1)
+        p.feed(response_body)
+        p.close()
+        return u.close()
+
+
+def make_response(num_torrents: int) -> bytes:
+    'Build an SCGI response to system.multicall of f.multicall for num_torrents'
+    files = [[f'Formula.1.2024x05/{i:02d}.Session.mkv', 2**30, 4096, 2048, 1] for i in range(6)]
+    body = xmlrpc.client.dumps(([[files] for _ in range(num_torrents)],), methodresponse=True).encode()
+    return b'Status: 200 OK\r\nContent-Type: text/xml\r\nContent-Length: %d\r\n\r\n' % len(body) + body
+
+
+def serve(response: bytes) -> int:
+    'Serve a canned response to every SCGI request, returning the listening port'
+    server = socket.socket()
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(('127.0.0.1', 0))
+    server.listen(16)
+
+    def handle(conn):
+        with conn:
+            # Requests are tiny, and arrive in a single read
+            conn.recv(65536)
+            conn.sendall(response)
+
+    def accept():
+        while True:
+            conn, _ = server.accept()
+            threading.Thread(target=handle, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return server.getsockname()[1]
+
+
+def main():
+    for num_torrents in (1000, 5000, 10000):
+        response = make_response(num_torrents)
+        port = serve(response)
+
+        new = SCGIServerProxy(f'scgi://127.0.0.1:{port}/')
+        legacy = SCGIServerProxy(f'scgi://127.0.0.1:{port}/')
+        legacy._SCGIServerProxy__transport = LegacySCGITransport()  # noqa: SLF001
+
+        assert new.system.multicall([]) == legacy.system.multicall([])
+
+        results = {}
+        for name, proxy in (('legacy', legacy), ('new', new)):
+            duration = min(timeit.repeat(lambda proxy=proxy: proxy.system.multicall([]), number=1, repeat=5))
+
+            # Measure peak memory allocated during a single request
+            tracemalloc.start()
+            proxy.system.multicall([])
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            results[name] = (duration, peak)
+
+        print(f'{len(response) / 2**20:6.1f}MB response:')
+        for name, (duration, peak) in results.items():
+            print(f'  {name:>6} {duration * 1000:7.1f}ms  peak {peak / 2**20:6.1f}MB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+'''
+Benchmark the columnar merge_upstream against the previous iterrows implementation, on synthetic
+sheet history shaped like the output of get_as_dataframe.
+
+    hatch run test:bench
+'''
+
+import datetime
+import decimal
+import random
+import timeit
+
+import numpy as np
+import pandas as pd
+
+from informa.plugins.tob import Order, Wine, create_indentifiers, merge_upstream
+
+TAGS = [
+    'Elegant Bordeaux',
+    'Powerhouse Bordeaux',
+    'Premier Cru Complexity',
+    'Yours Sancerre-ly!',
+    'Burgundy Brut',
+    'V-V-V Vouvray',
+    'Meaty Bordeaux Merlot',
+    'Full throttle CNDP',
+]
+
+
+def legacy_merge_upstream(df: pd.DataFrame, orders: list[Order]) -> None:
+    'merge_upstream prior to the columnar conversion'
+    orders.clear()
+    if df.empty:
+        return
+
+    rows = df[df['number'].notna()]
+    for number, order_rows in rows.groupby('number', sort=False):
+        first = order_rows.iloc[0]
+        order = Order(
+            number=int(number),
+            date=pd.to_datetime(first['date']).date(),
+            total=decimal.Decimal(str(first['total'])),
+            discount=decimal.Decimal(str(first['discount'])),
+        )
+
+        for _, row in order_rows.iterrows():
+            paid = None if pd.isna(row['wine.paid']) else decimal.Decimal(str(row['wine.paid']))
+            identifier = None if pd.isna(row['wine.identifier']) else str(row['wine.identifier'])
+            order.wines.append(
+                Wine(
+                    title=None if pd.isna(row['wine.title']) else str(row['wine.title']),
+                    url=None if pd.isna(row['wine.url']) else str(row['wine.url']),
+                    tag=None if pd.isna(row['wine.tag']) else str(row['wine.tag']),
+                    price=decimal.Decimal(str(row['wine.price'])),
+                    paid=paid,
+                    image_url=None if pd.isna(row['wine.image_url']) else str(row['wine.image_url']),
+                    identifier=identifier,
+                )
+            )
+
+        provided_identifiers = [wine.identifier for wine in order.wines]
+        if any(identifier is None for identifier in provided_identifiers):
+            create_indentifiers(order)
+            for wine, identifier in zip(order.wines, provided_identifiers):
+                if identifier is not None:
+                    wine.identifier = identifier
+
+        orders.append(order)
+
+
+def make_sheet(num_rows: int) -> pd.DataFrame:
+    'Build sheet history of 6-bottle orders, with gaps in optional columns and some missing identifiers'
+    rand = random.Random(1)
+    data = []
+
+    for i in range(num_rows // 6):
+        number = 18000 + i
+        date = datetime.date(2020, 1, 1) + datetime.timedelta(days=i % 2000)
+        for j in range(6):
+            tag = rand.choice(TAGS)
+            price = rand.choice([29.95, 34.95, 45.95, 67.95])
+            data.append({
+                'number': float(number),
+                'date': date.isoformat(),
+                'total': 215.7,
+                'discount': 0.0 if i % 10 else 20.0,
+                'wine.title': f'{tag} {2015 + j}.' if rand.random() > 0.2 else np.nan,
+                'wine.url': f'https://theotherbordeaux.com/shop/{i}/{j}/',
+                'wine.tag': tag,
+                'wine.price': price,
+                'wine.paid': round(price * 0.7, 2) if rand.random() > 0.1 else np.nan,
+                'wine.image_url': np.nan if j % 3 else f'https://theotherbordeaux.com/wp-content/uploads/{i}.jpg',
+                'wine.identifier': np.nan if i % 7 == 0 else f'{i:064x}',
+            })
+
+    # Blank rows trail the history in the sheet
+    data.extend({'number': np.nan} for _ in range(50))
+    return pd.DataFrame(data)
+
+
+def main():
+    for num_rows in (1000, 10000, 50000):
+        df = make_sheet(num_rows)
+
+        legacy, new = [], []
+        legacy_merge_upstream(df, legacy)
+        merge_upstream(df, new)
+        assert legacy == new
+
+        print(f'{num_rows} rows:')
+        for name, func in (('legacy', legacy_merge_upstream), ('new', merge_upstream)):
+            duration = min(timeit.repeat(lambda func=func, df=df: func(df, []), number=1, repeat=3))
+            print(f'  {name:>6} {duration * 1000:8.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+import base64
+from unittest.mock import MagicMock, Mock, patch
+
+import googleapiclient.errors
+import pytest
+
+from informa.lib.gmail import BATCH_RETRIES, Gmail, _gmail, get_gmail
+
+
+def _data(message_id: str, html: str | None = None) -> dict:
+    data = {
+        'id': message_id,
+        'threadId': message_id,
+        'labelIds': ['UNREAD'],
+        'internalDate': '1780531200000',
+        'payload': {'headers': [{'name': 'Subject', 'value': f'Order {message_id}'}]},
+    }
+    if html is not None:
+        data['payload'] = {
+            **data['payload'],
+            'mimeType': 'multipart/alternative',
+            'body': {},
+            'parts': [
+                {'mimeType': 'text/plain', 'filename': '', 'body': {'data': base64.urlsafe_b64encode(b'plain').decode()}},
+                {'mimeType': 'text/html', 'filename': '', 'body': {'data': base64.urlsafe_b64encode(html.encode()).decode()}},
+            ],
+        }
+    return data
+
+
+def _http_error(status: int) -> googleapiclient.errors.HttpError:
+    return googleapiclient.errors.HttpError(Mock(status=status), b'Error')
+
+
+class FakeBatch:
+    '''
+    Batch request which answers each added request with the response queued on it, or with the next
+    error queued for its ID in failures
+    '''
+
+    def __init__(self, callback, failures):
+        self.callback = callback
+        self.failures = failures
+        self.requests = []
+
+    def add(self, request, request_id):
+        self.requests.append((request, request_id))
+
+    def execute(self):
+        for request, request_id in self.requests:
+            if self.failures.get(request_id):
+                self.callback(request_id, None, self.failures[request_id].pop(0))
+            else:
+                self.callback(request_id, request.response, None)
+
+
+@pytest.fixture
+def gmail():
+    with patch('informa.lib.gmail.build') as mock_build:
+        service = MagicMock()
+        mock_build.return_value = service
+
+        gmail = Gmail(Mock())
+        gmail.batches = []
+        gmail.failures = {}
+
+        def new_batch_http_request(callback):
+            batch = FakeBatch(callback, gmail.failures)
+            gmail.batches.append(batch)
+            return batch
+
+        service.new_batch_http_request.side_effect = new_batch_http_request
+
+        # Single message requests return the message, in full unless only metadata was requested
+        def get(userId, id, format='full', **kwargs):
+            return Mock(response=_data(id, None if format == 'metadata' else f'<p>{id}</p>'))
+
+        gmail.users.messages.return_value.get.side_effect = get
+        yield gmail
+
+
+def test_sync_without_history_lists_metadata(gmail):
+    '''
+    Ensure a first sync lists matching messages with metadata only, and returns the mailbox historyId
+    '''
+    gmail.users.getProfile.return_value.execute.return_value = {'historyId': '100'}
+    gmail.users.messages.return_value.list.return_value.execute.return_value = {'messages': [{'id': 'a'}, {'id': 'b'}]}
+
+    msgs, history_id = gmail.sync('label:wines is:unread')
+
+    assert history_id == '100'
+    assert [(m.id, m.subject, m.loaded) for m in msgs] == [('a', 'Order a', False), ('b', 'Order b', False)]
+    assert len(gmail.batches) == 1
+
+
+def test_sync_with_history_only_returns_added_messages(gmail):
+    '''
+    Ensure a sync from a historyId only returns matching messages which were added since
+    '''
+    gmail.users.history.return_value.list.return_value.execute.return_value = {
+        'history': [{'messagesAdded': [{'message': {'id': 'b'}}, {'message': {'id': 'z'}}]}],
+        'historyId': '200',
+    }
+    gmail.users.messages.return_value.list.return_value.execute.return_value = {'messages': [{'id': 'a'}, {'id': 'b'}]}
+
+    msgs, history_id = gmail.sync('label:wines is:unread', '100')
+
+    assert history_id == '200'
+    assert [m.id for m in msgs] == ['b']
+
+
+def test_sync_with_history_returns_messages_marked_unread(gmail):
+    '''
+    Ensure a sync from a historyId also returns matching messages which were marked unread again
+    '''
+    gmail.users.history.return_value.list.return_value.execute.return_value = {
+        'history': [
+            {'labelsAdded': [{'message': {'id': 'a'}, 'labelIds': ['UNREAD']}]},
+            {'labelsAdded': [{'message': {'id': 'b'}, 'labelIds': ['STARRED']}]},
+        ],
+        'historyId': '200',
+    }
+    gmail.users.messages.return_value.list.return_value.execute.return_value = {'messages': [{'id': 'a'}, {'id': 'b'}]}
+
+    msgs, _ = gmail.sync('label:wines is:unread', '100')
+
+    assert [m.id for m in msgs] == ['a']
+
+
+def test_sync_with_unchanged_history_skips_search(gmail):
+    '''
+    Ensure no search is made when no messages were added since the historyId
+    '''
+    gmail.users.history.return_value.list.return_value.execute.return_value = {'historyId': '100'}
+
+    assert gmail.sync('label:wines is:unread', '100') == ([], '100')
+    gmail.users.messages.return_value.list.assert_not_called()
+
+
+def test_sync_with_expired_history_lists_all(gmail):
+    '''
+    Ensure an expired historyId falls back to listing all matching messages
+    '''
+    gmail.users.history.return_value.list.return_value.execute.side_effect = googleapiclient.errors.HttpError(
+        Mock(status=404), b'Not Found'
+    )
+    gmail.users.getProfile.return_value.execute.return_value = {'historyId': '300'}
+    gmail.users.messages.return_value.list.return_value.execute.return_value = {'messages': [{'id': 'a'}]}
+
+    msgs, history_id = gmail.sync('label:wines is:unread', '1')
+
+    assert history_id == '300'
+    assert [m.id for m in msgs] == ['a']
+
+
+def test_fetch_loads_bodies_in_one_batch(gmail):
+    '''
+    Ensure message bodies are fetched together in a batch, and decoded lazily
+    '''
+    msgs = gmail.get_metadata(['a', 'b'])
+
+    gmail.fetch(msgs)
+
+    assert len(gmail.batches) == 2
+    assert [m.html for m in msgs] == ['<p>a</p>', '<p>b</p>']
+    assert msgs[0].plain == 'plain'
+    assert not msgs[0].has_attachments()
+
+    # Already loaded messages are not fetched again
+    gmail.fetch(msgs)
+    assert len(gmail.batches) == 2
+
+
+@patch('informa.lib.gmail.time.sleep')
+def test_batch_retries_only_rate_limited_requests(mock_sleep, gmail):
+    '''
+    Ensure requests which are rate limited are retried alone, after a backoff
+    '''
+    gmail.failures['b'] = [_http_error(429), _http_error(503)]
+
+    msgs = gmail.get_metadata(['a', 'b', 'c'])
+
+    assert [m.id for m in msgs] == ['a', 'b', 'c']
+    assert [[request_id for _, request_id in batch.requests] for batch in gmail.batches] == [
+        ['a', 'b', 'c'],
+        ['b'],
+        ['b'],
+    ]
+    assert [c.args[0] for c in mock_sleep.call_args_list] == [0.5, 1]
+
+
+@patch('informa.lib.gmail.time.sleep')
+def test_batch_raises_other_errors(mock_sleep, gmail):
+    '''
+    Ensure requests failing with a client error are not retried
+    '''
+    gmail.failures['b'] = [_http_error(404)]
+
+    with pytest.raises(googleapiclient.errors.HttpError):
+        gmail.get_metadata(['a', 'b'])
+
+    assert len(gmail.batches) == 1
+    mock_sleep.assert_not_called()
+
+
+@patch('informa.lib.gmail.time.sleep')
+def test_batch_gives_up_after_retries(mock_sleep, gmail):
+    '''
+    Ensure a request which is rate limited on every attempt eventually raises
+    '''
+    gmail.failures['a'] = [_http_error(429)] * BATCH_RETRIES
+
+    with pytest.raises(googleapiclient.errors.HttpError):
+        gmail.get_metadata(['a'])
+
+    assert len(gmail.batches) == BATCH_RETRIES
+
+
+def test_get_gmail_caches_client(monkeypatch):
+    '''
+    Ensure the Gmail client is authenticated once, and shared across callers
+    '''
+    monkeypatch.setenv('GSUITE_OAUTH_CREDS', 'creds.json')
+    _gmail.cache_clear()
+
+    with (
+        patch('informa.lib.gmail.Credentials.from_service_account_file') as mock_creds,
+        patch('informa.lib.gmail.build'),
+    ):
+        assert get_gmail(Mock()) is get_gmail(Mock())
+
+    mock_creds.assert_called_once()
+    _gmail.cache_clear()
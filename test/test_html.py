@@ -0,0 +1,28 @@
+from unittest.mock import patch
+
+import pytest
+
+from informa.lib.html import parse_html
+
+
+@pytest.mark.parametrize('fixture', ['tob_site_pack_25751', 'tob_email_38073', 'ha_releases'])
+def test_parse_html_fast_selects_the_same(http_response, fixture):
+    '''
+    Ensure the lxml fast path selects the same elements as html.parser on saved pages
+    '''
+    html = http_response(fixture)
+
+    for selector in ('#tab-description a', '.order_item td', '.release-date', 'h1, h2'):
+        assert [el.get_text(strip=True) for el in parse_html(html, fast=True).select(selector)] == [
+            el.get_text(strip=True) for el in parse_html(html).select(selector)
+        ]
+
+
+def test_parse_html_falls_back_without_lxml():
+    '''
+    Ensure the fast path uses html.parser when lxml isn't installed
+    '''
+    with patch('informa.lib.html.FAST_PARSER', 'html.parser'):
+        soup = parse_html('<p class="price">$ 26.37</p>', fast=True)
+
+    assert soup.select_one('.price').text == '$ 26.37'
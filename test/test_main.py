@@ -1,3 +1,4 @@
+import asyncio
 import datetime
 import inspect
 from unittest.mock import Mock, patch
@@ -137,6 +138,42 @@ class TestApiDecorator:
         assert plugin.api == router
 
 
+class TestTaskFailureHandler:
+    '''Test the task failure handler wrapped around Rocketry tasks'''
+
+    def test_sync_task_failure_handled(self, informa_app):
+        '''Test failures in sync tasks are passed to the failure handler'''
+
+        def failing_task():
+            raise ValueError('boom')
+
+        task = informa_app.rocketry.session.create_task(func=failing_task, start_cond='false', name='sync_task')
+
+        with patch.object(informa_app, '_handle_task_failure') as mock_handler:
+            with pytest.raises(ValueError):
+                task.func()
+
+            mock_handler.assert_called_once()
+            assert mock_handler.call_args.args[0] == 'sync_task'
+
+    def test_async_task_is_awaited_and_failure_handled(self, informa_app):
+        '''Test async tasks remain coroutine functions, so Rocketry awaits them'''
+
+        async def failing_task():
+            raise ValueError('boom')
+
+        task = informa_app.rocketry.session.create_task(func=failing_task, start_cond='false', name='async_task')
+
+        assert inspect.iscoroutinefunction(task.func)
+
+        with patch.object(informa_app, '_handle_task_failure') as mock_handler:
+            with pytest.raises(ValueError):
+                asyncio.run(task.func())
+
+            mock_handler.assert_called_once()
+            assert mock_handler.call_args.args[0] == 'async_task'
+
+
 class TestEnablePlugin:
     '''Test plugin enabling functionality'''
 
@@ -190,6 +227,28 @@ class TestEnablePlugin:
             assert call_kwargs['func'] == test_task
             assert call_kwargs['start_cond'] == 'every 5 mins'
 
+    @patch('informa.lib.plugin.InformaPlugin.__post_init__', return_value=None)
+    def test_enable_plugin_binds_next_fire_provider(self, mock_post_init, informa_app, mock_plugin_module):
+        '''Test a next fire provider is wrapped in a condition bound to the plugin'''
+        from informa.lib.plugin import InformaPlugin, InformaTask, NextFire
+
+        def test_task(plugin):
+            pass
+
+        provider = Mock(return_value=None)
+        plugin = InformaPlugin(mock_plugin_module)
+        plugin.tasks = [InformaTask(test_task, provider)]
+        plugin.enabled = False
+        informa_app.plugins[mock_plugin_module.__name__] = plugin
+
+        with patch.object(informa_app.rocketry.session, 'create_task') as mock_create:
+            informa_app.enable_plugin(mock_plugin_module.__name__)
+
+            condition = mock_create.call_args.kwargs['start_cond']
+            assert isinstance(condition, NextFire)
+            assert condition.next_fire(None) is None
+            provider.assert_called_once_with(plugin, None)
+
     @patch('informa.lib.plugin.InformaPlugin.__post_init__', return_value=None)
     def test_enable_plugin_registers_api(self, mock_post_init, informa_app, mock_plugin_module):
         '''Test enabling plugin registers API router'''
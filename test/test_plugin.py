@@ -334,3 +334,37 @@ class TestCachedProperties:
         from informa.lib import PluginAdapter
 
         assert isinstance(test_plugin.logger, PluginAdapter)
+
+
+class TestNextFire:
+    '''Test the next fire time condition'''
+
+    def test_holds_once_next_fire_passed(self):
+        '''Test the condition only holds after the provided time'''
+        from informa.lib.plugin import NextFire
+
+        now = datetime.datetime.now(datetime.UTC)
+        task = Mock(last_run=None)
+
+        assert NextFire(lambda _: now - datetime.timedelta(seconds=1)).get_state(task=task) is True
+        assert NextFire(lambda _: now + datetime.timedelta(hours=1)).get_state(task=task) is False
+        assert NextFire(lambda _: None).get_state(task=task) is False
+
+    def test_provider_cached_until_task_runs(self):
+        '''Test the provider is only called again when the task has run, or after recheck'''
+        from informa.lib.plugin import NextFire
+
+        provider = Mock(return_value=None)
+        condition = NextFire(provider)
+        last_run = datetime.datetime(2024, 5, 26, 13, tzinfo=datetime.UTC)
+
+        condition.next_fire(None)
+        condition.next_fire(None)
+        assert provider.call_count == 1
+
+        condition.next_fire(last_run)
+        assert provider.call_count == 2
+
+        condition.recheck = datetime.timedelta(0)
+        condition.next_fire(last_run)
+        assert provider.call_count == 3
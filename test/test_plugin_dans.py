@@ -0,0 +1,306 @@
+import datetime
+import decimal
+import random
+import statistics
+import time
+from unittest.mock import patch
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import pytest
+
+from informa.lib.utils import now_aest
+from informa.plugins.dans import (
+    HISTORY_SCHEMA,
+    Config,
+    FailedProductQuery,
+    History,
+    Observation,
+    PriceHistory,
+    Product,
+    ProductIndex,
+    Run,
+    State,
+    get_stats,
+    main,
+    migrate_history,
+)
+
+PRODUCTS = [Product(str(i), f'Wine {i}', 20) for i in range(5)]
+
+
+@pytest.fixture
+def store(tmp_path):
+    with patch('informa.plugins.dans.HISTORY_DIR', tmp_path / 'dans'):
+        yield PriceHistory(tmp_path / 'dans')
+
+
+def _query_product(_, product: Product) -> decimal.Decimal:
+    # Earlier products respond slowest, to shuffle completion order
+    time.sleep(0.05 * (5 - int(product.id)))
+    if product.id == '3':
+        raise FailedProductQuery(f'HTTP 404 loading {product.name}')
+    return decimal.Decimal(f'{18 + int(product.id)}.99')
+
+
+@patch('informa.plugins.dans.send_alert')
+@patch('informa.plugins.dans.query_product', side_effect=_query_product)
+def test_main_queries_concurrently_in_config_order(mock_query_product, mock_send_alert, store):
+    '''
+    Ensure products are queried concurrently, with history merged in configured order
+    '''
+    state = State()
+
+    start = time.monotonic()
+    assert main(state, Config(products=PRODUCTS)) == 2
+    assert time.monotonic() - start < 0.4
+
+    runs = {product_id: index.run for product_id, index in state.index.items() if index.run}
+    assert list(runs) == ['0', '1', '2', '4']
+    assert [run.alerted for run in runs.values()] == [True, True, False, False]
+    assert mock_send_alert.call_count == 2
+
+
+@patch('informa.plugins.dans.send_alert')
+@patch('informa.plugins.dans.query_product', return_value=decimal.Decimal('15.00'))
+def test_main_suppresses_recent_alerts(mock_query_product, mock_send_alert, store):
+    '''
+    Ensure a product isn't alerted again within 6 days, using alerts from the Parquet store
+    '''
+    product = PRODUCTS[0]
+    store.append([History(product, decimal.Decimal('16.00'), now_aest() - datetime.timedelta(days=2), alerted=True)])
+
+    assert main(State(), Config(products=[product])) == 1
+    mock_send_alert.assert_not_called()
+
+
+@patch('informa.plugins.dans.query_product', side_effect=FailedProductQuery('down'))
+def test_main_migrates_json_history(mock_query_product, store):
+    '''
+    Ensure legacy history in state is moved into the Parquet store, with its products
+    '''
+    old = Product('99', 'Old Wine', 10)
+    state = State(
+        history=[
+            History(old, decimal.Decimal('12.3300001'), datetime.datetime(2024, 1, 1, tzinfo=datetime.UTC)),
+            History(PRODUCTS[0], decimal.Decimal('19.99'), datetime.datetime(2024, 1, 2, tzinfo=datetime.UTC)),
+        ]
+    )
+
+    main(state, Config(products=PRODUCTS[:1]))
+
+    assert state.history == []
+    assert store.products() == {'99': old, '0': PRODUCTS[0]}
+
+    ts = datetime.datetime(2024, 1, 1, tzinfo=datetime.UTC)
+    runs = store.read(columns=['price', 'first_seen', 'last_seen', 'count'], filters=pc.field('product_id') == '99')
+    assert runs.to_pylist() == [{'price': decimal.Decimal('12.33'), 'first_seen': ts, 'last_seen': ts, 'count': 1}]
+
+
+def test_migrate_history_retried_does_not_duplicate(store):
+    '''
+    Ensure legacy history migrated again, after a run which failed before saving the cleared state, isn't
+    duplicated in the store
+    '''
+    history = [
+        History(PRODUCTS[0], decimal.Decimal('19.99'), datetime.datetime(2024, 1, d, tzinfo=datetime.UTC))
+        for d in (1, 2)
+    ]
+
+    migrate_history(State(history=list(history)), store)
+    migrate_history(State(history=list(history)), store)
+
+    assert store.read(columns=['count']).to_pylist() == [{'count': 2}]
+
+
+def test_delete_product_compacts_history(store):
+    '''
+    Ensure deleting a product removes its history and product row, leaving a single dataset file
+    '''
+    ts = now_aest()
+    store.write_products(PRODUCTS[:2])
+    store.append([History(PRODUCTS[0], decimal.Decimal('1.00'), ts)])
+    store.append([History(PRODUCTS[1], decimal.Decimal('2.00'), ts), History(PRODUCTS[0], decimal.Decimal('3.00'), ts)])
+
+    assert store.delete_product('0') == 2
+    assert list(store.products()) == ['1']
+    assert store.read(columns=['product_id']).to_pylist() == [{'product_id': '1'}]
+    assert len(list(store.runs_path.glob('*.parquet'))) == 1
+
+
+@patch('informa.plugins.dans.send_alert')
+@patch('informa.plugins.dans.query_product', return_value=decimal.Decimal('15.00'))
+def test_main_maintains_product_index(mock_query_product, mock_send_alert, store):
+    '''
+    Ensure alert suppression uses the persisted index, without reading history from the store
+    '''
+    product = PRODUCTS[0]
+    state = State(index={product.id: ProductIndex()})
+    state.index[product.id].add(History(product, decimal.Decimal('16.00'), now_aest() - datetime.timedelta(days=2), True))
+    recent = state.index[product.id].last_alert
+
+    with patch.object(PriceHistory, 'build_index') as mock_build_index:
+        assert main(state, Config(products=[product])) == 1
+
+    mock_build_index.assert_not_called()
+    mock_send_alert.assert_not_called()
+    assert state.index[product.id].last_alert == recent
+    assert state.index[product.id].latest.price == decimal.Decimal('15.00')
+
+    # Index survives a round trip through the state file
+    assert State.from_dict(state.to_dict()).index == state.index
+
+
+def test_build_index(store):
+    '''
+    Ensure the index is built from the most recent alert and observation for each product
+    '''
+    ts = datetime.datetime(2024, 1, 1, tzinfo=datetime.UTC)
+    store.append([
+        History(PRODUCTS[0], decimal.Decimal('1.00'), ts, alerted=True),
+        History(PRODUCTS[0], decimal.Decimal('2.00'), ts + datetime.timedelta(days=1)),
+        History(PRODUCTS[1], decimal.Decimal('3.00'), ts),
+    ])
+
+    index = store.build_index(['0', '1', '2'])
+
+    assert index['0'].last_alert == Observation(decimal.Decimal('1.00'), ts)
+    assert index['0'].latest == Observation(decimal.Decimal('2.00'), ts + datetime.timedelta(days=1))
+    assert index['0'].count == 2
+    assert index['1'].last_alert is None
+    assert index['1'].latest == Observation(decimal.Decimal('3.00'), ts)
+    assert index['2'] == ProductIndex()
+
+
+@pytest.mark.parametrize('count', [1, 2, 7, 50])
+def test_product_index_aggregates_match_full_history(count):
+    '''
+    Ensure incrementally maintained aggregates, including the histogram median, are exact
+    '''
+    rand = random.Random(count)
+    ts = datetime.datetime(2024, 1, 1, tzinfo=datetime.UTC)
+    prices = [decimal.Decimal(rand.choice(['17.99', '18.50', '19.99', '22.00', '24.95'])) for _ in range(count)]
+
+    index = ProductIndex()
+    for i, price in enumerate(prices):
+        index.add(History(PRODUCTS[0], price, ts + datetime.timedelta(hours=i)))
+
+    stats = index.stats(PRODUCTS[0])
+    assert stats['Count'] == count
+    assert stats['Lowest'] == min(prices)
+    assert stats['Highest'] == max(prices)
+    assert stats['Median'] == statistics.median(prices)
+    assert stats['Latest'] == prices[-1]
+    assert stats['First Fetch'] == ts
+
+
+def test_get_stats_from_index(store):
+    '''
+    Ensure stats are served from the index, for products in the product table
+    '''
+    ts = datetime.datetime(2024, 1, 1, tzinfo=datetime.UTC)
+    store.write_products(PRODUCTS[:2])
+    state = State(index={'1': ProductIndex(), '0': ProductIndex(), '99': ProductIndex()})
+    state.index['0'].add(History(PRODUCTS[0], decimal.Decimal('19.99'), ts))
+
+    stats = get_stats(state)
+    assert [row['name'] for row in stats] == ['Wine 0', 'Wine 1']
+    assert stats[0]['Median'] == decimal.Decimal('19.99')
+    assert stats[1]['Count'] == 0
+
+
+@patch('informa.plugins.dans.send_alert')
+@patch('informa.plugins.dans.query_product')
+def test_main_writes_runs_on_price_change(mock_query_product, mock_send_alert, store):
+    '''
+    Ensure unchanged prices extend the open run in state, and only closed runs are written to the store
+    '''
+    product = PRODUCTS[0]
+    state = State()
+
+    for price in ('25.00', '25.00', '25.00', '26.00'):
+        mock_query_product.return_value = decimal.Decimal(price)
+        main(state, Config(products=[product]))
+
+    runs = store.read(columns=['price', 'count']).to_pylist()
+    assert runs == [{'price': decimal.Decimal('25.00'), 'count': 3}]
+    assert state.index['0'].run.price == decimal.Decimal('26.00')
+    assert state.index['0'].count == 4
+
+    # Open run survives a round trip through the state file
+    assert State.from_dict(state.to_dict()).index['0'].run == state.index['0'].run
+
+
+def test_alerts_start_new_runs():
+    '''
+    Ensure an alerted observation is never merged into a run, so the last alert is kept exactly
+    '''
+    ts = datetime.datetime(2024, 1, 1, tzinfo=datetime.UTC)
+    index = ProductIndex()
+
+    closed = [
+        index.add(History(PRODUCTS[0], decimal.Decimal('15.00'), ts + datetime.timedelta(hours=i), alerted=alerted))
+        for i, alerted in enumerate([False, True, False, False])
+    ]
+
+    assert closed == [
+        None,
+        Run(decimal.Decimal('15.00'), ts, ts),
+        Run(decimal.Decimal('15.00'), ts + datetime.timedelta(hours=1), ts + datetime.timedelta(hours=1), alerted=True),
+        None,
+    ]
+    assert index.run.count == 2
+    assert index.last_alert == Observation(decimal.Decimal('15.00'), ts + datetime.timedelta(hours=1))
+
+
+@pytest.mark.parametrize('count', [1, 7, 200])
+def test_index_from_runs_matches_observations(store, count):
+    '''
+    Ensure the index built from compacted runs is identical to one maintained over every observation
+    '''
+    rand = random.Random(count)
+    ts = datetime.datetime(2024, 1, 1, tzinfo=datetime.UTC)
+    observations = []
+    price = decimal.Decimal('19.99')
+
+    for i in range(count):
+        if rand.random() < 0.1:  # noqa: PLR2004
+            price = decimal.Decimal(rand.choice(['17.99', '19.99', '22.00']))
+        observations.append(History(PRODUCTS[0], price, ts + datetime.timedelta(hours=12 * i), rand.random() < 0.05))  # noqa: PLR2004
+
+    expected = ProductIndex()
+    for history in observations:
+        expected.add(history)
+
+    store.append(observations)
+    index = store.build_index(['0'])['0']
+
+    runs = store.read(columns=['count'])
+    assert pc.sum(runs['count']).as_py() == count
+    assert runs.num_rows <= count
+    assert index.stats(PRODUCTS[0]) == expected.stats(PRODUCTS[0])
+    assert index.last_alert == expected.last_alert
+
+
+def test_migrate_observation_dataset(store):
+    '''
+    Ensure the legacy dataset of one row per observation is compacted into runs, and removed
+    '''
+    ts = datetime.datetime(2024, 1, 1, tzinfo=datetime.UTC)
+    legacy = pa.Table.from_pylist(
+        [
+            {'product_id': '0', 'price': decimal.Decimal('19.99'), 'ts': ts + datetime.timedelta(days=i), 'alerted': False}
+            for i in range(10)
+        ],
+        schema=HISTORY_SCHEMA,
+    )
+    store.history_path.mkdir(parents=True)
+    pq.write_table(legacy, store.history_path / 'legacy.parquet')
+
+    migrate_history(State(), store)
+
+    assert not store.history_path.exists()
+    assert store.read(columns=['first_seen', 'last_seen', 'count']).to_pylist() == [
+        {'first_seen': ts, 'last_seen': ts + datetime.timedelta(days=9), 'count': 10}
+    ]
@@ -0,0 +1,688 @@
+import asyncio
+import datetime
+import errno
+import inspect
+import time
+import xmlrpc.client
+from zoneinfo import ZoneInfo
+from unittest.mock import AsyncMock, Mock, patch
+
+import googleapiclient.errors
+import pytest
+
+from informa import app
+from informa.plugins.f1torrents import (
+    AsyncRTorrent,
+    Config,
+    Download,
+    FailedFetchingTorrents,
+    FoundTorrent,
+    Race,
+    RaceWeekend,
+    Release,
+    RTorrent,
+    RtorrentError,
+    RtorrentUnreachable,
+    SCGITransport,
+    State,
+    TorrentSnapshot,
+    add_magnet_to_rtorrent,
+    add_torrents,
+    classify,
+    discover_torrents,
+    next_race_weekend,
+    parse_info_hash,
+    race_weekend_schedule,
+    save_magnet_as_download,
+    plan_reconciliation,
+    set_torrent_file_priorities,
+    sync_f1_calendar,
+    wanted_release,
+)
+
+
+@patch('informa.plugins.f1torrents.mailgun.send')
+@patch('informa.plugins.f1torrents.ensure_awake_async', return_value=True)
+@patch('informa.plugins.f1torrents.AsyncRTorrent')
+def test_add_magnet_wakes_rtorrent_and_retries(mock_rtorrent, mock_ensure_awake, mock_send):
+    '''
+    Ensure a sleeping rtorrent host is woken and the magnet added in the same run
+    '''
+    mock_rtorrent.return_value.add_magnet = AsyncMock(side_effect=[RtorrentUnreachable('No route to host'), None])
+    races = {'2024x05ra': Download('2024x05ra', 'title', 'magnet:?dn=Formula.1.2024x05')}
+
+    assert asyncio.run(add_magnet_to_rtorrent(races)) is True
+    assert races['2024x05ra'].added_to_rtorrent is True
+    assert mock_rtorrent.return_value.add_magnet.await_count == 2
+    mock_ensure_awake.assert_awaited_once()
+
+
+@patch('informa.plugins.f1torrents.ensure_awake_async', return_value=False)
+@patch('informa.plugins.f1torrents.AsyncRTorrent')
+def test_add_magnet_gives_up_when_host_stays_asleep(mock_rtorrent, mock_ensure_awake):
+    '''
+    Ensure the magnet remains pending when rtorrent does not wake before the deadline
+    '''
+    mock_rtorrent.return_value.add_magnet = AsyncMock(side_effect=RtorrentUnreachable('No route to host'))
+    races = {'2024x05ra': Download('2024x05ra', 'title', 'magnet:?dn=Formula.1.2024x05')}
+
+    assert asyncio.run(add_magnet_to_rtorrent(races)) is False
+    assert races['2024x05ra'].added_to_rtorrent is False
+
+
+def test_async_rtorrent_unreachable_host_wakes_jorg():
+    '''
+    Ensure a failed connect to a sleeping host is recognised by errno, so jorg is woken and the magnet added
+    '''
+    calls = []
+
+    async def run():
+        server = await _serve_scgi(lambda method, params: calls.append(method) or 0)
+        async with server:
+            open_connection = asyncio.open_connection
+            port = server.sockets[0].getsockname()[1]
+
+            async def connect(host, _):
+                if not calls:
+                    calls.append('connect')
+                    raise OSError(errno.EHOSTUNREACH, f"Connect call failed ('{host}', 5000)")
+                return await open_connection('127.0.0.1', port)
+
+            with (
+                patch('informa.plugins.f1torrents.asyncio.open_connection', side_effect=connect),
+                patch('informa.plugins.f1torrents.ensure_awake_async', return_value=True) as mock_ensure_awake,
+                patch('informa.plugins.f1torrents.mailgun.send'),
+            ):
+                races = {'2024x05ra': Download('2024x05ra', 'title', 'magnet:?dn=Formula.1.2024x05')}
+                assert await add_magnet_to_rtorrent(races) is True
+
+            mock_ensure_awake.assert_awaited_once()
+
+    asyncio.run(run())
+    assert calls == ['connect', 'load.start_verbose']
+
+
+def test_add_torrents_runs_after_each_run():
+    '''
+    Ensure magnets are added by an async task chained after run, while run itself stays sync
+    '''
+    tasks = {task.func.__name__: task for task in app.plugins['informa.plugins.f1torrents'].tasks}
+
+    assert not inspect.iscoroutinefunction(tasks['run'].func)
+    assert inspect.iscoroutinefunction(tasks['add_torrents'].func)
+    assert tasks['add_torrents'].condition.depend_task == 'informa.plugins.f1torrents.run'
+
+
+@patch('informa.plugins.f1torrents.mailgun.send')
+@patch('informa.plugins.f1torrents.AsyncRTorrent')
+def test_add_torrents_merges_into_latest_state(mock_rtorrent, mock_send):
+    '''
+    Ensure races recorded by another task while rtorrent was awaited are kept
+    '''
+    states = [
+        State(races={'2024x05ra': Download('2024x05ra', 'title', 'magnet:?dn=Formula.1.2024x05')}),
+        State(
+            races={
+                '2024x05ra': Download('2024x05ra', 'title', 'magnet:?dn=Formula.1.2024x05'),
+                '2024x05qu': Download('2024x05qu', 'title', 'magnet:?dn=Formula.1.2024x05'),
+            }
+        ),
+    ]
+    mock_rtorrent.return_value.add_magnet = AsyncMock()
+    plugin = Mock()
+    plugin.load_state.side_effect = states
+
+    asyncio.run(add_torrents(plugin))
+
+    written = plugin.write_state.call_args.args[0]
+    assert written is states[1]
+    assert written.races['2024x05ra'].added_to_rtorrent is True
+    assert written.races['2024x05qu'].added_to_rtorrent is False
+
+
+def _mock_rtorrent(downloads: list, files: dict) -> RTorrent:
+    'Create an RTorrent with a mocked SCGI server returning downloads & files'
+    rt = RTorrent('localhost', 5000)
+    rt.server = Mock()
+    rt.server.d.multicall2.return_value = downloads
+    rt.server.system.multicall.side_effect = lambda calls: [[files[c['params'][0]]] for c in calls]
+    return rt
+
+
+def test_rtorrent_get_torrents_batches_file_queries():
+    '''
+    Ensure files for every download are fetched in a single system.multicall
+    '''
+    rt = _mock_rtorrent(
+        [
+            ['aaa', 'Formula.1.2024x05.China.Race.SkyF1UHD.2160P', 1024, 'F1'],
+            ['bbb', 'Formula.1.2024x05.China.Qualifying.SkyF1UHD.2160P', 2048, ''],
+        ],
+        {
+            'aaa': [['01.Pre-Race.mp4', 1024, 10, 10, 1], ['02.Race.Session.mp4', 2048, 20, 10, 2]],
+            'bbb': [['02.Qualifying.Session.mp4', 2048, 20, 0, 0]],
+        },
+    )
+
+    torrents = rt.get_torrents()
+
+    rt.server.system.multicall.assert_called_once()
+    assert list(torrents) == ['aaa', 'bbb']
+    assert torrents['aaa']['progress'] == '66.7%'
+    assert torrents['aaa']['files'][1]['priority'] == 'high'
+    assert torrents['bbb']['files'][0]['priority'] == 'skip'
+
+
+@patch('informa.plugins.f1torrents.RT_MULTICALL_CHUNK', 2)
+def test_rtorrent_get_torrents_filters_before_fetching_files():
+    '''
+    Ensure filtered-out downloads are never queried for files, and multicalls are chunked
+    '''
+    rt = _mock_rtorrent(
+        [
+            ['aaa', 'Formula.1.2024x05.China.Race', 0, ''],
+            ['bbb', 'Some.Other.Torrent', 0, ''],
+            ['ccc', 'Formula.1.2024x05.China.Qualifying', 0, ''],
+            ['ddd', 'Formula.1.2024x05.China.Sprint', 0, ''],
+        ],
+        {'aaa': [], 'ccc': [], 'ddd': []},
+    )
+
+    torrents = rt.get_torrents(view='started', name_filter='Formula.1')
+
+    assert list(torrents) == ['aaa', 'ccc', 'ddd']
+    assert rt.server.d.multicall2.call_args.args[1] == 'started'
+    assert rt.server.system.multicall.call_count == 2
+
+
+class FakeSocket:
+    'Socket which returns a response in fixed size chunks via recv_into'
+
+    def __init__(self, data: bytes, chunk_size: int):
+        self.chunks = [data[i : i + chunk_size] for i in range(0, len(data), chunk_size)]
+
+    def recv_into(self, buf):
+        if not self.chunks:
+            return 0
+        chunk = self.chunks.pop(0)
+        buf[: len(chunk)] = chunk
+        return len(chunk)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 4096])
+@pytest.mark.parametrize('separator', [b'\r\n\r\n', b'\n\n'])
+def test_scgi_transport_parses_streamed_response(chunk_size, separator):
+    '''
+    Ensure SCGI headers are split from the body regardless of how the response is chunked
+    '''
+    body = xmlrpc.client.dumps(([['aaa', 'Formula.1.2024x05', 1024, 'F1']],), methodresponse=True).encode()
+    response = b'Status: 200 OK\r\nContent-Type: text/xml' + separator + body
+
+    assert SCGITransport(bufsize=chunk_size).parse_response(FakeSocket(response, chunk_size)) == (
+        [['aaa', 'Formula.1.2024x05', 1024, 'F1']],
+    )
+
+
+def test_scgi_transport_raises_on_missing_body():
+    '''
+    Ensure a response truncated within the SCGI headers raises RtorrentError
+    '''
+    with pytest.raises(RtorrentError):
+        SCGITransport().parse_response(FakeSocket(b'Status: 200 OK\r\n', 4096))
+
+
+async def _serve_scgi(handler, delay: float = 0) -> asyncio.Server:
+    'Start a local SCGI server, which responds to each XML-RPC call with handler(method, params)'
+
+    async def handle(reader, writer):
+        length = int((await reader.readuntil(b':'))[:-1])
+        headers = (await reader.readexactly(length + 1))[:-1].split(b'\x00')
+        params, method = xmlrpc.client.loads(await reader.readexactly(int(headers[1])))
+
+        await asyncio.sleep(delay)
+
+        body = xmlrpc.client.dumps((handler(method, params),), methodresponse=True).encode()
+        writer.write(b'Status: 200 OK\r\nContent-Type: text/xml\r\n\r\n' + body)
+        await writer.drain()
+        writer.close()
+
+    return await asyncio.start_server(handle, '127.0.0.1', 0)
+
+
+def test_async_rtorrent_get_torrents():
+    '''
+    Ensure AsyncRTorrent fetches downloads and their files via system.multicall
+    '''
+
+    def handler(method, params):
+        if method == 'd.multicall2':
+            return [['aaa', 'Formula.1.2024x05.China.Race', 1024, 'F1'], ['bbb', 'Other', 0, '']]
+        if method == 'system.multicall':
+            return [[[['02.Race.Session.mp4', 2048, 20, 20, 2]]] for _ in params[0]]
+        raise AssertionError(method)
+
+    async def run():
+        server = await _serve_scgi(handler)
+        async with server:
+            rt = AsyncRTorrent('127.0.0.1', server.sockets[0].getsockname()[1])
+            return await rt.get_torrents(name_filter='Formula.1')
+
+    torrents = asyncio.run(run())
+
+    assert list(torrents) == ['aaa']
+    assert torrents['aaa']['complete'] is True
+    assert torrents['aaa']['files'][0]['priority'] == 'high'
+
+
+def test_async_rtorrent_concurrent_calls_and_timeout():
+    '''
+    Ensure calls run concurrently on separate connections, and slow calls raise RtorrentError
+    '''
+
+    async def run():
+        server = await _serve_scgi(lambda method, params: 2, delay=0.2)
+        async with server:
+            port = server.sockets[0].getsockname()[1]
+
+            rt = AsyncRTorrent('127.0.0.1', port)
+            start = asyncio.get_running_loop().time()
+            results = await asyncio.gather(*[rt.get_file_priority('aaa', i) for i in range(4)])
+            elapsed = asyncio.get_running_loop().time() - start
+
+            with pytest.raises(RtorrentError):
+                await AsyncRTorrent('127.0.0.1', port, timeout=0.05).get_file_priority('aaa', 0)
+
+        return results, elapsed
+
+    results, elapsed = asyncio.run(run())
+
+    assert results == [2, 2, 2, 2]
+    assert elapsed < 0.6
+
+
+def test_torrent_snapshot_refreshes_only_changed_downloads():
+    '''
+    Ensure files are only refetched for new or changed downloads, and removed downloads are dropped
+    '''
+    rt = Mock()
+    rt.get_files = AsyncMock(
+        side_effect=lambda hash_ids: {h: [['02.Race.Session.mp4', 2048, 20, 10, 1]] for h in hash_ids}
+    )
+    snapshot = TorrentSnapshot()
+
+    rt.list_downloads = AsyncMock(return_value=[['aaa', 'Formula.1.A', 0, ''], ['bbb', 'Formula.1.B', 0, '']])
+    assert asyncio.run(snapshot.refresh(rt)) == 2
+
+    rt.list_downloads = AsyncMock(return_value=[['aaa', 'Formula.1.A', 0, ''], ['bbb', 'Formula.1.B', 1024, '']])
+    assert asyncio.run(snapshot.refresh(rt)) == 1
+    assert rt.get_files.call_args.args[0] == ['bbb']
+
+    rt.list_downloads = AsyncMock(return_value=[['bbb', 'Formula.1.B', 1024, '']])
+    assert asyncio.run(snapshot.refresh(rt)) == 0
+    assert list(snapshot.torrents) == ['bbb']
+    assert snapshot.refreshed is not None
+
+
+def test_torrent_snapshot_refetches_invalidated_downloads():
+    '''
+    Ensure files are refetched for downloads whose priorities were changed, though their version is unchanged
+    '''
+    rt = Mock()
+    rt.list_downloads = AsyncMock(return_value=[['aaa', 'Formula.1.A', 0, 'F1'], ['bbb', 'Formula.1.B', 0, 'F1']])
+    rt.get_files = AsyncMock(
+        side_effect=lambda hash_ids: {h: [['02.Race.Session.mp4', 2048, 20, 10, 1]] for h in hash_ids}
+    )
+    snapshot = TorrentSnapshot()
+    asyncio.run(snapshot.refresh(rt))
+
+    rt.get_files = AsyncMock(
+        side_effect=lambda hash_ids: {h: [['02.Race.Session.mp4', 2048, 20, 10, 2]] for h in hash_ids}
+    )
+    snapshot.invalidate(['aaa'])
+
+    assert asyncio.run(snapshot.refresh(rt)) == 1
+    assert snapshot.torrents['aaa']['files'][0]['priority'] == 'high'
+    assert snapshot.torrents['bbb']['files'][0]['priority'] == 'normal'
+
+
+def _torrent(tag: str, files: list[tuple[str, str]]) -> dict:
+    return {'name': 'Formula.1.2024x05', 'tag': tag, 'files': [{'filename': f, 'priority': p} for f, p in files]}
+
+
+def test_plan_reconciliation_only_includes_needed_changes():
+    '''
+    Ensure only missing tags and priorities generate rtorrent calls
+    '''
+    calls = plan_reconciliation(
+        {
+            'aaa': _torrent('F1', [('01.Pre-Race.mp4', 'normal'), ('02.Race.Session.mp4', 'high')]),
+            'bbb': _torrent('', [('01.Pre-Qualifying.mp4', 'normal'), ('02.Qualifying.Session.mp4', 'normal')]),
+        }
+    )
+
+    assert calls == [
+        ('d.custom1.set', ('bbb', 'F1')),
+        ('f.priority.set', ('bbb:f1', 2)),
+        ('d.update_priorities', ('bbb',)),
+    ]
+
+
+@patch('informa.plugins.f1torrents.reconciled', set())
+@patch('informa.plugins.f1torrents.AsyncRTorrent')
+def test_set_torrent_file_priorities_steady_state_does_no_writes(mock_rtorrent):
+    '''
+    Ensure changes are applied as one multicall, and reconciled torrents are not revisited
+    '''
+    mock_rtorrent.return_value.multicall = AsyncMock()
+
+    snapshot = TorrentSnapshot(
+        torrents={
+            'aaa': _torrent('', [('02.Race.Session.mp4', 'normal')]),
+            'bbb': _torrent('', []),
+        },
+        refreshed=datetime.datetime.now(tz=datetime.UTC),
+    )
+
+    with patch('informa.plugins.f1torrents.snapshot', snapshot):
+        asyncio.run(set_torrent_file_priorities(None))
+        mock_rtorrent.return_value.multicall.assert_called_once()
+        assert snapshot.versions == {}
+
+        # Magnet awaiting metadata is retried, the reconciled torrent is skipped
+        mock_rtorrent.return_value.multicall.reset_mock()
+        asyncio.run(set_torrent_file_priorities(None))
+        assert mock_rtorrent.return_value.multicall.call_args.args[0] == [('d.custom1.set', ('bbb', 'F1'))]
+
+
+def _event(event_id: str, summary: str, start: str, status: str = 'confirmed') -> dict:
+    return {'id': event_id, 'status': status, 'summary': summary, 'start': {'dateTime': start}}
+
+
+def _mock_calendar(mock_gc, *pages):
+    '''
+    Mock the paged Google Calendar events().list API, returning each page in turn
+    '''
+    events = mock_gc.return_value.service.events.return_value
+    requests = [Mock(execute=Mock(return_value=page)) for page in pages]
+    events.list.return_value = requests[0]
+    events.list_next.side_effect = [*requests[1:], None]
+    return events
+
+
+@patch('informa.plugins.f1torrents.Credentials')
+@patch('informa.plugins.f1torrents.GoogleCalendar')
+@patch.dict('os.environ', {'GSUITE_OAUTH_CREDS': 'creds.json'})
+def test_sync_f1_calendar_full_then_incremental(mock_gc, _):
+    '''
+    Ensure the first sync fetches every page, and subsequent syncs apply only changes
+    '''
+    events = _mock_calendar(
+        mock_gc,
+        {'items': [_event('a', 'F1: Grand Prix (Bahrain)', '2024-03-02T15:00:00Z')]},
+        {
+            'items': [
+                _event('b', 'F1: Grand Prix (Monaco)', '2024-05-26T13:00:00Z'),
+                _event('c', 'F1: Practice 1 (Monaco)', '2024-05-24T11:30:00Z'),
+            ],
+            'nextSyncToken': 'token1',
+        },
+    )
+    state = State()
+    config = Config(current_season=2024, gcal='f1')
+
+    assert sync_f1_calendar(state, config) is True
+    assert state.calendar_sync_token == 'token1'
+    assert [r.title for r in state.calendar.values()] == ['Bahrain', 'Monaco']
+    assert state.weekends[0] == RaceWeekend(datetime.date(2024, 3, 1), datetime.date(2024, 3, 5))
+    assert 'syncToken' not in events.list.call_args.kwargs
+
+    # Incremental sync cancels Bahrain
+    events = _mock_calendar(mock_gc, {'items': [{'id': 'a', 'status': 'cancelled'}], 'nextSyncToken': 'token2'})
+
+    assert sync_f1_calendar(state, config) is True
+    assert events.list.call_args.kwargs['syncToken'] == 'token1'
+    assert state.calendar_sync_token == 'token2'
+    assert list(state.calendar) == ['b']
+    assert len(state.weekends) == 1
+
+
+@patch('informa.plugins.f1torrents.Credentials')
+@patch('informa.plugins.f1torrents.GoogleCalendar')
+@patch.dict('os.environ', {'GSUITE_OAUTH_CREDS': 'creds.json'})
+def test_sync_f1_calendar_expired_token_does_full_sync(mock_gc, _):
+    '''
+    Ensure an expired sync token falls back to a full sync, dropping stale races
+    '''
+    expired = googleapiclient.errors.HttpError(Mock(status=410), b'Sync token is no longer valid')
+    events = mock_gc.return_value.service.events.return_value
+    events.list.side_effect = [
+        Mock(execute=Mock(side_effect=expired)),
+        Mock(
+            execute=Mock(
+                return_value={
+                    'items': [_event('b', 'F1: Grand Prix (Monaco)', '2024-05-26T13:00:00Z')],
+                    'nextSyncToken': 'fresh',
+                }
+            )
+        ),
+    ]
+    events.list_next.return_value = None
+
+    state = State(
+        calendar={'a': Race('Bahrain', datetime.datetime(2024, 3, 2, tzinfo=datetime.UTC))},
+        calendar_sync_token='stale',
+    )
+
+    assert sync_f1_calendar(state, Config(current_season=2024, gcal='f1')) is True
+    assert 'syncToken' not in events.list.call_args.kwargs
+    assert state.calendar_sync_token == 'fresh'
+    assert list(state.calendar) == ['b']
+
+
+WEEKENDS = [
+    RaceWeekend(datetime.date(2024, 3, 1), datetime.date(2024, 3, 5)),
+    RaceWeekend(datetime.date(2024, 5, 24), datetime.date(2024, 5, 28)),
+]
+
+
+@pytest.mark.parametrize(
+    ('today', 'expected'),
+    [
+        (datetime.date(2024, 2, 29), WEEKENDS[0]),
+        (datetime.date(2024, 3, 1), WEEKENDS[0]),
+        (datetime.date(2024, 3, 5), WEEKENDS[0]),
+        (datetime.date(2024, 3, 6), WEEKENDS[1]),
+        (datetime.date(2024, 5, 26), WEEKENDS[1]),
+        (datetime.date(2024, 12, 1), None),
+    ],
+)
+def test_next_race_weekend(today, expected):
+    assert next_race_weekend(WEEKENDS, today) == expected
+
+
+@pytest.mark.parametrize(
+    ('now', 'last_run', 'expected'),
+    [
+        # Dormant until the next weekend starts
+        ('2024-04-10T12:00', '2024-03-05T23:50', '2024-05-24T00:00'),
+        # Polling every interval during a weekend
+        ('2024-05-25T12:00', '2024-05-25T11:55', '2024-05-25T12:10'),
+        # First run fires immediately during a weekend
+        ('2024-05-25T12:00', None, '2024-05-25T12:00'),
+        # Nothing left in the season
+        ('2024-06-10T12:00', '2024-05-28T23:50', None),
+    ],
+)
+def test_race_weekend_schedule(now, last_run, expected):
+    '''
+    Ensure tasks fire densely within race weekends, and sleep until the next weekend otherwise
+    '''
+    tz = ZoneInfo('Australia/Melbourne')
+
+    def parse(value):
+        return datetime.datetime.fromisoformat(value).replace(tzinfo=tz) if value else None
+
+    plugin = Mock()
+    plugin.load_state.return_value = State(weekends=WEEKENDS)
+    next_fire = race_weekend_schedule(datetime.timedelta(minutes=15))
+
+    with patch('informa.plugins.f1torrents.now_aest', return_value=parse(now)):
+        assert next_fire(plugin, parse(last_run)) == parse(expected)
+
+
+@pytest.mark.parametrize(
+    ('now', 'last_run', 'expected'),
+    [
+        # Idle polling between weekends
+        ('2024-04-10T12:00', '2024-04-10T11:50', '2024-04-10T12:20'),
+        # The next weekend starts before the idle interval is up
+        ('2024-05-23T23:50', '2024-05-23T23:45', '2024-05-24T00:00'),
+        # Dense polling during a weekend
+        ('2024-05-25T12:00', '2024-05-25T11:55', '2024-05-25T11:56'),
+        # Idle polling continues after the season
+        ('2024-06-10T12:00', '2024-06-10T11:40', '2024-06-10T12:10'),
+    ],
+)
+def test_race_weekend_schedule_idle(now, last_run, expected):
+    '''
+    Ensure tasks with an idle interval keep running between race weekends
+    '''
+    tz = ZoneInfo('Australia/Melbourne')
+
+    def parse(value):
+        return datetime.datetime.fromisoformat(value).replace(tzinfo=tz) if value else None
+
+    plugin = Mock()
+    plugin.load_state.return_value = State(weekends=WEEKENDS)
+    next_fire = race_weekend_schedule(datetime.timedelta(minutes=1), idle=datetime.timedelta(minutes=30))
+
+    with patch('informa.plugins.f1torrents.now_aest', return_value=parse(now)):
+        assert next_fire(plugin, parse(last_run)) == parse(expected)
+
+
+def _found(info_hash: str, session_type: str = 'ra') -> FoundTorrent:
+    release = Release(2024, 5, session_type, 'SkyF1UHD')
+    return FoundTorrent(info_hash, f'Formula.1.2024x05.{info_hash}', release, f'magnet:?xt=urn:btih:{info_hash}')
+
+
+def test_discover_torrents_dedupes_across_sources_and_state():
+    '''
+    Ensure torrents are deduped by info hash across sources, and against those already in state
+    '''
+    state = State(races={'2024x05ra': Download('2024x05ra', 'title', 'magnet', info_hash='AAA')})
+    sources = {
+        'one': Mock(return_value=[_found('AAA'), _found('BBB')]),
+        'two': Mock(return_value=[_found('BBB'), _found('CCC', 'qu')]),
+    }
+
+    with patch.dict('informa.plugins.f1torrents.SOURCES', sources):
+        found = discover_torrents(Config(current_season=2024, gcal='f1', sources=['one', 'two']), state)
+
+    assert sorted(t.info_hash for t in found) == ['BBB', 'CCC']
+
+
+def test_discover_torrents_prefers_sources_in_config_order():
+    '''
+    Ensure the first configured source's release wins for a session, even when it answers last
+    '''
+
+    def slow_uhd(*_):
+        time.sleep(0.1)
+        return [_found('UHD')]
+
+    sources = {'thepiratebay': Mock(side_effect=slow_uhd), 'torrentgalaxy': Mock(return_value=[_found('HD')])}
+    config = Config(current_season=2024, gcal='f1', sources=['thepiratebay', 'torrentgalaxy'])
+
+    with patch.dict('informa.plugins.f1torrents.SOURCES', sources):
+        found = discover_torrents(config, State())
+
+    assert [t.info_hash for t in found] == ['UHD', 'HD']
+
+    state = State()
+    assert [save_magnet_as_download(state, t) for t in found] == [True, False]
+    assert state.races['2024x05ra'].info_hash == 'UHD'
+
+
+def test_discover_torrents_failed_source_does_not_block_others():
+    '''
+    Ensure a failing source is skipped, and an error only raised when every source fails
+    '''
+    config = Config(current_season=2024, gcal='f1', sources=['up', 'down'])
+    sources = {
+        'up': Mock(return_value=[_found('AAA')]),
+        'down': Mock(side_effect=FailedFetchingTorrents('Failed loading from down')),
+    }
+
+    with patch.dict('informa.plugins.f1torrents.SOURCES', sources):
+        assert [t.info_hash for t in discover_torrents(config, State())] == ['AAA']
+
+        sources['up'].side_effect = FailedFetchingTorrents('Failed loading from up')
+        with pytest.raises(FailedFetchingTorrents):
+            discover_torrents(config, State())
+
+
+@patch('informa.plugins.f1torrents.DISCOVERY_DEADLINE', 0.1)
+def test_discover_torrents_skips_sources_past_deadline():
+    '''
+    Ensure discovery returns at its deadline with the sources which answered, without waiting on slow ones
+    '''
+    config = Config(current_season=2024, gcal='f1', sources=['slow', 'fast'])
+    sources = {'slow': Mock(side_effect=lambda *_: time.sleep(1)), 'fast': Mock(return_value=[_found('AAA')])}
+
+    with patch.dict('informa.plugins.f1torrents.SOURCES', sources):
+        start = time.monotonic()
+        found = discover_torrents(config, State())
+
+    assert time.monotonic() - start < 0.5
+    assert [t.info_hash for t in found] == ['AAA']
+
+
+@pytest.mark.parametrize(
+    'magnet',
+    [
+        'magnet:?xt=urn:btih:5ca1ab1e00000000000000000000000000000000&dn=Formula.1',
+        'magnet:?dn=Formula.1&xt=urn:btih:LSQ2WHQAAAAAAAAAAAAAAAAAAAAAAAAA',
+    ],
+)
+def test_parse_info_hash(magnet):
+    assert parse_info_hash(magnet) == '5CA1AB1E00000000000000000000000000000000'
+
+
+@pytest.mark.parametrize(
+    ('title', 'expected'),
+    [
+        ('Formula.1.2024x05.Monaco.Race.SkyF1UHD.2160P', Release(2024, 5, 'ra', 'SkyF1UHD.2160P')),
+        ('Formula.1.2024x06.Canada.Qualifying.SkyF1HD.1080p', Release(2024, 6, 'qu', 'SkyF1HD.1080p')),
+        ('Formula.1.2024x11.Austria.Sprint.Qualifying.SkyF1UHD.2160P', Release(2024, 11, 'sq', 'SkyF1UHD.2160P')),
+        ('Formula.1.2024x11.Austria.Sprint.SkyF1UHD.2160P', Release(2024, 11, 'sr', 'SkyF1UHD.2160P')),
+        ('Formula.1.2023x22.Season.Review.SkyF1UHD.2160P', Release(2023, 22, 'rv', 'SkyF1UHD.2160P')),
+        ('Formula.1.2024x05.Teds.Qualifying.Notebook.SkyF1UHD.2160P', Release(2024, 5, 'qu', 'SkyF1UHD.2160P', teds=True)),
+        ('Formula.1.2024x05.Monaco.Drivers.Press.Conference.SkyF1UHD.2160P', Release(2024, 5, None, 'SkyF1UHD.2160P')),
+        ('Formula.1.2024x05.Monaco.Pre-Race.Buildup.SkyF1UHD.2160P', Release(2024, 5, None, 'SkyF1UHD.2160P')),
+        ('Formula.1.2024x05.Monaco.Post-Race.Analysis.SkyF1UHD.2160P', Release(2024, 5, None, 'SkyF1UHD.2160P')),
+        ('Formula.1.2024x05.Monaco.Racetrack.Tour.SkyF1UHD.2160P', Release(2024, 5, None, 'SkyF1UHD.2160P')),
+        ('Formula.E.2024x05.Monaco.Race.1080p', None),
+    ],
+)
+def test_classify(title, expected):
+    assert classify(title) == expected
+
+
+@pytest.mark.parametrize(
+    ('title', 'expected'),
+    [
+        ('Formula.1.2024x05.Monaco.Race.SkyF1UHD.2160P', '2024x05ra'),
+        ('Formula.1.2024x05.Monaco.Pre-Race.Buildup.SkyF1UHD.2160P', None),
+        ('Formula.1.2024x05.Monaco.Race.SkyF1HD.1080p', None),
+        ('Formula.1.2023x05.Monaco.Race.SkyF1UHD.2160P', None),
+        ('Formula.1.2024x05.Monaco.Sprint.Qualifying.SkyF1UHD.2160P', '2024x05sq'),
+        ('Formula.1.2024x05.Monaco.FP1.SkyF1UHD.2160P', None),
+    ],
+)
+def test_wanted_release(title, expected):
+    '''
+    Ensure only race sessions in the current season and quality are wanted, and a build-up show never takes
+    the Race key
+    '''
+    release = wanted_release(title, 2024, 'SkyF1UHD')
+    assert (release.key if release else None) == expected
@@ -0,0 +1,75 @@
+from unittest.mock import patch
+
+from informa.lib.ssh import Job
+from informa.lib.utils import now_aest
+from informa.plugins.megadl import Download, State, download_complete, main
+
+
+def _finished_job(*output: str) -> Job:
+    job = Job('megadlz', started=now_aest(), finished=now_aest(), exit_status=0)
+    job.output.extend(output)
+    return job
+
+
+@patch('informa.plugins.megadl.recent', [])
+@patch('informa.plugins.megadl.run_background')
+def test_main_counts_finished_job_and_starts_next(mock_run_background):
+    '''
+    Ensure a finished download is counted, and megadlz started again
+    '''
+    jobs = [_finished_job('Downloading', 'Downloaded Some.Files', 'Count 3', 'Size 4096')]
+
+    with patch('informa.plugins.megadl.jobs', jobs):
+        assert main(State()) == 3
+
+    assert jobs == [mock_run_background.return_value]
+    assert mock_run_background.call_args.args[2].endswith(' && megadlz')
+
+
+@patch('informa.plugins.megadl.run_background')
+def test_main_skips_while_downloads_in_progress(mock_run_background):
+    '''
+    Ensure no new downloads are started while others are still in progress
+    '''
+    with patch('informa.plugins.megadl.jobs', [Job('megadlz')]):
+        assert main(State()) == 0
+
+    mock_run_background.assert_not_called()
+
+
+@patch('informa.plugins.megadl.recent', [])
+@patch('informa.plugins.megadl.run_background')
+def test_main_counts_failed_download(mock_run_background):
+    '''
+    Ensure a failed download is not counted
+    '''
+    jobs = [_finished_job('ERROR: quota exceeded')]
+
+    with patch('informa.plugins.megadl.jobs', jobs):
+        assert main(State()) == 0
+
+    assert jobs == [mock_run_background.return_value]
+
+
+@patch('informa.plugins.megadl.app')
+@patch('informa.plugins.megadl.measure_download')
+@patch('informa.plugins.megadl.run_background')
+def test_download_complete_records_and_continues_with_backlog(mock_run_background, mock_measure_download, mock_app):
+    '''
+    Ensure a download is written to state as it completes, and megadlz is run again straight after, stopping
+    once nothing is downloaded
+    '''
+    state = State(downloads=[Download('B', 1, None, 1.0, now_aest())])
+    plugin = mock_app.plugins['informa.plugins.megadl']
+    plugin.load_state.return_value = state
+
+    with patch('informa.plugins.megadl.jobs', []) as jobs:
+        download_complete(_finished_job('Downloaded Some.Files', 'Count 3', 'Size 4096'))
+        assert len(jobs) == 1
+
+        download_complete(_finished_job('Nothing to download'))
+        assert len(jobs) == 1
+
+    assert state.completed == ['Some.Files']
+    assert [(d.name, d.files, d.size) for d in state.downloads[1:]] == [('Some.Files', 3, 4096)]
+    plugin.write_state.assert_called_with(state)
@@ -0,0 +1,57 @@
+import datetime
+from unittest.mock import patch
+
+from informa.lib.utils import now_aest
+from informa.plugins.tailscale_dns import Device, State, device_fingerprint, main
+
+
+@patch('informa.plugins.tailscale_dns.update_dns_record', return_value=True)
+@patch('informa.plugins.tailscale_dns.fetch_dns_records')
+@patch('informa.plugins.tailscale_dns.fetch_tailscale_devices')
+def test_main_updates_only_records_differing_from_zone(mock_devices, mock_zone, mock_update):
+    '''
+    Ensure records are diffed against the live zone, correcting drift even when state matches the tailnet
+    '''
+    mock_devices.return_value = [Device('jorg', '100.0.0.1'), Device('trevor', '100.0.0.2'), Device('new', '100.0.0.3')]
+    # Record for trevor was changed outside of informa
+    mock_zone.return_value = {'jorg': '100.0.0.1', 'trevor': '1.2.3.4', 'www': '5.6.7.8'}
+
+    state = State(tailnet={'jorg': '100.0.0.1', 'trevor': '100.0.0.2'})
+
+    assert main(state) == 2
+    assert sorted(c.args for c in mock_update.call_args_list) == [('new', '100.0.0.3'), ('trevor', '100.0.0.2')]
+    assert state.tailnet == {'jorg': '100.0.0.1', 'trevor': '100.0.0.2', 'new': '100.0.0.3'}
+
+
+@patch('informa.plugins.tailscale_dns.update_dns_record', side_effect=lambda hostname, _: hostname != 'new')
+@patch('informa.plugins.tailscale_dns.fetch_dns_records', return_value={})
+@patch('informa.plugins.tailscale_dns.fetch_tailscale_devices')
+def test_main_failed_update_not_saved(mock_devices, mock_zone, mock_update):
+    '''
+    Ensure a failed Gandi update is not recorded in state
+    '''
+    mock_devices.return_value = [Device('jorg', '100.0.0.1'), Device('new', '100.0.0.3')]
+    state = State()
+
+    assert main(state) == 1
+    assert state.tailnet == {'jorg': '100.0.0.1'}
+
+
+@patch('informa.plugins.tailscale_dns.fetch_dns_records')
+@patch('informa.plugins.tailscale_dns.fetch_tailscale_devices')
+def test_main_skips_unchanged_tailnet(mock_devices, mock_zone):
+    '''
+    Ensure an unchanged tailnet skips the Gandi reconcile, until the reconcile interval has passed
+    '''
+    devices = [Device('trevor', '100.0.0.2'), Device('jorg', '100.0.0.1')]
+    mock_devices.return_value = devices
+    mock_zone.return_value = {'jorg': '100.0.0.1', 'trevor': '100.0.0.2'}
+
+    state = State(fingerprint=device_fingerprint(devices[::-1]), reconciled=now_aest())
+    assert main(state) == 0
+    mock_zone.assert_not_called()
+
+    state.reconciled -= datetime.timedelta(days=2)
+    assert main(state) == 0
+    mock_zone.assert_called_once()
+    assert now_aest() - state.reconciled < datetime.timedelta(minutes=1)
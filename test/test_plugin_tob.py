@@ -1,10 +1,29 @@
 import datetime
 import decimal
-from unittest.mock import Mock, patch
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock, Mock, patch
 
 import pandas as pd
-
-from informa.plugins.tob import Order, OrderLine, Wine, extract_wines, merge_upstream, parse_email
+import pytest
+import requests
+
+from informa.plugins.tob import (
+    Order,
+    OrderLine,
+    PageCache,
+    State,
+    Wine,
+    backfill,
+    extract_wines,
+    main,
+    merge_upstream,
+    pack_links,
+    parse_email,
+)
 
 
 @patch('requests.get')
@@ -234,6 +253,106 @@ def test_tob_extract_wines_uses_user_agent(mock_requests_get, http_response):
     assert mock_requests_get.call_args.kwargs.get('headers', {}).get('User-Agent')
 
 
+def test_tob_page_cache_prefetches_pack(tmp_path, http_response):
+    '''
+    Test a mixed pack and the pages of its wines are prefetched, then extracted from the cache without refetching
+    '''
+    pack = http_response('tob_site_pack_25751')
+    site = {
+        'fakeurl': pack,
+        **{url: http_response(f'tob_site_pack_25751_item_{i}') for i, url in enumerate(pack_links(pack), 1)},
+    }
+
+    pages = PageCache(tmp_path)
+    with patch.object(pages.session, 'get', side_effect=lambda url, timeout: Mock(text=site[url])) as mock_get:
+        pages.prefetch(['fakeurl'])
+        wines = extract_wines('fakeurl', OrderLine(decimal.Decimal('236.34'), 6), pages=pages)
+
+    assert sorted(call.args[0] for call in mock_get.call_args_list) == sorted(site)
+    assert [w.tag for w in wines] == [
+        'Premier Cru Complexity',
+        'Yours Sancerre-ly!',
+        'Saint-Émilion Grand Cru',
+        'Burgundy Brut',
+        'V-V-V Vouvray',
+        'Bordeaux Supérieur for Summer',
+    ]
+
+    # Pages persist on disk across cache instances
+    with patch.object(requests.Session, 'get') as mock_get:
+        assert extract_wines('fakeurl', OrderLine(decimal.Decimal('236.34'), 6), pages=PageCache(tmp_path)) == wines
+    mock_get.assert_not_called()
+
+
+def test_tob_page_cache_skips_failed_prefetch(tmp_path):
+    '''
+    Test a failed prefetch isn't cached, leaving extract_wines to raise on the next fetch
+    '''
+    pages = PageCache(tmp_path)
+    with patch.object(pages.session, 'get', side_effect=requests.ConnectionError('down')):
+        pages.prefetch(['fakeurl'])
+
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_tob_page_cache_skips_non_product_page(tmp_path, http_response):
+    '''
+    Test a page served with a 200 but without the product description, like a bot-block page, isn't cached
+    '''
+    pages = PageCache(tmp_path)
+    with patch.object(pages.session, 'get', return_value=Mock(text='<html><h1>Under maintenance</h1></html>')):
+        assert 'maintenance' in pages.get('fakeurl')
+    assert list(tmp_path.iterdir()) == []
+
+    with patch.object(pages.session, 'get', return_value=Mock(text=http_response('tob_site_single_23025'))):
+        pages.get('fakeurl')
+    assert len(list(tmp_path.iterdir())) == 1
+
+
+def test_tob_page_cache_caps_concurrent_fetches(tmp_path):
+    '''
+    Test fetches across all threads sharing a PageCache are capped at its concurrency
+    '''
+    pages = PageCache(tmp_path, concurrency=2)
+    active, peak = 0, 0
+    lock = threading.Lock()
+
+    def get(url, timeout):
+        nonlocal active, peak
+        with lock:
+            active += 1
+            peak = max(peak, active)
+        time.sleep(0.01)
+        with lock:
+            active -= 1
+        return Mock(text='<div id="tab-description"></div>')
+
+    with patch.object(pages.session, 'get', side_effect=get), ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(pages.get, [f'url{i}' for i in range(8)]))
+
+    assert peak == 2
+
+
+def test_tob_page_cache_refetches_expired_page(tmp_path, http_response):
+    '''
+    Test cached pages older than max_age are refetched, and kept indefinitely without a max_age
+    '''
+    page = http_response('tob_site_single_23025')
+    path = PageCache(tmp_path)._cache_path('fakeurl')
+    path.write_text(page, encoding='utf8')
+    os.utime(path, (time.time() - 7200, time.time() - 7200))
+
+    pages = PageCache(tmp_path)
+    with patch.object(pages.session, 'get') as mock_get:
+        pages.get('fakeurl')
+    mock_get.assert_not_called()
+
+    pages = PageCache(tmp_path, max_age=datetime.timedelta(hours=1))
+    with patch.object(pages.session, 'get', return_value=Mock(text=page)) as mock_get:
+        pages.get('fakeurl')
+    mock_get.assert_called_once()
+
+
 @patch('informa.plugins.tob.extract_wines')
 def test_tob_parse_email_18260(mock_extract_wines, http_response):
     '''
@@ -372,3 +491,271 @@ def test_tob_merge_upstream_replaces_state_with_sheet_history():
     assert len(existing) == 1
     assert existing[0].number == 38048
     assert existing[0].wines[0].title == 'Château Rouzerol, Castillon Côtes-de-Bordeaux 2022.'
+
+
+
+def test_tob_merge_upstream_backfills_identifiers():
+    '''
+    Test identifiers missing from the sheet are generated, counting repeats of a tag within each order
+    '''
+    sheet = pd.DataFrame(
+        [
+            {'number': 2.0, 'wine.tag': 'Elegant Bordeaux', 'wine.identifier': float('nan')},
+            {'number': 1.0, 'wine.tag': 'Elegant Bordeaux', 'wine.identifier': 'kept'},
+            {'number': 2.0, 'wine.tag': 'Elegant Bordeaux', 'wine.identifier': 'provided'},
+            {'number': 2.0, 'wine.tag': float('nan'), 'wine.identifier': float('nan')},
+            {'number': float('nan')},
+        ]
+    ).assign(**{
+        'date': '2026-06-02',
+        'total': 100.0,
+        'discount': 0.0,
+        'wine.title': float('nan'),
+        'wine.url': float('nan'),
+        'wine.price': 34.95,
+        'wine.paid': float('nan'),
+        'wine.image_url': float('nan'),
+    })
+    orders = []
+
+    merge_upstream(sheet, orders)
+
+    assert [o.number for o in orders] == [2, 1]
+    assert [(w.index, w.identifier) for w in orders[0].wines] == [
+        (1, hashlib.sha256(b'2Elegant Bordeaux1').hexdigest()),
+        (2, 'provided'),
+        (1, hashlib.sha256(b'2None1').hexdigest()),
+    ]
+    assert [(w.index, w.identifier) for w in orders[1].wines] == [(None, 'kept')]
+    assert orders[0].wines[0].paid is None
+    assert orders[0].wines[0].price == decimal.Decimal('34.95')
+
+@pytest.fixture
+def spreadsheet(monkeypatch):
+    monkeypatch.setenv('GSUITE_OAUTH_CREDS', 'creds.json')
+    spreadsheet = MagicMock()
+    spreadsheet.get_lastUpdateTime.return_value = '2026-06-01T00:00:00.000Z'
+    with patch('gspread.service_account') as mock_service_account:
+        mock_service_account.return_value.open_by_key.return_value = spreadsheet
+        yield spreadsheet
+
+
+def _order(number: int) -> Order:
+    return Order(
+        number=number,
+        date=datetime.date(2026, 6, 4),
+        total=decimal.Decimal('29.95'),
+        discount=decimal.Decimal(0),
+        wines=[Wine(tag='Powerhouse Bordeaux', price=decimal.Decimal('45.95'), paid=decimal.Decimal('29.95'))],
+    )
+
+
+@patch('informa.plugins.tob.set_with_dataframe')
+@patch('informa.plugins.tob.get_as_dataframe')
+@patch('informa.plugins.tob.check_for_email', return_value=([], '200'))
+def test_tob_main_skips_unmodified_sheet(mock_check_for_email, mock_get_as_dataframe, mock_set_with_dataframe, spreadsheet):
+    '''
+    Test an unmodified sheet with no new order costs only the metadata call
+    '''
+    state = State(orders=[_order(1)], sheet_modified='2026-06-01T00:00:00.000Z')
+
+    assert main(state) == 0
+
+    mock_get_as_dataframe.assert_not_called()
+    mock_set_with_dataframe.assert_not_called()
+    spreadsheet.worksheet.return_value.append_rows.assert_not_called()
+    assert [o.number for o in state.orders] == [1]
+
+
+@patch('informa.plugins.tob.set_with_dataframe')
+@patch('informa.plugins.tob.get_as_dataframe', return_value=pd.DataFrame())
+@patch('informa.plugins.tob.check_for_email', return_value=([], '200'))
+def test_tob_main_reloads_modified_sheet(mock_check_for_email, mock_get_as_dataframe, mock_set_with_dataframe, spreadsheet):
+    '''
+    Test a sheet modified since the last sync replaces the order history in state
+    '''
+    state = State(orders=[_order(1)], sheet_modified='2026-05-01T00:00:00.000Z')
+
+    main(state)
+
+    mock_get_as_dataframe.assert_called_once()
+    assert state.orders == []
+    assert state.sheet_modified == '2026-06-01T00:00:00.000Z'
+
+
+@patch('informa.plugins.tob.set_with_dataframe')
+@patch('informa.plugins.tob.get_as_dataframe')
+@patch('informa.plugins.tob.parse_email', return_value=_order(2))
+@patch('informa.plugins.tob.check_for_email', return_value=([Mock()], '200'))
+def test_tob_main_appends_new_order(
+    mock_check_for_email, mock_parse_email, mock_get_as_dataframe, mock_set_with_dataframe, spreadsheet
+):
+    '''
+    Test a new order is appended to the sheet in one call, without rewriting the history
+    '''
+    state = State(orders=[_order(1)], sheet_modified='2026-06-01T00:00:00.000Z')
+    spreadsheet.get_lastUpdateTime.side_effect = ['2026-06-01T00:00:00.000Z', '2026-06-02T00:00:00.000Z']
+
+    assert main(state) == 1
+
+    mock_get_as_dataframe.assert_not_called()
+    mock_set_with_dataframe.assert_not_called()
+    spreadsheet.worksheet.return_value.append_rows.assert_called_once_with(
+        [['2', '2026-06-04', '29.95', '0', '', '', 'Powerhouse Bordeaux', '45.95', '29.95', '', '']],
+        value_input_option='USER_ENTERED',
+        table_range='A1',
+    )
+    assert [o.number for o in state.orders] == [1, 2]
+    assert state.sheet_modified == '2026-06-02T00:00:00.000Z'
+    assert state.history_id == '200'
+
+
+@patch('informa.plugins.tob.parse_email', return_value=None)
+@patch('informa.plugins.tob.check_for_email', return_value=([Mock()], '200'))
+def test_tob_main_keeps_history_id_until_emails_handled(mock_check_for_email, mock_parse_email, spreadsheet):
+    '''
+    Test the Gmail historyId isn't advanced past an email which failed to parse, so it's found again next run
+    '''
+    state = State(orders=[_order(1)], sheet_modified='2026-06-01T00:00:00.000Z', history_id='100')
+
+    assert main(state) == 0
+
+    mock_check_for_email.assert_called_once_with(history_id='100')
+    assert state.history_id == '100'
+
+
+def _email(message_id: str) -> Mock:
+    return Mock(id=message_id, html=message_id, date=datetime.datetime(2026, 6, 4, tzinfo=datetime.UTC))
+
+
+@patch('informa.plugins.tob.set_with_dataframe')
+@patch('informa.plugins.tob.get_as_dataframe')
+@patch('informa.plugins.tob.merge_upstream')
+@patch('informa.plugins.tob.get_gmail')
+@patch('informa.plugins.tob.parse_email', side_effect=lambda html, pages: None if html == 'c' else _order(int(html)))
+@patch('informa.plugins.tob.check_for_email')
+def test_tob_backfill_merges_orders_in_one_write(
+    mock_check_for_email,
+    mock_parse_email,
+    mock_get_gmail,
+    mock_merge_upstream,
+    mock_get_as_dataframe,
+    mock_set_with_dataframe,
+    spreadsheet,
+    monkeypatch,
+):
+    '''
+    Test backfill parses every email, skipping those parsed by an interrupted run, and writes the sheet once
+    '''
+    monkeypatch.setenv('LOCAL', '1')
+    emails = [_email('1'), _email('2'), _email('3'), _email('c')]
+    mock_check_for_email.return_value = (emails, '100')
+
+    # Order 1 is already in the sheet, and order 3 was parsed by an interrupted backfill
+    state = State(backfill={'3': _order(3)})
+    mock_merge_upstream.side_effect = lambda df, orders: orders.append(_order(1))
+    plugin = Mock(load_state=Mock(return_value=state))
+
+    backfill.callback(plugin, datetime.datetime(2024, 1, 1), 2)
+
+    mock_check_for_email.assert_called_once_with('after:2024/01/01')
+    mock_get_gmail.return_value.fetch.assert_called_once_with([emails[0], emails[1], emails[3]])
+    assert sorted(call.args[0] for call in mock_parse_email.call_args_list) == ['1', '2', 'c']
+
+    mock_set_with_dataframe.assert_called_once()
+    assert [o.number for o in state.orders] == [1, 2, 3]
+    assert state.backfill == {}
+    assert state.sheet_modified == '2026-06-01T00:00:00.000Z'
+
+
+@patch('informa.plugins.tob.open_sheet')
+@patch('informa.plugins.tob.get_gmail')
+@patch('informa.plugins.tob.parse_email', side_effect=[_order(1), KeyboardInterrupt])
+@patch('informa.plugins.tob.check_for_email', return_value=([_email('1'), _email('2')], '100'))
+def test_tob_backfill_saves_progress_on_interrupt(
+    mock_check_for_email, mock_parse_email, mock_get_gmail, mock_open_sheet, monkeypatch
+):
+    '''
+    Test orders parsed before an interrupt are saved to state, for the next backfill to resume from
+    '''
+    monkeypatch.setenv('LOCAL', '1')
+    state = State()
+    plugin = Mock(load_state=Mock(return_value=state))
+
+    with pytest.raises(KeyboardInterrupt):
+        backfill.callback(plugin, datetime.datetime(2024, 1, 1), 1)
+
+    assert list(state.backfill) == ['1']
+    plugin.write_state.assert_called_with(state)
+    mock_open_sheet.assert_not_called()
+
+
+@patch('informa.plugins.tob.open_sheet', return_value=None)
+@patch('informa.plugins.tob.get_gmail')
+@patch('informa.plugins.tob.parse_email', side_effect=[ValueError('bad email'), _order(2)])
+@patch('informa.plugins.tob.check_for_email', return_value=([_email('1'), _email('2')], '100'))
+def test_tob_backfill_records_failed_emails(
+    mock_check_for_email, mock_parse_email, mock_get_gmail, mock_open_sheet, monkeypatch
+):
+    '''
+    Test an email which raises is recorded as failed, and not parsed again when the backfill resumes
+    '''
+    monkeypatch.setenv('LOCAL', '1')
+    state = State()
+    plugin = Mock(load_state=Mock(return_value=state))
+
+    backfill.callback(plugin, datetime.datetime(2024, 1, 1), 1)
+
+    assert state.backfill_failed == ['1']
+    assert list(state.backfill) == ['2']
+
+    backfill.callback(plugin, datetime.datetime(2024, 1, 1), 1)
+    assert mock_parse_email.call_count == 2
+
+
+@patch('informa.plugins.tob.set_with_dataframe')
+@patch('informa.plugins.tob.get_as_dataframe')
+@patch('informa.plugins.tob.merge_upstream')
+@patch('informa.plugins.tob.get_gmail')
+@patch('informa.plugins.tob.parse_email', side_effect=lambda html, pages: _order(int(html)))
+@patch('informa.plugins.tob.check_for_email', return_value=([_email('2')], '100'))
+def test_tob_backfill_merges_into_latest_state(
+    mock_check_for_email,
+    mock_parse_email,
+    mock_get_gmail,
+    mock_merge_upstream,
+    mock_get_as_dataframe,
+    mock_set_with_dataframe,
+    spreadsheet,
+    monkeypatch,
+):
+    '''
+    Test orders added by a scheduled run during the backfill are kept in the final write
+    '''
+    monkeypatch.setenv('LOCAL', '1')
+
+    # The scheduled run adds order 5 while the backfill is parsing
+    latest = State(orders=[_order(5)], history_id='200')
+    plugin = Mock(load_state=Mock(side_effect=[State(), State(), latest]))
+
+    backfill.callback(plugin, datetime.datetime(2024, 1, 1), 1)
+
+    state = plugin.write_state.call_args.args[0]
+    assert state is latest
+    assert [o.number for o in state.orders] == [5, 2]
+    assert state.history_id == '200'
+
+
+@patch('informa.plugins.tob.check_for_email')
+def test_tob_backfill_requires_local(mock_check_for_email, monkeypatch, capsys):
+    '''
+    Test backfill refuses to run on the server, where its output and runtime exceed the CLI request
+    '''
+    monkeypatch.delenv('LOCAL', raising=False)
+    plugin = Mock()
+
+    backfill.callback(plugin, datetime.datetime(2024, 1, 1), 1)
+
+    assert 'LOCAL=1' in capsys.readouterr().out
+    plugin.load_state.assert_not_called()
+    mock_check_for_email.assert_not_called()
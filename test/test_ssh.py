@@ -0,0 +1,95 @@
+import io
+import logging
+import threading
+from unittest.mock import MagicMock, Mock, patch
+
+from informa.lib.ssh import SSHPool, run_background, stream_command
+
+logger = logging.getLogger('informa')
+
+
+@patch('informa.lib.ssh.paramiko.client.SSHClient')
+def test_pool_reuses_live_connection(mock_client):
+    '''
+    Ensure a live pooled connection is reused, and a dead one replaced
+    '''
+    pool = SSHPool()
+
+    client = pool.get('jorg', 'mafro')
+    assert pool.get('jorg', 'mafro') is client
+    mock_client.return_value.connect.assert_called_once()
+    client.get_transport.return_value.set_keepalive.assert_called_once_with(pool.keepalive)
+
+    client.get_transport.return_value.is_active.return_value = False
+    pool.get('jorg', 'mafro')
+    assert mock_client.return_value.connect.call_count == 2
+
+
+def _mock_client(output: str | bytes, exit_status: int = 0) -> Mock:
+    channel = MagicMock()
+    channel.makefile.return_value = io.BytesIO(output.encode() if isinstance(output, str) else output)
+    channel.recv_exit_status.return_value = exit_status
+
+    client = Mock()
+    client.get_transport.return_value.open_session.return_value = channel
+    return client
+
+
+def test_stream_command_yields_lines():
+    '''
+    Ensure remote output is passed on line by line, with the exit status returned
+    '''
+    lines = []
+    client = _mock_client('Downloading\nDownloaded thing\nCount 3\n', exit_status=2)
+
+    assert stream_command(client, 'megadlz', lines.append) == 2
+    assert lines == ['Downloading', 'Downloaded thing', 'Count 3']
+    client.get_transport.return_value.open_session.return_value.exec_command.assert_called_once_with('megadlz')
+
+
+def test_stream_command_replaces_undecodable_bytes():
+    '''
+    Ensure output which isn't valid UTF-8 is passed on with replacement characters, rather than ending the stream
+    '''
+    lines = []
+
+    assert stream_command(_mock_client(b'caf\xe9\nCount 3\n'), 'megadlz', lines.append) == 0
+    assert lines == ['caf\ufffd', 'Count 3']
+
+
+def test_run_background_tracks_job():
+    '''
+    Ensure a background job records its output and completion
+    '''
+    done = threading.Event()
+    job = run_background(logger, lambda: _mock_client('one\ntwo\n'), 'megadlz', on_complete=lambda _: done.set())
+
+    assert done.wait(timeout=5)
+    assert job.started is not None
+    assert job.exit_status == 0
+    assert list(job.output) == ['one', 'two']
+
+
+def test_run_background_records_connect_failure():
+    '''
+    Ensure a failed SSH connection finishes the job with an error
+    '''
+    done = threading.Event()
+    job = run_background(logger, Mock(side_effect=OSError('No route to host')), 'megadlz', lambda _: done.set())
+
+    assert done.wait(timeout=5)
+    assert job.exit_status is None
+    assert job.error == 'No route to host'
+
+
+@patch('informa.lib.ssh.stream_command', side_effect=UnicodeDecodeError('utf-8', b'\xe9', 0, 1, 'invalid'))
+def test_run_background_finishes_job_on_unexpected_error(mock_stream_command):
+    '''
+    Ensure any exception while running the command still finishes the job, with the error recorded
+    '''
+    done = threading.Event()
+    job = run_background(logger, Mock(), 'megadlz', lambda _: done.set())
+
+    assert done.wait(timeout=5)
+    assert job.running is False
+    assert job.error.startswith('UnicodeDecodeError')
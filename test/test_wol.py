@@ -0,0 +1,57 @@
+import asyncio
+import logging
+from unittest.mock import MagicMock, patch
+
+from informa.lib.wol import ensure_awake, ensure_awake_async
+
+logger = logging.getLogger('informa')
+
+
+@patch('informa.lib.wol.requests.get')
+@patch('informa.lib.wol.is_port_open', return_value=True)
+def test_ensure_awake_host_already_up(mock_port_open, mock_requests_get):
+    '''
+    Ensure no WOL packet is sent when the host is already accepting connections
+    '''
+    assert ensure_awake(logger, 'jorg', 22, 'aa:bb') is True
+    mock_requests_get.assert_not_called()
+
+
+@patch('informa.lib.wol.time.sleep')
+@patch('informa.lib.wol.requests.get')
+@patch('informa.lib.wol.is_port_open', side_effect=[False, False, False, True])
+def test_ensure_awake_polls_with_backoff(mock_port_open, mock_requests_get, mock_sleep):
+    '''
+    Ensure WOL is sent and readiness is polled with exponential backoff
+    '''
+    assert ensure_awake(logger, 'jorg', 22, 'aa:bb') is True
+
+    mock_requests_get.assert_called_once()
+    assert mock_requests_get.call_args.args[0].endswith('/wake/aa:bb')
+    assert [c.args[0] for c in mock_sleep.call_args_list] == [1, 2, 4]
+
+
+@patch('informa.lib.wol.time.monotonic')
+@patch('informa.lib.wol.time.sleep')
+@patch('informa.lib.wol.requests.get', return_value=MagicMock())
+@patch('informa.lib.wol.is_port_open', return_value=False)
+def test_ensure_awake_deadline_exceeded(mock_port_open, mock_requests_get, mock_sleep, mock_monotonic):
+    '''
+    Ensure False is returned when the host does not wake before the deadline
+    '''
+    mock_monotonic.side_effect = [0, 0, 5, 11, 11]
+
+    assert ensure_awake(logger, 'jorg', 22, 'aa:bb', deadline=10) is False
+
+
+@patch('informa.lib.wol.asyncio.sleep')
+@patch('informa.lib.wol.requests.get')
+@patch('informa.lib.wol.is_port_open', side_effect=[False, False, False, True])
+def test_ensure_awake_async_polls_without_blocking(mock_port_open, mock_requests_get, mock_sleep):
+    '''
+    Ensure the async variant sends WOL and polls with the same backoff, sleeping on the event loop
+    '''
+    assert asyncio.run(ensure_awake_async(logger, 'jorg', 22, 'aa:bb')) is True
+
+    mock_requests_get.assert_called_once()
+    assert [c.args[0] for c in mock_sleep.await_args_list] == [1, 2, 4]